@@ -4,13 +4,21 @@ import json
 import time
 import re
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import tkinter as tk
 from tkinter import scrolledtext, ttk
 import sys
 from bs4 import BeautifulSoup
-import difflib
 import random
+import math
+import hashlib
+from datetime import datetime
+
+import image_store
+import resolver
+import title_match
+import work_queue
 
 
 # ============================
@@ -28,6 +36,7 @@ MAX_WORKERS = 1  # 降低并发数以避免触发 MTime 限流
 MODE = "zh_movies"  # ★ 按你选择：只抓中文电影
 
 POPULAR_MAX_PAGES = 500
+POPULAR_PREFETCH_MOVIES = 60  # 热门模式预取的电影数上限（约 3 页）
 CHINESE_MAX_PAGES = 500  # 中文电影最多抓多少页
 
 BASE_URL = "https://api.themoviedb.org/3"
@@ -51,6 +60,65 @@ else:
 RECORD_FILE = os.path.join(BASE_DIR, "downloaded.json")
 FAILED_FILE = os.path.join(BASE_DIR, "failed_downloads.json")  # 失败记录文件
 
+# 待下载电影列表：追加写的 JSON Lines 日志 + 每行一个 id 的索引
+MOVIES_LIST_FILE = os.path.join(BASE_DIR, "movies_to_download.jsonl")
+MOVIES_INDEX_FILE = os.path.join(BASE_DIR, "movies_to_download.ids")
+LEGACY_MOVIES_LIST_FILE = os.path.join(BASE_DIR, "movies_to_download.json")  # 旧格式，首次运行时迁移
+
+# 待下载电影优先级队列：队列每轮从电影列表重建，只持久化按年份的命中率统计（跨会话保留）
+PRIORITY_FILE = os.path.join(BASE_DIR, "pending_priority.json")
+PRIORITY_WEIGHTS = {
+    "year": 1.0,  # 上映年份是否在窗口内
+    "popularity": 1.0,  # TMDB popularity
+    "votes": 1.0,  # TMDB vote_count
+    "hit_rate": 2.0,  # 同年份电影历史 MTime 匹配命中率
+}
+PRIORITY_YEAR_WINDOW = 30  # 近多少年内的电影拿满年份分
+# 旧版列表迁移来的电影没有 popularity / vote_count，按中等热度算，不至于永远排在最后
+PRIORITY_LEGACY_DEFAULTS = {"popularity": 10.0, "vote_count": 100}
+PRIORITY_DEFER_UNRELEASED = True  # 未上映电影本轮跳过，留在队列里下次再看
+MTIME_CYCLE_BUDGET = 200  # 每轮最多处理多少部电影（≈ MTime 搜索请求预算）
+
+# TMDB id → MTime movieId 映射（存在 resolver 的共享 title_ids.json 里），命中时跳过 unionSearch2 搜索
+# 未匹配电影的负缓存同样由 resolver 管理（按指数间隔重新搜索，见 resolver.NEGATIVE_*）
+MTIME_ID_MAP_TTL_DAYS = 0  # 超过多少天的映射重新搜索校验，0 表示永不过期（每部电影只搜一次）
+MTIME_ID_REVALIDATE = False  # True 时忽略缓存，全部重新搜索
+
+# 搜索：中英文名并发（推测执行），任一路分数达到接受线即取消另一路
+MTIME_SPECULATIVE_SEARCH = True
+MTIME_ACCEPT_SCORE = 0.6  # 达到此分不再等另一路结果
+MTIME_SEARCH_RATE = 2.0  # unionSearch2 每秒最多请求数
+MTIME_SEARCH_BURST = 2  # 允许的突发请求数（中英文同时发出）
+
+# 三段流水线：搜索匹配 → image.api 拉列表 → 下载图片，段间用有界队列连接
+MTIME_PIPELINE = True
+MTIME_PIPELINE_MOVIE_QUEUE = 4  # 已匹配、等待拉列表的电影上限
+MTIME_PIPELINE_JOB_QUEUE = 40  # 等待下载的图片上限
+MTIME_IMAGE_API_RATE = 1 / 4.0  # image.api 每秒请求数（≈ 旧逻辑搜索后 3~6s 的等待）
+MTIME_DOWNLOAD_RATE = 1 / 5.0  # 图片下载每秒请求数（另加 0~3s 随机抖动，≈ 旧逻辑 5~8s）
+
+# MTime 图片类型策略：priority 越小越先下；cap 为每部电影该类型最多几张（0 不限）
+MTIME_TYPE_NAMES = {
+    1: "海报",
+    6: "剧照",
+}
+MTIME_TYPE_POLICY = {
+    6: {"priority": 0, "cap": 0},  # 剧照优先、全要
+    1: {"priority": 1, "cap": 10},  # 海报其次
+}
+MTIME_DEFAULT_TYPE_POLICY = {"priority": 9, "cap": 20}  # 其它类型
+MTIME_EXCLUDED_TYPES = set()  # 完全不下载的类型
+# 两遍调度：第一遍只下 priority <= MTIME_FIRST_PASS_MAX_PRIORITY 的类型，覆盖整个待下载列表后，
+# 第二遍再回头补其余类型（记录在 record["mtime_pass"]：1=还有类型待补，2=全部完成）
+MTIME_TWO_PASS = True
+MTIME_FIRST_PASS_MAX_PRIORITY = 0
+
+# image.api 列表指纹（按 MTime movieId 记图片数 + 图片 id 哈希），列表没变的电影不再逐张比对
+MTIME_FINGERPRINT_FILE = os.path.join(BASE_DIR, "mtime_fingerprints.json")
+# 定期回扫已完成的电影，看有没有新剧照
+MTIME_RESWEEP_DAYS = 30  # 距上次检查超过多少天的电影参与回扫，0 表示不回扫
+MTIME_RESWEEP_BUDGET = 100  # 每轮最多回扫多少部（每部一次 image.api）
+
 
 # ============================
 # 全局状态 & 统计
@@ -62,6 +130,7 @@ record_lock = threading.Lock()
 session_new_movies = []  # 本次新增电影列表
 session_new_images = 0  # 本次新增图片总数
 session_movie_new_images = {}  # 每部电影新增图片数（目前未用到，但保留）
+session_lock = threading.Lock()  # 多个下载线程同时累加 session_movie_new_images
 
 pause_requested = False
 is_downloading = False
@@ -103,6 +172,14 @@ CONSECUTIVE_FAIL_THRESHOLD = 5  # 连续失败多少次触发自动暂停
 AUTO_PAUSE_DURATION = 3600  # 自动暂停时长（秒），60分钟
 last_success_time = None  # 上次成功时间
 
+# 失败重试：每个失败项自带退避时间表，后台重试引擎只取到期的项，和正常下载共用限速器
+RETRY_BASE_DELAY = 600  # 第一次失败后多久可重试（秒）
+RETRY_MAX_DELAY = 86400  # 退避上限（秒）
+RETRY_ENGINE_ENABLED = True  # 下载期间在后台自动重试到期的失败项
+RETRY_ENGINE_POLL = 60  # 后台引擎每隔多少秒看一次有没有到期的项
+RETRY_ENGINE_BATCH = 5  # 每次最多重试几项（其余留给正常下载用限速额度）
+RETRY_ENGINE_JOIN_TIMEOUT = 30  # 停止时最多等后台引擎手上这一张下完多少秒
+
 # ============================
 # GUI
 # ============================
@@ -337,14 +414,40 @@ def clean_filename(name: str) -> str:
 
 
 def normalize_title(s: str) -> str:
-    if not s:
-        return ""
-    s = s.strip()
-    # 去掉括号里的年份等
-    s = re.split(r"[（）()]", s)[0]
-    # 全部小写，去掉空格
-    s = s.lower().replace(" ", "")
-    return s
+    return title_match.normalize_title(s)
+
+
+class RateLimiter:
+    """令牌桶限速：rate 为每秒补充的令牌数，burst 为桶容量"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cancel=None) -> bool:
+        """拿到令牌返回 True；等待期间 cancel 被设置则返回 False"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if cancel is not None:
+                if cancel.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+search_limiter = RateLimiter(MTIME_SEARCH_RATE, MTIME_SEARCH_BURST)
+image_api_limiter = RateLimiter(MTIME_IMAGE_API_RATE)
+download_limiter = RateLimiter(MTIME_DOWNLOAD_RATE)
 
 
 def safe_get(url, params=None, stream=False):
@@ -399,6 +502,9 @@ def load_record():
     return {"movie_ids": [], "images": {}}
 
 
+failed_lock = threading.Lock()
+
+
 def load_failed_record():
     """加载失败记录"""
     if os.path.exists(FAILED_FILE):
@@ -407,39 +513,118 @@ def load_failed_record():
                 return json.load(f)
         except Exception:
             log("⚠ 失败记录文件损坏，将重建")
-    return []  # [{"url": ..., "save_path": ..., "movie_id_str": ..., "remote_key": ..., "movie_title": ...}, ...]
+    # [{"url", "save_path", "movie_id_str", "remote_key", "movie_title",
+    #   "attempts", "last_error", "last_failed", "next_eligible"}, ...]
+    return []
 
 
 def save_failed_record(failed_list):
     """保存失败记录"""
     try:
-        with open(FAILED_FILE, "w", encoding="utf-8") as f:
+        tmp = FAILED_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(failed_list, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, FAILED_FILE)
     except Exception as e:
         log(f"⚠ 保存失败记录出错：{e}")
 
 
-def add_failed_item(job, movie_title=""):
-    """添加一个失败项到失败记录"""
-    failed_list = load_failed_record()
-    # 避免重复添加
-    existing_keys = {item.get("remote_key") for item in failed_list}
-    if job["remote_key"] not in existing_keys:
-        failed_list.append({
-            "url": job["url"],
-            "save_path": job["save_path"],
-            "movie_id_str": job["movie_id_str"],
-            "remote_key": job["remote_key"],
-            "movie_title": movie_title
-        })
+def retry_delay(attempts):
+    """第 attempts 次失败后的退避时间：指数增长 + 10% 抖动，封顶 RETRY_MAX_DELAY"""
+    delay = min(RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0), RETRY_MAX_DELAY)
+    return delay * random.uniform(1.0, 1.1)
+
+
+def add_failed_item(job, movie_title="", error=None):
+    """添加一个失败项到失败记录；已存在的项累加尝试次数并顺延下次可重试时间"""
+    now = int(time.time())
+    with failed_lock:
+        failed_list = load_failed_record()
+        item = next((x for x in failed_list if x.get("remote_key") == job["remote_key"]), None)
+        if item is None:
+            item = {
+                "url": job["url"],
+                "save_path": job["save_path"],
+                "movie_id_str": job["movie_id_str"],
+                "remote_key": job["remote_key"],
+                "movie_title": movie_title,
+            }
+            failed_list.append(item)
+        item["attempts"] = item.get("attempts", 0) + 1
+        item["last_error"] = type(error).__name__ if error is not None else ""
+        item["last_failed"] = now
+        item["next_eligible"] = now + int(retry_delay(item["attempts"]))
         save_failed_record(failed_list)
 
 
 def remove_failed_item(remote_key):
     """从失败记录中移除成功下载的项"""
-    failed_list = load_failed_record()
-    failed_list = [item for item in failed_list if item.get("remote_key") != remote_key]
-    save_failed_record(failed_list)
+    with failed_lock:
+        failed_list = load_failed_record()
+        kept = [item for item in failed_list if item.get("remote_key") != remote_key]
+        if len(kept) != len(failed_list):
+            save_failed_record(kept)
+
+
+def forget_mtime_image(mid_str, remote_key, url="", save_path="", movie_title=""):
+    """
+    完整性校验发现坏图：从记录里去掉并重新排队
+    知道原始 URL 时放进失败重试队列；不知道时让整部电影回到待下载列表（见 forget_mtime_images）
+    """
+    global record
+    if not url:
+        forget_mtime_images(mid_str, [remote_key])
+        return
+
+    with record_lock:
+        if record is None:
+            record = load_record()
+        keys = record["images"].get(mid_str, [])
+        if remote_key in keys:
+            keys.remove(remote_key)
+    save_record_safe()
+
+    add_failed_item(
+        {"url": url, "save_path": save_path, "movie_id_str": mid_str, "remote_key": remote_key},
+        movie_title,
+        ValueError("corrupt image"),
+    )
+
+
+def forget_mtime_images(mid_str, remote_keys, save=True):
+    """
+    不知道原始 URL 的坏图 / 丢图：从记录里去掉，整部电影回到待下载列表（清掉列表指纹，下次逐张比对）
+    save=False 时由调用方最后统一 save_record_safe()
+    """
+    global record
+    drop = set(remote_keys)
+    with record_lock:
+        if record is None:
+            record = load_record()
+        keys = record["images"].get(mid_str, [])
+        keys[:] = [k for k in keys if k not in drop]
+        movie_id = int(mid_str)
+        if movie_id in record["movie_ids"]:
+            record["movie_ids"].remove(movie_id)
+        record.get("mtime_pass", {}).pop(mid_str, None)
+    if save:
+        save_record_safe()
+
+    mtime_id = resolver.get_cached_id("mtime", mid_str)
+    if mtime_id:
+        forget_mtime_fingerprint(mtime_id)
+
+
+def _on_write_failed(result, error):
+    """后台写盘失败：从记录里去掉，放进失败重试队列"""
+    if result.get("source") == "mtime" and result.get("movie_id") and result.get("key"):
+        path = result["path"]
+        forget_mtime_image(
+            str(result["movie_id"]), result["key"], result.get("url", ""), path, image_store.movie_folder(path)
+        )
+
+
+image_store.add_failure_listener(_on_write_failed)
 
 
 def get_pending_retry_count():
@@ -448,6 +633,248 @@ def get_pending_retry_count():
     return len(failed_list)
 
 
+def take_eligible_failed_items(limit=None, force=False):
+    """到期可重试的失败项，最早到期的在前；force=True 时忽略时间表（手动重试）"""
+    now = time.time()
+    with failed_lock:
+        failed_list = load_failed_record()
+    with record_lock:
+        images = record["images"] if record else {}
+        items = [
+            item
+            for item in failed_list
+            if (force or item.get("next_eligible", 0) <= now)
+            and item.get("remote_key") not in images.get(item.get("movie_id_str"), ())
+        ]
+    items.sort(key=lambda item: item.get("next_eligible", 0))
+    return items[:limit] if limit else items
+
+
+# ============================
+# 待下载电影列表（JSON Lines）
+# ============================
+
+
+def migrate_legacy_movie_list():
+    """旧版 movies_to_download.json（整表 JSON）→ JSONL + id 索引，只执行一次"""
+    if os.path.exists(MOVIES_LIST_FILE) or not os.path.exists(LEGACY_MOVIES_LIST_FILE):
+        return
+
+    try:
+        with open(LEGACY_MOVIES_LIST_FILE, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+    except Exception as e:
+        log(f"⚠ 旧电影列表读取失败，跳过迁移：{e}", category="refresh")
+        return
+
+    tmp_list = MOVIES_LIST_FILE + ".tmp"
+    tmp_index = MOVIES_INDEX_FILE + ".tmp"
+    seen = set()
+    with open(tmp_list, "w", encoding="utf-8") as fl, open(tmp_index, "w", encoding="utf-8") as fi:
+        for m in legacy:
+            if m["id"] in seen:
+                continue
+            seen.add(m["id"])
+            for k, v in PRIORITY_LEGACY_DEFAULTS.items():
+                m.setdefault(k, v)
+            fl.write(json.dumps(m, ensure_ascii=False) + "\n")
+            fi.write(f"{m['id']}\n")
+    os.replace(tmp_index, MOVIES_INDEX_FILE)
+    os.replace(tmp_list, MOVIES_LIST_FILE)
+    log(f"📦 电影列表已迁移为 JSONL：{len(seen)} 部", category="refresh")
+
+
+def load_movie_list_ids():
+    """只读小索引文件拿到已收录的 id；索引缺失时从 JSONL 重建"""
+    ids = set()
+    if os.path.exists(MOVIES_INDEX_FILE):
+        with open(MOVIES_INDEX_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    ids.add(int(line))
+        return ids
+
+    if not os.path.exists(MOVIES_LIST_FILE):
+        return ids
+
+    for m in iter_movie_list():
+        ids.add(m["id"])
+    with open(MOVIES_INDEX_FILE, "w", encoding="utf-8") as f:
+        for movie_id in ids:
+            f.write(f"{movie_id}\n")
+    return ids
+
+
+def append_movies_to_list(movies):
+    """
+    把新电影追加到列表末尾（先写数据，再写索引）
+    两次写之间崩溃时索引缺这几部，下次刷新会重复追加；读取端 iter_movie_list 按 id 去重。
+    反过来先写索引的话，崩溃会让电影只在索引里、永远不会再加进列表
+    """
+    if not movies:
+        return
+    with list_file_lock:
+        with open(MOVIES_LIST_FILE, "a", encoding="utf-8") as f:
+            for m in movies:
+                f.write(json.dumps(m, ensure_ascii=False) + "\n")
+        with open(MOVIES_INDEX_FILE, "a", encoding="utf-8") as f:
+            for m in movies:
+                f.write(f"{m['id']}\n")
+
+
+def iter_movie_list():
+    """
+    逐行读取电影列表，不把整个列表放进内存；跳过写了一半的坏行
+    同一 id 只取第一次出现的那行：数据写完、索引没写完就崩溃时，下次刷新会把这几部再追加一遍
+    """
+    if not os.path.exists(MOVIES_LIST_FILE):
+        return
+    seen = set()
+    with open(MOVIES_LIST_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                m = json.loads(line)
+            except ValueError:
+                continue
+            if m.get("id") in seen:
+                continue
+            seen.add(m.get("id"))
+            yield m
+
+
+# ============================
+# 待下载电影优先级队列
+# ============================
+
+priority_state = None  # {"items": {id: movie}（只在内存里）, "stats": {year: [命中, 尝试]}}
+priority_lock = threading.Lock()
+
+
+def load_priority_state():
+    global priority_state
+    state = {"items": {}, "stats": {}}
+    if os.path.exists(PRIORITY_FILE):
+        try:
+            with open(PRIORITY_FILE, "r", encoding="utf-8") as f:
+                # 旧版文件里还存着整份队列（"items"），直接丢掉，队列由 sync_priority_queue 从列表重建
+                state["stats"] = json.load(f).get("stats", {})
+        except Exception:
+            log("⚠ 优先级队列文件损坏，将重建", category="refresh")
+    priority_state = state
+    return state
+
+
+def save_priority_state():
+    """只写按年份的命中率统计（几十行），每部电影处理完调用也不贵"""
+    if priority_state is None:
+        return
+    with priority_lock:
+        try:
+            tmp = PRIORITY_FILE + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"stats": priority_state["stats"]}, f, ensure_ascii=False)
+            os.replace(tmp, PRIORITY_FILE)
+        except Exception as e:
+            log(f"⚠ 保存优先级队列出错：{e}", category="refresh")
+
+
+def is_unreleased(movie) -> bool:
+    release_date = movie.get("release_date") or ""
+    if release_date:
+        return release_date > datetime.now().strftime("%Y-%m-%d")
+    try:
+        return int(movie.get("year") or 0) > datetime.now().year
+    except ValueError:
+        return False
+
+
+def movie_hit_rate(movie) -> float:
+    hits, tries = priority_state["stats"].get(str(movie.get("year") or ""), [0, 0])
+    # 拉普拉斯平滑，没有历史时按 0.5 算
+    return (hits + 1) / (tries + 2)
+
+
+def score_pending_movie(movie) -> float:
+    w = PRIORITY_WEIGHTS
+    score = 0.0
+
+    try:
+        year = int(movie.get("year") or 0)
+    except ValueError:
+        year = 0
+    if year:
+        age = datetime.now().year - year
+        score += w["year"] * (1.0 if 0 <= age <= PRIORITY_YEAR_WINDOW else 0.3)
+
+    popularity = float(movie.get("popularity", PRIORITY_LEGACY_DEFAULTS["popularity"]) or 0)
+    score += w["popularity"] * min(1.0, math.log1p(popularity) / math.log1p(100))
+
+    votes = float(movie.get("vote_count", PRIORITY_LEGACY_DEFAULTS["vote_count"]) or 0)
+    score += w["votes"] * min(1.0, math.log1p(votes) / math.log1p(1000))
+
+    score += w["hit_rate"] * movie_hit_rate(movie)
+    return score
+
+
+def sync_priority_queue(movie_iter, downloaded_ids):
+    """把列表里新出现的待下载电影加入队列，移除已归档的"""
+    with priority_lock:
+        items = priority_state["items"]
+        for key in [k for k in items if int(k) in downloaded_ids]:
+            del items[key]
+        for m in movie_iter:
+            if m["id"] in downloaded_ids:
+                continue
+            items.setdefault(str(m["id"]), m)
+        return len(items)
+
+
+def take_priority_batch(budget):
+    """按分数从高到低取出本轮要处理的电影（未上映的留到以后）"""
+    with priority_lock:
+        movies = list(priority_state["items"].values())
+        scored = []
+        deferred = 0
+        for m in movies:
+            if PRIORITY_DEFER_UNRELEASED and is_unreleased(m):
+                deferred += 1
+                continue
+            if is_mtime_search_deferred(m["id"]):
+                # 负缓存中的电影不占本轮预算
+                continue
+            scored.append((score_pending_movie(m), m))
+
+    scored.sort(key=lambda x: x[0], reverse=True)
+    if deferred:
+        log(f"⏭ 未上映电影 {deferred} 部，本轮跳过", category="refresh")
+    return [m for _score, m in scored[:budget]]
+
+
+# 匹配到了 MTime id 的状态（不管后面图片下没下完）：prepare_mtime_movie 的 "matched"，
+# 以及 try_download_mtime_images 匹配之后的 "done" / "api_failed" / "paused"
+MTIME_HIT_STATUSES = ("matched", "done", "api_failed", "paused")
+
+
+def is_mtime_hit(status) -> bool:
+    """命中率统计用的唯一判定，串行和流水线两条路径共用"""
+    return status in MTIME_HIT_STATUSES
+
+
+def record_priority_result(movie, hit):
+    """记录一次 MTime 匹配结果，更新命中率并把电影移出队列"""
+    with priority_lock:
+        year_key = str(movie.get("year") or "")
+        stat = priority_state["stats"].setdefault(year_key, [0, 0])
+        stat[1] += 1
+        if hit:
+            stat[0] += 1
+        priority_state["items"].pop(str(movie["id"]), None)
+
+
 def save_record_safe():
     if record is None:
         return
@@ -492,115 +919,150 @@ def download_movie_images(movie_id, title):
 # ============================
 
 
-def search_mtime_movie(title_cn: str, title_en: str, year: str):
+def mtime_search_candidates(q: str, cancel=None):
     """
-    使用 front-gateway.mtime.com 的 unionSearch2 接口搜索电影
+    调一次 unionSearch2，返回原始候选列表 [{"movieId", "name", "nameEn", "year"}, ...]
+    请求失败（网络/超时/HTTP 错误/非 JSON）返回 None，与没有结果的 [] 区分开
+    cancel 被设置时（另一路已经匹配成功）直接放弃，不再发请求
     """
-    best_mid = None
-    best_score = 0.0
-
-    def parse_search_page(q: str):
-        nonlocal best_mid, best_score
+    if not q:
+        return []
+    if not search_limiter.acquire(cancel):
+        return []
 
-        if not q:
-            return
+    log(f"  🔍 MTime 搜索：{q}", category="mtime")
+    url = "https://front-gateway.mtime.com/mtime-search/search/unionSearch2"
+    params = {"keyword": q, "pageIndex": 1, "pageSize": 20, "searchType": 0}
 
-        log(f"  🔍 MTime 搜索：{q}", category="mtime")
-        url = "https://front-gateway.mtime.com/mtime-search/search/unionSearch2"
-        params = {"keyword": q, "pageIndex": 1, "pageSize": 20, "searchType": 0}
-
-        try:
-            resp = requests.get(url, headers=HEADERS, params=params, timeout=20)
-        except Exception as e:
-            log(f"  ⚠ MTime 搜索失败：{e}", category="mtime")
-            return
-
-        if resp.status_code != 200:
-            log(f"  ⚠ MTime 搜索 HTTP {resp.status_code}", category="mtime")
-            return
+    try:
+        resp = requests.get(url, headers=HEADERS, params=params, timeout=20)
+    except Exception as e:
+        log(f"  ⚠ MTime 搜索失败：{e}", category="mtime")
+        return None
 
-        try:
-            data = resp.json()
-        except Exception as e:
-            log(f"  ⚠ MTime 响应非 JSON：{e}", category="mtime")
-            return
+    if resp.status_code != 200:
+        log(f"  ⚠ MTime 搜索 HTTP {resp.status_code}", category="mtime")
+        return None
 
-        movies = data.get("data", {}).get("movies", [])
-        if not movies:
-            return
+    try:
+        data = resp.json()
+    except Exception as e:
+        log(f"  ⚠ MTime 响应非 JSON：{e}", category="mtime")
+        return None
 
-        for m in movies:
-            mid = m.get("movieId")
-            if not mid:
-                continue
+    return data.get("data", {}).get("movies", []) or []
 
-            name_cn = m.get("name", "")
-            name_en = m.get("nameEn", "")
-            year_str = str(m.get("year", ""))  # API returns year as string or int?
 
-            # 优先匹配中文名
-            target = title_cn or title_en or ""
-            if not target:
-                continue
+def search_mtime_movie_detail(title_cn: str, title_en: str, year: str, movie_id=None):
+    """
+    使用 front-gateway.mtime.com 的 unionSearch2 接口搜索电影，用共享打分器选最佳候选
+    传入 TMDB movie_id 时，目标片名直接取本地片名索引里预处理好的片名和别名
+    返回 {"id", "score", "query", "best_id", "best_title"}，未达阈值时 id 为 None
+    """
+    movie = {"id": movie_id, "title_cn": title_cn, "title_en": title_en, "year": year}
+    detail = resolver.empty_detail()
 
-            # 尝试匹配中文名
-            score_cn = 0.0
-            if name_cn:
-                n1 = normalize_title(name_cn)
-                n2 = normalize_title(target)
-                if n1 and n2:
-                    score_cn = difflib.SequenceMatcher(None, n1, n2).ratio()
-
-            # 尝试匹配英文名
-            score_en = 0.0
-            if name_en:
-                n1 = normalize_title(name_en)
-                n2 = normalize_title(target)
-                if n1 and n2:
-                    score_en = difflib.SequenceMatcher(None, n1, n2).ratio()
-
-            ratio = max(score_cn, score_en)
-
-            # 年份校验
-            year_penalty = 0.0
-            if year and year_str:
+    def merge(q, movies):
+        if movies is None:
+            resolver.merge_candidates(detail, movie, q, None)
+            return
+        cands = [
+            {
+                "id": m.get("movieId"),
+                "titles": [m.get("name", ""), m.get("nameEn", "")],
+                "year": str(m.get("year", "")),  # API returns year as string or int?
+            }
+            for m in movies
+            if m.get("movieId")
+        ]
+        resolver.merge_candidates(detail, movie, q, cands)
+
+    queries = resolver.movie_titles(movie)
+
+    if MTIME_SPECULATIVE_SEARCH and len(queries) > 1:
+        # 推测执行：中英文同时搜，任一路结果过了接受线就取消另一路
+        cancel = threading.Event()
+        ex = ThreadPoolExecutor(max_workers=len(queries))
+        futures = {ex.submit(mtime_search_candidates, q, cancel): q for q in queries}
+        try:
+            for fut in as_completed(futures):
                 try:
-                    y1 = int(year)
-                    y2 = int(year_str)
-                    if abs(y1 - y2) > 2:
-                        year_penalty = 0.15
-                except ValueError:
-                    pass
-
-            score = ratio - year_penalty
-
-            if score > best_score:
-                best_score = score
-                best_mid = mid
-
-    # 优先用中文名
-    if title_cn:
-        parse_search_page(title_cn)
-        time.sleep(0.5)
-
-    # 不够好/没找到，再用英文名
-    if (best_mid is None or best_score < 0.6) and title_en:
-        parse_search_page(title_en)
-        time.sleep(0.5)
-
-    # 设置一个最低阈值
-    if best_mid is not None and best_score >= 0.5:
+                    merge(futures[fut], fut.result())
+                except Exception as e:
+                    log(f"  ⚠ MTime 搜索异常：{e}", category="mtime")
+                    merge(futures[fut], None)
+                if detail["score"] >= MTIME_ACCEPT_SCORE:
+                    cancel.set()
+                    break
+        finally:
+            cancel.set()
+            ex.shutdown(wait=False, cancel_futures=True)
+    else:
+        # 优先用中文名，不够好/没找到，再用英文名
+        for i, q in enumerate(queries):
+            if i and detail["score"] >= MTIME_ACCEPT_SCORE:
+                break
+            merge(q, mtime_search_candidates(q))
+            time.sleep(0.5)
+
+    resolver.finish_detail(detail)
+    if detail["id"] is not None:
         log(
-            f"  ✅ MTime 匹配成功：movieId={best_mid}（相似度 {best_score:.2f}）",
+            f"  ✅ MTime 匹配成功：movieId={detail['id']}（相似度 {detail['score']:.2f}）",
             category="mtime",
         )
-        return best_mid
     else:
         log(
-            f"  ⏭ MTime 未找到足够匹配的结果（score={best_score:.2f}）",
+            f"  ⏭ MTime 未找到足够匹配的结果（score={detail['score']:.2f}）",
             category="mtime",
         )
-        return None
+    return detail
+
+
+def search_mtime_movie(title_cn: str, title_en: str, year: str):
+    return search_mtime_movie_detail(title_cn, title_en, year)["id"]
+
+
+def resolver_search(movie, cancel=None):
+    """供 resolver 调用的 MTime 搜索入口"""
+    return search_mtime_movie_detail(
+        movie.get("title_cn", ""), movie.get("title_en", ""), movie.get("year", ""), movie.get("id")
+    )
+
+
+# ============================
+# ★ MTime：TMDB id → MTime id（映射和负缓存由 resolver 统一管理）
+# ============================
+
+
+def is_mtime_search_deferred(movie_id) -> bool:
+    """负缓存里还没到再查时间的电影返回 True"""
+    return resolver.is_deferred("mtime", movie_id)
+
+
+def resolve_mtime_id(movie_id, title_cn, title_en, year, revalidate=False):
+    """
+    先查共享映射，命中直接返回；再查负缓存，没到再查时间就跳过；
+    否则（或要求重新校验时）搜索并写入对应缓存
+    返回 (mtime_id, 来源)，来源为 "cache" / "search" / "deferred"
+    """
+    movie = {"id": movie_id, "title_cn": title_cn, "title_en": title_en, "year": year}
+    mtime_id, source, detail = resolver.resolve(
+        "mtime",
+        movie,
+        resolver_search,
+        revalidate=revalidate or MTIME_ID_REVALIDATE,
+        ttl_days=MTIME_ID_MAP_TTL_DAYS,
+    )
+    if source == "cache":
+        log(f"  📌 MTime 映射缓存命中：movieId={mtime_id}", category="mtime")
+    elif source == "deferred":
+        log("  🕒 负缓存中，未到再查时间，跳过搜索", category="mtime")
+    elif not mtime_id and detail.get("error"):
+        log("  ⚠ MTime 搜索请求失败，不记负缓存，下次再查", category="mtime")
+    elif not mtime_id:
+        log(f"  🕒 已记入负缓存，{detail['retry_days']} 天后再查", category="mtime")
+    return mtime_id, source
 
 
 def check_and_auto_pause():
@@ -633,40 +1095,66 @@ def check_and_auto_pause():
     return False
 
 
-def download_one_mtime_image(job, movie_title=""):
+def add_movie_new_images(base_title, n=1):
+    if not n:
+        return
+    with session_lock:
+        session_movie_new_images[base_title] = session_movie_new_images.get(base_title, 0) + n
+
+
+def download_one_mtime_image(job, movie_title="", retry=False):
+    """
+    下载一张 MTime 图片，返回是否成功
+    retry=True（重试引擎调用）时：不触发自动暂停，失败也不计入连续失败，只顺延该项自己的退避时间
+    """
     global pause_requested, mtime_ok, mtime_fail, session_new_images
     global consecutive_fails, last_success_time
 
     # 检查暂停请求
     if pause_requested:
-        return
+        return False
 
     # 检查是否需要自动暂停
-    if check_and_auto_pause():
-        return
+    if not retry and check_and_auto_pause():
+        return False
 
     url = job["url"]
     save_path = job["save_path"]
     mid_str = job["movie_id_str"]
     remote_key = job["remote_key"]
 
-    # 根据连续失败次数动态调整延迟
-    base_delay = 5.0 + consecutive_fails * 1.0  # 失败越多，延迟越长
-    max_delay = min(base_delay + 3.0, 30.0)  # 最大延迟30秒
-    time.sleep(random.uniform(base_delay, max_delay))
+    # 后台重试引擎和正常下载可能拿到同一张图：已经记上的不再下
+    with record_lock:
+        done = remote_key in record["images"].get(mid_str, ())
+    if done:
+        remove_failed_item(remote_key)
+        return False
+
+    # 下载段的限速：令牌桶保证平均间隔，再按连续失败次数追加延迟
+    download_limiter.acquire()
+    extra_delay = min(consecutive_fails * 1.0, 22.0)  # 失败越多，延迟越长（总计最大约30秒）
+    time.sleep(random.uniform(extra_delay, extra_delay + 3.0))
 
     try:
         resp = safe_get(url, stream=True)
         if not resp:
             raise RuntimeError("MTime 请求失败")
 
-        img_data = resp.content
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        with open(save_path, "wb") as f:
-            f.write(img_data)
+        image_store.write_image(
+            save_path,
+            resp.iter_content(image_store.CHUNK_SIZE),
+            source="mtime",
+            movie_id=mid_str,
+            key=remote_key,
+            url=url,
+        )
 
         with record_lock:
-            record["images"][mid_str].append(remote_key)
+            keys = record["images"].setdefault(mid_str, [])
+            if remote_key in keys:
+                # 另一路在我们下载期间先记上了，文件已被覆盖为同一张图，不重复计数
+                return False
+            keys.append(remote_key)
 
         mtime_ok += 1
         session_new_images += 1
@@ -678,23 +1166,27 @@ def download_one_mtime_image(job, movie_title=""):
         # 如果之前失败过，现在成功了，从失败记录中移除
         remove_failed_item(remote_key)
 
-        log("  ✔ MTime 保存：" + save_path, category="mtime")
+        log(("  ✔ 重试成功：" if retry else "  ✔ MTime 保存：") + save_path, category="mtime")
+        return True
     except Exception as e:
         mtime_fail += 1
-        consecutive_fails += 1  # 增加连续失败计数
-        
-        # 记录失败的下载任务，以便下次重试
-        add_failed_item(job, movie_title)
-        log(f"  ❌ MTime 下载失败（连续{consecutive_fails}次）：{url} 错误：{e}", category="mtime")
+        if not retry:
+            consecutive_fails += 1  # 增加连续失败计数
+
+        # 记录失败的下载任务（带退避时间表），以便之后重试
+        add_failed_item(job, movie_title, e)
+        if retry:
+            log(f"  ❌ 重试失败：{url} 错误：{e}", category="mtime")
+        else:
+            log(f"  ❌ MTime 下载失败（连续{consecutive_fails}次）：{url} 错误：{e}", category="mtime")
+        return False
 
 
-def try_download_mtime_images(movie_id, title_cn, title_en, year):
+def prepare_mtime_movie(movie_id, title_cn, title_en, year):
     """
-    为某个 TMDB 电影，尝试用标题匹配 MTime 并下载所有类型剧照。
-    使用 front-gateway.mtime.com 的 image.api 接口
+    第一段：建目录、匹配 MTime id
+    返回 (状态, ctx)，状态为 "matched" / "unmatched" / "deferred"
     """
-    global record, session_new_images, session_movie_new_images, pause_requested
-
     mid_str = str(movie_id)
     base_title = title_cn or title_en or f"movie_{mid_str}"
     safe_title = clean_filename(base_title) or f"movie_{mid_str}"
@@ -707,45 +1199,181 @@ def try_download_mtime_images(movie_id, title_cn, title_en, year):
 
     log(f"🧩 正在为《{base_title}》匹配 MTime 剧照…", category="mtime")
 
-    mtime_id = search_mtime_movie(title_cn, title_en, year)
+    mtime_id, source = resolve_mtime_id(movie_id, title_cn, title_en, year)
+    ctx = {
+        "movie_id": movie_id,
+        "mid_str": mid_str,
+        "base_title": base_title,
+        "movie_dir": movie_dir,
+        "mtime_id": mtime_id,
+        "source": source,
+    }
+    if source == "deferred":
+        return "deferred", ctx
     if not mtime_id:
-        return
+        return "unmatched", ctx
+    return "matched", ctx
+
+
+def mtime_type_policy(img_type):
+    return MTIME_TYPE_POLICY.get(img_type, MTIME_DEFAULT_TYPE_POLICY)
+
+
+def select_mtime_images(image_infos, pass_no=1):
+    """
+    按类型策略挑图：排除类型、每类型上限（按 API 顺序取前 N 张）、按优先级排序
+    两遍调度的第一遍只保留高优先级类型
+    返回 (本次要下的 imageInfos, 留到第二遍的张数)
+    """
+    per_type = {}
+    selected = []
+    deferred = 0
+    for img in image_infos:
+        img_type = img.get("type")
+        if img_type in MTIME_EXCLUDED_TYPES:
+            continue
+        policy = mtime_type_policy(img_type)
+        n = per_type.get(img_type, 0)
+        if policy.get("cap") and n >= policy["cap"]:
+            continue
+        per_type[img_type] = n + 1
+
+        if MTIME_TWO_PASS and pass_no == 1 and policy["priority"] > MTIME_FIRST_PASS_MAX_PRIORITY:
+            deferred += 1
+            continue
+        selected.append(img)
+
+    # sort 是稳定的，同优先级内保持 API 顺序
+    selected.sort(key=lambda img: mtime_type_policy(img.get("type"))["priority"])
+    return selected, deferred
+
+
+def mark_mtime_pass(ctx):
+    """记录这部电影完成了第几遍（1=还有类型留给第二遍，2=全部完成），并记下本次列表指纹"""
+    with record_lock:
+        record.setdefault("mtime_pass", {})[ctx["mid_str"]] = 1 if ctx.get("deferred_count") else 2
+    if ctx.get("fingerprint"):
+        remember_mtime_fingerprint(ctx)
 
-    # 添加延迟，避免连续请求
-    time.sleep(random.uniform(3.0, 6.0))
+
+# ============================
+# ★ MTime：image.api 列表指纹
+# ============================
+
+mtime_fingerprints = None  # {mtime_id: {"tmdb", "n", "h", "pass", "deferred", "checked"}}
+mtime_fingerprints_lock = threading.Lock()
+
+
+def load_mtime_fingerprints():
+    global mtime_fingerprints
+    data = {}
+    if os.path.exists(MTIME_FINGERPRINT_FILE):
+        try:
+            with open(MTIME_FINGERPRINT_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            log("⚠ MTime 列表指纹损坏，将重建", category="mtime")
+    mtime_fingerprints = data
+    return data
+
+
+def save_mtime_fingerprints():
+    if mtime_fingerprints is None:
+        return
+    with mtime_fingerprints_lock:
+        try:
+            tmp = MTIME_FINGERPRINT_FILE + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(mtime_fingerprints, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, MTIME_FINGERPRINT_FILE)
+        except Exception as e:
+            log(f"⚠ 保存 MTime 列表指纹出错：{e}", category="mtime")
+
+
+def mtime_listing_fingerprint(image_infos):
+    """(图片数, 排序后图片 id 的 64 位哈希)，与 API 返回顺序无关"""
+    keys = sorted(str(img.get("id") or img.get("image") or "") for img in image_infos)
+    digest = hashlib.blake2b("\n".join(keys).encode("utf-8"), digest_size=8).hexdigest()
+    return len(keys), digest
+
+
+def get_mtime_fingerprint(mtime_id):
+    if mtime_fingerprints is None:
+        load_mtime_fingerprints()
+    with mtime_fingerprints_lock:
+        return mtime_fingerprints.get(str(mtime_id))
+
+
+def forget_mtime_fingerprint(mtime_id):
+    if mtime_fingerprints is None:
+        load_mtime_fingerprints()
+    with mtime_fingerprints_lock:
+        removed = mtime_fingerprints.pop(str(mtime_id), None)
+    if removed:
+        save_mtime_fingerprints()
+
+
+def remember_mtime_fingerprint(ctx):
+    """只在整部电影处理完后调用：中途失败的电影不记指纹，下次仍会逐张比对"""
+    if mtime_fingerprints is None:
+        load_mtime_fingerprints()
+    n, digest = ctx["fingerprint"]
+    with mtime_fingerprints_lock:
+        mtime_fingerprints[str(ctx["mtime_id"])] = {
+            "tmdb": ctx["movie_id"],
+            "n": n,
+            "h": digest,
+            "pass": ctx.get("pass", 1),
+            "deferred": ctx.get("deferred_count", 0),
+            "checked": int(time.time()),
+        }
+    save_mtime_fingerprints()
+
+
+def fetch_mtime_jobs(ctx):
+    """
+    第二段：拉取 image.api，生成待下载任务
+    返回 (状态, jobs)，状态为 "ok" / "api_failed" / "paused"
+    """
+    mid_str = ctx["mid_str"]
+    movie_dir = ctx["movie_dir"]
 
     # 拉取 image.api
     api_url = "https://front-gateway.mtime.com/library/movie/image.api"
-    r = safe_get(api_url, params={"movieId": mtime_id})
+    r = safe_get(api_url, params={"movieId": ctx["mtime_id"]})
     if not r:
         log("  ❌ MTime image.api 接口失败", category="mtime")
-        return
+        return "api_failed", []
 
     try:
         data = r.json()
     except Exception as e:
         log(f"  ❌ MTime JSON 解析失败：{e}", category="mtime")
-        return
+        return "api_failed", []
 
     image_infos = data.get("data", {}).get("imageInfos", [])
+
+    # 列表和上次完整处理时一样（且当时已下到这一遍）：不建集合、不碰记录，直接跳过
+    fingerprint = mtime_listing_fingerprint(image_infos)
+    ctx["fingerprint"] = fingerprint
+    seen = get_mtime_fingerprint(ctx["mtime_id"])
+    if seen and (seen["n"], seen["h"]) == fingerprint and seen["pass"] >= ctx.get("pass", 1):
+        ctx["deferred_count"] = seen["deferred"]
+        log("  ⏭ MTime 图片列表未变化", category="mtime")
+        return "ok", []
+
+    image_infos, ctx["deferred_count"] = select_mtime_images(image_infos, ctx.get("pass", 1))
     if not image_infos:
-        log("  ⏭ MTime 无新剧照", category="mtime")
-        return
+        return "ok", []
 
     jobs = []
     with record_lock:
         existing = set(record["images"][mid_str])
 
-    # 类型映射（猜测）
-    TYPE_MAP = {
-        1: "海报",
-        6: "剧照",
-    }
-
     for img in image_infos:
         if pause_requested:
             log("  ⏸ 暂停请求 → 停止加入新的 MTime 剧照", category="mtime")
-            break
+            return "paused", []
 
         img_id = img.get("id")
         img_url = img.get("image")
@@ -759,7 +1387,7 @@ def try_download_mtime_images(movie_id, title_cn, title_en, year):
         if remote_key in existing:
             continue
 
-        type_name = TYPE_MAP.get(img_type, f"Type_{img_type}")
+        type_name = MTIME_TYPE_NAMES.get(img_type, f"Type_{img_type}")
         type_dir = os.path.join(movie_dir, f"MTime_{type_name}")
 
         # 使用图片 ID 作为文件名
@@ -782,67 +1410,262 @@ def try_download_mtime_images(movie_id, title_cn, title_en, year):
             }
         )
 
+    return "ok", jobs
+
+
+def try_download_mtime_images(movie_id, title_cn, title_en, year, pass_no=1):
+    """
+    为某个 TMDB 电影，尝试用标题匹配 MTime 并下载所有类型剧照（逐部串行版本）。
+    使用 front-gateway.mtime.com 的 image.api 接口
+    返回状态：
+      "done"       -> 已匹配并处理完（可以归档）
+      "unmatched"  -> 搜索了但没匹配到（已记入负缓存，不归档，以后再查）
+      "deferred"   -> 负缓存未到再查时间，本次没有发请求
+      "api_failed" -> 匹配到了但 image.api 失败（不归档，下次用缓存 id 重试）
+      "paused"     -> 暂停请求，任务取消（不归档）
+    """
+    status, ctx = prepare_mtime_movie(movie_id, title_cn, title_en, year)
+    if status != "matched":
+        return status
+    ctx["pass"] = pass_no
+
+    # 刚搜索过才需要延迟，避免连续请求
+    if ctx["source"] == "search":
+        time.sleep(random.uniform(3.0, 6.0))
+
+    status, jobs = fetch_mtime_jobs(ctx)
+    if status != "ok":
+        return status
+
+    base_title = ctx["base_title"]
     if not jobs:
         log("  ⏭ MTime 无新剧照", category="mtime")
-        return
+        mark_mtime_pass(ctx)
+        return "done"
 
     if pause_requested:
         log("  ⏸ 暂停请求 → 取消 MTime 下载任务", category="mtime")
-        return
+        return "paused"
 
     log(f"  🚀 MTime 开始下载 {len(jobs)} 张（多类型文件夹）…", category="mtime")
 
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-        for _ in ex.map(lambda j: download_one_mtime_image(j, base_title), jobs):
-            pass
+        new_count = sum(ex.map(lambda j: download_one_mtime_image(j, base_title), jobs))
 
-    new_count = len(jobs)
-    session_new_images += 0  # 单张里已经累加，这里不再重复累加
-    session_movie_new_images[base_title] = (
-        session_movie_new_images.get(base_title, 0) + new_count
-    )
+    add_movie_new_images(base_title, new_count)
 
     log(f"  ✔ MTime 完成：《{base_title}》新增 {new_count} 张", category="mtime")
+    mark_mtime_pass(ctx)
+    return "done"
 
 
 # ============================
-# TMDB：热门模式（原逻辑，保留）
+# ★ MTime：三段流水线（搜索 → image.api → 下载）
 # ============================
 
 
-def run_popular_mode():
-    global record, session_new_movies, pause_requested
+def paused():
+    return pause_requested
+
+
+def archive_mtime_movie(movie, ctx=None):
+    if ctx is not None:
+        mark_mtime_pass(ctx)
+    movie_id = movie["id"]
+    display_title = movie["title_cn"] or movie["title_en"] or f"movie_{movie_id}"
+    with record_lock:
+        if movie_id not in record["movie_ids"]:
+            record["movie_ids"].append(movie_id)
+            session_new_movies.append(display_title)
+    save_record_safe()
+    log(f"  💾 《{display_title}》完成并在记录中归档", category="mtime")
+
 
-    for page in range(1, POPULAR_MAX_PAGES + 1):
+def run_mtime_pipeline(pending_movies, pass_no=1):
+    """
+    三段流水线，每段有自己的限速：
+      搜索段（search_limiter）→ image.api 段（image_api_limiter）→ 下载段（download_limiter）
+    下一部电影的匹配和拉列表，与当前电影的图片下载重叠进行
+    """
+    movie_q = queue.Queue(maxsize=MTIME_PIPELINE_MOVIE_QUEUE)
+    job_q = queue.Queue(maxsize=MTIME_PIPELINE_JOB_QUEUE)
+    errors = {"search": 0, "image_api": 0, "download": 0}
+    errors_lock = threading.Lock()
+
+    def stage_error(stage, what, e):
+        # 单部电影/单张图出错只记一笔，段线程不能退出：否则上游会永远卡在有界队列的 put 上
+        with errors_lock:
+            errors[stage] += 1
+        log(f"  ⚠ MTime {what}异常：{e}", category="mtime")
+
+    def search_one(movie):
+        """处理一部电影的匹配，返回 False 表示整段该停了"""
         if pause_requested:
-            log("⏸ 暂停请求 → 停止热门电影拉取")
+            log("⏸ MTime 搜索段暂停", category="mtime")
+            return False
+        if not is_mtime_enabled():
+            log("ℹ 未勾选 MTime 下载，跳过所有电影", category="mtime")
+            return False
+
+        status, ctx = prepare_mtime_movie(movie["id"], movie["title_cn"], movie["title_en"], movie["year"])
+        if status == "deferred":
+            return True
+        if pass_no == 1:
+            record_priority_result(movie, is_mtime_hit(status))
+            save_priority_state()
+        if status != "matched":
+            return True
+        ctx["pass"] = pass_no
+        return work_queue.put_until_paused(movie_q, (movie, ctx), paused)
+
+    def search_stage():
+        try:
+            for movie in pending_movies:
+                try:
+                    if not search_one(movie):
+                        return
+                except Exception as e:
+                    stage_error("search", "匹配", e)
+        finally:
+            movie_q.put(None)
+
+    def image_api_one(movie, ctx):
+        image_api_limiter.acquire()
+        status, jobs = fetch_mtime_jobs(ctx)
+        if status != "ok":
             return
 
-        log(f"\n📄 TMDB 热门电影 第 {page} 页", category="tmdb")
+        base_title = ctx["base_title"]
+        if not jobs:
+            log(f"  ⏭ 《{base_title}》MTime 无新剧照", category="mtime")
+            archive_mtime_movie(movie, ctx)
+            return
 
-        r = safe_get(
-            f"{BASE_URL}/movie/popular",
-            params={
-                "api_key": API_KEY,
-                "page": page,
-                "language": "zh-CN",  # 让 title 尽量是中文
-                "region": "CN",
-            },
+        log(f"  🚀 《{base_title}》MTime 排队下载 {len(jobs)} 张", category="mtime")
+        countdown = work_queue.MovieCountdown(len(jobs), lambda m=movie, c=ctx: archive_mtime_movie(m, c))
+        for i, job in enumerate(jobs):
+            if not work_queue.put_until_paused(job_q, (job, base_title, countdown), paused):
+                # 没放进去的图片也要计数，保证 countdown 能归零
+                for _ in range(len(jobs) - i):
+                    countdown.done_one(aborted=True)
+                return
+
+    def image_api_stage():
+        try:
+            while True:
+                item = movie_q.get()
+                if item is None:
+                    return
+                if pause_requested:
+                    continue
+                try:
+                    image_api_one(*item)
+                except Exception as e:
+                    stage_error("image_api", "拉取列表", e)
+        finally:
+            for _ in range(MAX_WORKERS):
+                job_q.put(None)
+
+    def download_stage():
+        while True:
+            item = job_q.get()
+            if item is None:
+                return
+            job, base_title, countdown = item
+            try:
+                if pause_requested:
+                    continue
+                if download_one_mtime_image(job, base_title):
+                    add_movie_new_images(base_title)
+            except Exception as e:
+                stage_error("download", "下载", e)
+            finally:
+                try:
+                    # 最后一张完成时在这里归档（存记录），出错也不能带走下载线程
+                    countdown.done_one(aborted=pause_requested)
+                except Exception as e:
+                    stage_error("download", "归档", e)
+
+    threads = [
+        threading.Thread(target=search_stage, daemon=True, name="MTime-Search"),
+        threading.Thread(target=image_api_stage, daemon=True, name="MTime-ImageApi"),
+    ] + [
+        threading.Thread(target=download_stage, daemon=True, name=f"MTime-Download-{i}")
+        for i in range(MAX_WORKERS)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if any(errors.values()):
+        log(
+            f"⚠ MTime 流水线出错：匹配 {errors['search']}，拉取列表 {errors['image_api']}，下载/归档 {errors['download']}",
+            category="mtime",
         )
-        time.sleep(3)  # 稍微减慢翻页速度
-        if not r:
-            continue
 
-        movies = r.json().get("results", [])
-        if not movies:
-            log("无更多热门电影", category="tmdb")
-            break
 
-        for m in movies:
+# ============================
+# TMDB：热门模式（原逻辑，保留）
+# ============================
+
+
+def popular_page_lister(movie_queue):
+    """预取热门列表：翻页（含 3s 节流）在独立线程里进行，和电影处理重叠"""
+    try:
+        for page in range(1, POPULAR_MAX_PAGES + 1):
             if pause_requested:
-                log("⏸ 暂停请求 → 停止处理更多电影", category="tmdb")
+                log("⏸ 暂停请求 → 停止热门电影拉取")
+                return
+
+            log(f"\n📄 TMDB 热门电影 第 {page} 页", category="tmdb")
+
+            r = safe_get(
+                f"{BASE_URL}/movie/popular",
+                params={
+                    "api_key": API_KEY,
+                    "page": page,
+                    "language": "zh-CN",  # 让 title 尽量是中文
+                    "region": "CN",
+                },
+            )
+            time.sleep(3)  # 稍微减慢翻页速度
+            if not r:
+                continue
+
+            movies = r.json().get("results", [])
+            if not movies:
+                log("无更多热门电影", category="tmdb")
                 return
 
+            for m in movies:
+                # 有界队列：处理跟不上时在这里等待（背压）
+                if not work_queue.put_until_paused(movie_queue, m, paused):
+                    return
+    except Exception as e:
+        log(f"⚠ 热门列表线程异常：{e}", category="tmdb")
+    finally:
+        movie_queue.put(None)
+
+
+def run_popular_mode():
+    global record, session_new_movies, pause_requested
+
+    movie_queue = queue.Queue(maxsize=POPULAR_PREFETCH_MOVIES)
+    lister = threading.Thread(
+        target=popular_page_lister, args=(movie_queue,), daemon=True, name="TMDB-Lister"
+    )
+    lister.start()
+
+    try:
+        while True:
+            m = movie_queue.get()
+            if m is None:
+                break
+
+            if pause_requested:
+                # 继续取空队列，直到列表线程发出结束信号
+                continue
+
             movie_id = m["id"]
             title = m.get("title") or m.get("name") or "无标题"
 
@@ -859,13 +1682,16 @@ def run_popular_mode():
             if pause_requested:
                 log("⏸ 暂停 → 已保存当前进度", category="tmdb")
                 save_record_safe()
-                return
+                continue
 
             if ok:
                 with record_lock:
-                    record["movie_ids"].append(movie_id)
+                    if movie_id not in record["movie_ids"]:
+                        record["movie_ids"].append(movie_id)
                 session_new_movies.append(title)
                 save_record_safe()
+    finally:
+        lister.join()
 
 
 # ============================
@@ -891,21 +1717,15 @@ def collect_new_movies():
         except Exception:
             pass
 
-    movies_list_file = os.path.join(BASE_DIR, "movies_to_download.json")
-    existing_ids = set()
-    all_movies = []
-
-    if os.path.exists(movies_list_file):
-        try:
-            with list_file_lock:
-                with open(movies_list_file, "r", encoding="utf-8") as f:
-                    saved_list = json.load(f)
-                    all_movies = saved_list
-                    for m in saved_list:
-                        existing_ids.add(m["id"])
-            log(f"📂 已加载现有列表，共 {len(all_movies)} 部电影", category="tmdb")
-        except Exception:
-            pass
+    migrate_legacy_movie_list()
+    try:
+        with list_file_lock:
+            existing_ids = load_movie_list_ids()
+        if existing_ids:
+            log(f"📂 已加载现有列表索引，共 {len(existing_ids)} 部电影", category="tmdb")
+    except Exception as e:
+        log(f"⚠ 读取列表索引失败：{e}", category="tmdb")
+        existing_ids = set()
 
     current_page = start_page
 
@@ -938,7 +1758,7 @@ def collect_new_movies():
             log("无更多中文电影", category="tmdb")
             break
 
-        new_count = 0
+        new_movies = []
         for m in movies:
             if pause_requested:
                 break
@@ -947,29 +1767,30 @@ def collect_new_movies():
             if movie_id in existing_ids:
                 continue
 
-            all_movies.append(
+            new_movies.append(
                 {
                     "id": movie_id,
                     "title_cn": m.get("title") or m.get("name") or "",
                     "title_en": m.get("original_title") or "",
                     "year": (m.get("release_date") or "0000")[:4],
+                    "release_date": m.get("release_date") or "",
+                    "popularity": m.get("popularity") or 0,
+                    "vote_count": m.get("vote_count") or 0,
                 }
             )
             existing_ids.add(movie_id)
-            new_count += 1
+        new_count = len(new_movies)
 
         if page % 10 == 0 or new_count > 0:
             try:
-                with list_file_lock:
-                    with open(movies_list_file, "w", encoding="utf-8") as f:
-                        json.dump(all_movies, f, ensure_ascii=False, indent=2)
+                append_movies_to_list(new_movies)
 
                 with open(scan_state_file, "w", encoding="utf-8") as f:
                     json.dump({"last_page": page + 1}, f)
 
                 if page % 10 == 0:
                     log(
-                        f"💾 进度已保存：第 {page} 页，累计收集 {len(all_movies)} 部",
+                        f"💾 进度已保存：第 {page} 页，累计收集 {len(existing_ids)} 部",
                         category="tmdb",
                     )
             except Exception as e:
@@ -980,49 +1801,127 @@ def collect_new_movies():
             log("✅ 连续多页无新电影，提前停止扫描", category="tmdb")
             break
 
-    return all_movies
+    return len(existing_ids)
+
+
+def revisit_mtime_movies(movies, pass_no):
+    """对已处理过的电影再走一遍（MTime id 走映射缓存，列表没变的靠指纹跳过）"""
+    if MTIME_PIPELINE:
+        run_mtime_pipeline(movies, pass_no=pass_no)
+        return
+
+    for movie in movies:
+        if pause_requested:
+            return
+        try:
+            try_download_mtime_images(
+                movie["id"], movie["title_cn"], movie["title_en"], movie["year"], pass_no=pass_no
+            )
+        except Exception as e:
+            log(f"  ⚠ MTime 处理异常：{e}", category="mtime")
+
+
+def run_mtime_second_pass():
+    """第二遍：给第一遍只下了高优先级类型的电影补齐其余类型"""
+    with record_lock:
+        ids = {int(k) for k, v in record.get("mtime_pass", {}).items() if v == 1}
+    if not ids:
+        log("✅ 没有需要第二遍补图的电影", category="refresh")
+        return
+
+    movies = [m for m in iter_movie_list() if m["id"] in ids]
+    log(f"🔁 第二遍：为 {len(movies)} 部电影补齐其余类型图片", category="refresh")
+    revisit_mtime_movies(movies, pass_no=2)
+
+
+def run_mtime_resweep():
+    """
+    回扫：已全部完成的电影里，挑距上次检查最久的一批重新拉 image.api
+    列表指纹没变的只更新检查时间，有变化的才逐张比对下载新图
+    """
+    if not MTIME_RESWEEP_DAYS:
+        return
+    if mtime_fingerprints is None:
+        load_mtime_fingerprints()
+    with record_lock:
+        done_ids = [int(k) for k, v in record.get("mtime_pass", {}).items() if v == 2]
+
+    cutoff = time.time() - MTIME_RESWEEP_DAYS * 86400
+    due = []
+    for movie_id in done_ids:
+        mtime_id = resolver.get_cached_id("mtime", movie_id)
+        if not mtime_id:
+            continue
+        seen = get_mtime_fingerprint(mtime_id)
+        checked = seen["checked"] if seen else 0
+        if checked < cutoff:
+            due.append((checked, movie_id))
+    if not due:
+        log("✅ 没有需要回扫的电影", category="refresh")
+        return
+
+    due.sort()
+    ids = {movie_id for _checked, movie_id in due[:MTIME_RESWEEP_BUDGET]}
+    movies = [m for m in iter_movie_list() if m["id"] in ids]
+    log(f"🔁 回扫：检查 {len(movies)} 部电影是否有新图片（共 {len(due)} 部到期）", category="refresh")
+    revisit_mtime_movies(movies, pass_no=2)
 
 
 def run_chinese_movies_mode():
     """
-    从 movies_to_download.json 读取电影列表
+    从 movies_to_download.jsonl 逐行读取电影列表
     仅下载未完成的电影（对比 downloaded.json）
     ✅ 现在只使用 MTime 下载图片，TMDB 不再下载图片
     """
     global record, session_new_movies, pause_requested
 
-    movies_list_file = os.path.join(BASE_DIR, "movies_to_download.json")
-    if not os.path.exists(movies_list_file):
+    migrate_legacy_movie_list()
+    if not os.path.exists(MOVIES_LIST_FILE):
         log("⚠ 未找到电影列表文件，请先点击【刷新列表】", category="refresh")
         return
 
-    all_movies = []
     try:
         with list_file_lock:
-            with open(movies_list_file, "r", encoding="utf-8") as f:
-                all_movies = json.load(f)
+            all_ids = load_movie_list_ids()
     except Exception as e:
         log(f"💥 读取列表失败：{e}", category="refresh")
         return
 
-    if not all_movies:
+    if not all_ids:
         log("⚠ 电影列表为空，请先点击【刷新列表】", category="refresh")
         return
 
-    pending_movies = []
     with record_lock:
         downloaded_ids = set(record["movie_ids"])
 
-    for m in all_movies:
-        if m["id"] not in downloaded_ids:
-            pending_movies.append(m)
+    pending_count = len(all_ids - downloaded_ids)
+    if not pending_count:
+        log("✅ 所有列表中的电影都已下载完成", category="refresh")
+        if is_mtime_enabled():
+            if MTIME_TWO_PASS:
+                run_mtime_second_pass()
+            run_mtime_resweep()
+        return
+
+    # 增量同步优先级队列，再按分数取本轮预算内的电影
+    if priority_state is None:
+        load_priority_state()
+    queued = sync_priority_queue(iter_movie_list(), downloaded_ids)
+    pending_movies = take_priority_batch(MTIME_CYCLE_BUDGET)
+    save_priority_state()
 
     if not pending_movies:
-        log("✅ 所有列表中的电影都已下载完成", category="refresh")
+        # 剩下的都是未上映或负缓存中的电影：第一遍已覆盖整个列表，开始第二遍
+        log("✅ 本轮没有可处理的待下载电影", category="refresh")
+        if is_mtime_enabled():
+            if MTIME_TWO_PASS:
+                run_mtime_second_pass()
+            run_mtime_resweep()
         return
 
     log(
-        f"\n📊 列表共 {len(all_movies)} 部，待下载 {len(pending_movies)} 部",
+        f"\n📊 列表共 {len(all_ids)} 部，待下载 {pending_count} 部，"
+        f"队列 {queued} 部，本轮按优先级处理 {len(pending_movies)} 部",
         category="refresh",
     )
     log("🚀 启动 MTime 下载线程（TMDB 图片下载已禁用）...\n", category="refresh")
@@ -1038,6 +1937,10 @@ def run_chinese_movies_mode():
         return
 
     def mtime_worker():
+        if MTIME_PIPELINE:
+            run_mtime_pipeline(pending_movies)
+            return
+
         for movie in pending_movies:
             if pause_requested:
                 log("⏸ MTime 下载线程暂停", category="mtime")
@@ -1047,22 +1950,21 @@ def run_chinese_movies_mode():
                 log("ℹ 未勾选 MTime 下载，跳过所有电影", category="mtime")
                 return
 
-            movie_id = movie["id"]
-            display_title = (
-                movie["title_cn"] or movie["title_en"] or f"movie_{movie_id}"
-            )
-
             try:
-                try_download_mtime_images(
+                status = try_download_mtime_images(
                     movie["id"], movie["title_cn"], movie["title_en"], movie["year"]
                 )
+                if status in ("deferred", "paused"):
+                    continue
 
-                with record_lock:
-                    if movie_id not in record["movie_ids"]:
-                        record["movie_ids"].append(movie_id)
-                        session_new_movies.append(display_title)
-                save_record_safe()
-                log(f"  💾 《{display_title}》完成并在记录中归档", category="mtime")
+                record_priority_result(movie, is_mtime_hit(status))
+                save_priority_state()
+
+                if status != "done":
+                    # 未匹配 / image.api 失败：留在待下载列表，按负缓存或映射缓存以后重试
+                    continue
+
+                archive_mtime_movie(movie)
 
             except Exception as e:
                 log(f"  ⚠ MTime 处理异常：{e}", category="mtime")
@@ -1107,13 +2009,17 @@ def download_worker():
         if MODE == "popular":
             run_popular_mode()
         elif MODE == "zh_movies":
+            if is_mtime_enabled():
+                start_retry_engine()
             run_chinese_movies_mode()
         else:
             log(f"⚠ 未知 MODE = {MODE}", category="refresh")
     except Exception as e:
         log(f"💥 下载线程异常：{e}", category="refresh")
     finally:
+        stop_retry_engine()
         save_record_safe()
+        resolver.flush()
         with state_lock:
             is_downloading = False
         log("✅ 下载线程结束", category="refresh")
@@ -1185,10 +2091,10 @@ def refresh_worker():
 
     try:
         log("▶ 开始刷新电影列表...", category="refresh")
-        movies = collect_new_movies()
-        if movies:
+        total = collect_new_movies()
+        if total:
             log(
-                f"✅ 刷新完成，共找到 {len(movies)} 部电影（包含历史 + 新增）",
+                f"✅ 刷新完成，共找到 {total} 部电影（包含历史 + 新增）",
                 category="refresh",
             )
         else:
@@ -1218,11 +2124,58 @@ def start_refresh():
 is_retrying = False  # 重试状态标志
 
 
+retry_engine_thread = None
+retry_engine_stop = threading.Event()
+
+
+def retry_engine_loop():
+    """
+    后台重试引擎：定期取到期的失败项，走和正常下载相同的限速器，穿插在正常下载之间
+    正常下载连续失败（疑似限流）时本轮不取，等主流程恢复
+    """
+    while not retry_engine_stop.is_set():
+        if not pause_requested and consecutive_fails < CONSECUTIVE_FAIL_THRESHOLD:
+            try:
+                for item in take_eligible_failed_items(RETRY_ENGINE_BATCH):
+                    if retry_engine_stop.is_set() or pause_requested:
+                        break
+                    log(f"  🔄 后台重试：《{item.get('movie_title', '')}》 - {os.path.basename(item['save_path'])}", category="mtime")
+                    download_one_mtime_image(item, item.get("movie_title", ""), retry=True)
+            except Exception as e:
+                log(f"  ⚠ 后台重试异常：{e}", category="mtime")
+        retry_engine_stop.wait(RETRY_ENGINE_POLL)
+
+
+def start_retry_engine():
+    global retry_engine_thread
+    if not RETRY_ENGINE_ENABLED:
+        return
+    # 先清停止标志：上一轮 stop 后线程还没退出时，让它接着跑，而不是马上退出、留下没有引擎的一轮
+    retry_engine_stop.clear()
+    if retry_engine_thread and retry_engine_thread.is_alive():
+        return
+    retry_engine_thread = threading.Thread(target=retry_engine_loop, daemon=True, name="MTime-Retry")
+    retry_engine_thread.start()
+
+
+def stop_retry_engine():
+    global retry_engine_thread
+    retry_engine_stop.set()
+    thread = retry_engine_thread
+    if thread and thread.is_alive() and thread is not threading.current_thread():
+        thread.join(RETRY_ENGINE_JOIN_TIMEOUT)
+        if thread.is_alive():
+            log("  ⚠ 后台重试引擎未能及时停止，将在当前这张下完后退出", category="mtime")
+            return
+    retry_engine_thread = None
+
+
 def retry_failed_worker():
     """
-    重试所有失败的下载任务
+    手动重试所有失败的下载任务（不看退避时间表），最早到期的先试
+    连续失败过多时提前结束，剩下的项保留各自的时间表交给后台引擎
     """
-    global is_retrying, pause_requested, record, mtime_ok, mtime_fail, session_new_images
+    global is_retrying, record
 
     with state_lock:
         if is_retrying:
@@ -1231,94 +2184,41 @@ def retry_failed_worker():
         is_retrying = True
 
     try:
-        failed_list = load_failed_record()
-        if not failed_list:
-            log("✅ 没有失败的下载任务需要重试", category="refresh")
-            return
-
-        log(f"▶ 开始重试 {len(failed_list)} 个失败的下载任务...", category="mtime")
-
         # 确保 record 已加载
         if record is None:
             loaded = load_record()
             with record_lock:
                 globals()["record"] = loaded
 
-        success_count = 0
-        still_failed = []
+        items = take_eligible_failed_items(force=True)
+        if not items:
+            log("✅ 没有失败的下载任务需要重试", category="refresh")
+            return
 
-        retry_consecutive_fails = 0  # 重试时的连续失败计数
+        log(f"▶ 开始重试 {len(items)} 个失败的下载任务...", category="mtime")
 
-        for item in failed_list:
+        success_count = 0
+        fails_in_row = 0
+        for item in items:
             if pause_requested:
                 log("⏸ 暂停请求 → 停止重试", category="mtime")
-                # 将未处理的项加入仍失败列表
-                still_failed.extend(failed_list[failed_list.index(item):])
+                break
+            if fails_in_row >= CONSECUTIVE_FAIL_THRESHOLD:
+                log(f"⚠ 重试连续失败 {fails_in_row} 次，停止本次重试，剩余项按退避时间表后台重试", category="mtime")
                 break
 
-            # 检查连续失败是否需要自动暂停
-            if retry_consecutive_fails >= CONSECUTIVE_FAIL_THRESHOLD:
-                log(f"⚠ 重试连续失败 {retry_consecutive_fails} 次，自动暂停 {AUTO_PAUSE_DURATION} 秒...", category="mtime")
-                waited = 0
-                while waited < AUTO_PAUSE_DURATION:
-                    if pause_requested:
-                        log("⏸ 用户请求暂停", category="refresh")
-                        still_failed.extend(failed_list[failed_list.index(item):])
-                        break
-                    time.sleep(5)
-                    waited += 5
-                if pause_requested:
-                    break
-                retry_consecutive_fails = 0
-                log("▶ 自动暂停结束，继续重试...", category="mtime")
-
-            url = item.get("url")
-            save_path = item.get("save_path")
-            mid_str = item.get("movie_id_str")
-            remote_key = item.get("remote_key")
-            movie_title = item.get("movie_title", "")
-
-            log(f"  🔄 重试：《{movie_title}》 - {os.path.basename(save_path)}", category="mtime")
-
-            # 根据连续失败次数动态调整延迟
-            base_delay = 5.0 + retry_consecutive_fails * 1.0
-            max_delay = min(base_delay + 3.0, 30.0)
-            time.sleep(random.uniform(base_delay, max_delay))
-
-            try:
-                resp = safe_get(url, stream=True)
-                if not resp:
-                    raise RuntimeError("MTime 请求失败")
-
-                img_data = resp.content
-                os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                with open(save_path, "wb") as f:
-                    f.write(img_data)
-
-                # 确保 images 字典中有该电影的记录
-                with record_lock:
-                    if mid_str not in record["images"]:
-                        record["images"][mid_str] = []
-                    record["images"][mid_str].append(remote_key)
-
-                mtime_ok += 1
-                session_new_images += 1
+            log(f"  🔄 重试：《{item.get('movie_title', '')}》 - {os.path.basename(item['save_path'])}", category="mtime")
+            if download_one_mtime_image(item, item.get("movie_title", ""), retry=True):
                 success_count += 1
-                retry_consecutive_fails = 0  # 成功，重置计数
-
-                log(f"  ✔ 重试成功：{save_path}", category="mtime")
-
-            except Exception as e:
-                mtime_fail += 1
-                retry_consecutive_fails += 1  # 增加连续失败计数
-                still_failed.append(item)
-                log(f"  ❌ 重试失败（连续{retry_consecutive_fails}次）：{url} 错误：{e}", category="mtime")
+                fails_in_row = 0
+            else:
+                fails_in_row += 1
 
-        # 更新失败记录文件
-        save_failed_record(still_failed)
         save_record_safe()
-
-        log(f"✅ 重试完成：成功 {success_count} 个，仍失败 {len(still_failed)} 个", category="refresh")
+        log(
+            f"✅ 重试完成：成功 {success_count} 个，仍失败 {get_pending_retry_count()} 个",
+            category="refresh",
+        )
 
     except Exception as e:
         log(f"💥 重试异常：{e}", category="refresh")
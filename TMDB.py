@@ -4,11 +4,14 @@ import json
 import time
 import re
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import queue
 import tkinter as tk
 from tkinter import scrolledtext, ttk
 import sys
 
+import image_store
+import work_queue
+
 # ============================
 # 配置区
 # ============================
@@ -23,10 +26,27 @@ else:
 RECORD_FILE = os.path.join(BASE_DIR, "downloaded.json")
 
 MAX_WORKERS = 8
+IMAGE_QUEUE_SIZE = 64  # 全局图片队列上限，满了会阻塞解析新电影（背压）
+MOVIE_QUEUE_SIZE = 60  # 预取的待解析电影上限（约 3 页）
+METADATA_WORKERS = 2  # 并行解析 /images 元数据的线程数
 POPULAR_MAX_PAGES = 500
+# 模式：
+#   "popular" -> 热门电影
+#   "upgrade" -> 把之前按预览尺寸保存的剧照升级为原图
 MODE = "popular"
 
 BASE_URL = "https://api.themoviedb.org/3"
+IMG_BASE = "https://image.tmdb.org/t/p/"
+
+# 图片尺寸策略（利用 /images 返回的 width/height/aspect_ratio）：
+#   "original" -> 总是下载原图（旧行为）
+#   "adaptive" -> 宽度 >= ORIGINAL_MIN_WIDTH 的下原图，其余下 PREVIEW_SIZE
+#   "preview"  -> 第一遍统一下 PREVIEW_SIZE，之后用 MODE = "upgrade" 再补原图
+IMAGE_SIZE_POLICY = "adaptive"
+PREVIEW_SIZE = "w1280"
+PREVIEW_WIDTH = 1280  # PREVIEW_SIZE 对应的宽度，原图不比它宽时直接下原图
+ORIGINAL_MIN_WIDTH = 3840
+UPGRADE_MIN_WIDTH = 0  # upgrade 模式只升级宽度不低于此值的图，0 表示全部升级
 
 # ============================
 # 全局状态
@@ -43,6 +63,12 @@ is_downloading = False
 download_thread = None
 state_lock = threading.Lock()
 
+# 全局图片线程池：跨电影共享，避免每部电影单独建/拆线程池
+image_queue = None
+image_workers = []
+stats_lock = threading.Lock()
+inflight_movie_ids = set()  # 已入队但图片还没下完的电影
+
 
 # ============================
 # GUI
@@ -198,6 +224,29 @@ def load_record():
     return {"movie_ids": [], "images": {}}
 
 
+def choose_image_size(img):
+    """根据尺寸策略和图片元数据，返回 TMDB 尺寸名（如 "w1280" / "original"）"""
+    if IMAGE_SIZE_POLICY == "original":
+        return "original"
+
+    width = img.get("width") or 0
+    if not width:
+        height = img.get("height") or 0
+        aspect = img.get("aspect_ratio") or 0
+        width = int(height * aspect) if height and aspect else 0
+
+    # 缺元数据，或原图本身不比预览尺寸大，下预览也省不了流量
+    if not width or width <= PREVIEW_WIDTH:
+        return "original"
+
+    if IMAGE_SIZE_POLICY == "preview":
+        return PREVIEW_SIZE
+
+    if width >= ORIGINAL_MIN_WIDTH:
+        return "original"
+    return PREVIEW_SIZE
+
+
 def save_record_safe():
     if record is None:
         return
@@ -210,30 +259,155 @@ def save_record_safe():
 # 下载单张图片
 # ============================
 def download_one_image(job):
+    global session_new_images
+
     img_url = job["img_url"]
     save_path = job["save_path"]
     mid = job["movie_id_str"]
     fp = job["file_path"]
 
     try:
-        img_data = safe_get(img_url, stream=True).content
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        with open(save_path, "wb") as f:
-            f.write(img_data)
+        resp = safe_get(img_url, stream=True)
+        image_store.write_image(
+            save_path, resp.iter_content(image_store.CHUNK_SIZE), source="tmdb", movie_id=mid, key=fp
+        )
 
         with record_lock:
-            record["images"][mid].append(fp)
+            if fp not in record["images"][mid]:
+                record["images"][mid].append(fp)
+            # 记录每张图保存时的尺寸，供 upgrade 模式按需升级
+            record.setdefault("image_sizes", {})[fp] = {
+                "size": job["size"],
+                "width": job.get("width", 0),
+                "path": save_path,
+            }
+
+        with stats_lock:
+            session_new_images += 1
 
         log("  ✔ 已保存：" + save_path)
     except Exception as e:
         log(f"  ❌ 下载失败：{img_url} 错误：{e}")
 
 
+def forget_image(mid_str, fp):
+    """完整性校验发现坏图：从记录里去掉，电影移出已完成列表，下次运行会重新下载缺的图"""
+    forget_images(mid_str, [fp])
+
+
+def forget_images(mid_str, fps, save=True):
+    """同 forget_image，一次去掉一部电影的多张；save=False 时由调用方最后统一 save_record_safe()"""
+    global record
+    drop = set(fps)
+    with record_lock:
+        if record is None:
+            record = load_record()
+        keys = record["images"].get(mid_str, [])
+        keys[:] = [k for k in keys if k not in drop]
+        sizes = record.get("image_sizes", {})
+        for fp in drop:
+            sizes.pop(fp, None)
+        if int(mid_str) in record["movie_ids"]:
+            record["movie_ids"].remove(int(mid_str))
+    if save:
+        save_record_safe()
+
+
+def _on_write_failed(result, error):
+    """后台写盘失败：已记上的图从记录里去掉，电影回到待下载（升级原图时没有 movie_id，原文件还在，不用管）"""
+    if result.get("source") == "tmdb" and result.get("movie_id") and result.get("key"):
+        forget_images(str(result["movie_id"]), [result["key"]])
+
+
+image_store.add_failure_listener(_on_write_failed)
+
+
+def adopt_images(mid_str, fps, save=True):
+    """对账发现磁盘上有、记录里没有的图：补进记录，以后不会重复下载（TMDB 和 MTime 的 key 都适用）"""
+    global record
+    with record_lock:
+        if record is None:
+            record = load_record()
+        keys = record["images"].setdefault(mid_str, [])
+        known = set(keys)
+        keys.extend(fp for fp in fps if fp not in known)
+    if save:
+        save_record_safe()
+
+
+# ============================
+# 全局图片线程池
+# ============================
+def paused():
+    return pause_requested
+
+
+def forget_inflight(movie_id):
+    """暂停时丢弃了部分图片，不归档，下次继续"""
+    with record_lock:
+        inflight_movie_ids.discard(movie_id)
+
+
+def finish_movie(movie_id, title):
+    with record_lock:
+        inflight_movie_ids.discard(movie_id)
+        if movie_id in record["movie_ids"]:
+            return
+        record["movie_ids"].append(movie_id)
+    session_new_movies.append(title)
+    save_record_safe()
+
+
+def image_worker_loop():
+    while True:
+        item = image_queue.get()
+        try:
+            if item is None:
+                return
+            job, countdown = item
+            if pause_requested:
+                countdown.done_one(aborted=True)
+                continue
+            download_one_image(job)
+            countdown.done_one()
+        except Exception as e:
+            log(f"  ⚠ 图片线程异常：{e}")
+        finally:
+            image_queue.task_done()
+
+
+def start_image_pool():
+    global image_queue, image_workers
+    image_queue = queue.Queue(maxsize=IMAGE_QUEUE_SIZE)
+    image_workers = []
+    for i in range(MAX_WORKERS):
+        t = threading.Thread(
+            target=image_worker_loop, daemon=True, name=f"TMDB-Image-{i}"
+        )
+        t.start()
+        image_workers.append(t)
+
+
+def stop_image_pool():
+    """等队列里的图片全部处理完，再让线程退出"""
+    global image_queue, image_workers
+    if image_queue is None:
+        return
+    image_queue.join()
+    for _ in image_workers:
+        image_queue.put(None)
+    for t in image_workers:
+        t.join()
+    image_queue = None
+    image_workers = []
+
+
 # ============================
 # 下载一部电影
 # ============================
 def download_movie_images(movie_id, title):
-    global record, session_new_images, pause_requested
+    """解析一部电影的剧照并投递到全局线程池；返回是否已投递/完成"""
+    global record, pause_requested
 
     mid_str = str(movie_id)
     safe_title = clean_filename(title)
@@ -263,7 +437,8 @@ def download_movie_images(movie_id, title):
         if fp in existing:
             continue
 
-        img_url = "https://image.tmdb.org/t/p/original" + fp
+        size = choose_image_size(img)
+        img_url = IMG_BASE + size + fp
         save_path = os.path.join(raw_dir, fp.replace("/", ""))
         jobs.append(
             {
@@ -271,53 +446,166 @@ def download_movie_images(movie_id, title):
                 "save_path": save_path,
                 "movie_id_str": mid_str,
                 "file_path": fp,
+                "size": size,
+                "width": img.get("width") or 0,
             }
         )
 
+    if pause_requested:
+        return False
+
     if not jobs:
         log("  ⏭ 无新剧照")
+        finish_movie(movie_id, title)
         return True
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-        for _ in ex.map(download_one_image, jobs):
-            pass
-
-    session_new_images += len(jobs)
+    with record_lock:
+        inflight_movie_ids.add(movie_id)
+
+    countdown = work_queue.MovieCountdown(
+        len(jobs),
+        lambda: finish_movie(movie_id, title),
+        on_abort=lambda: forget_inflight(movie_id),
+    )
+    for job in jobs:
+        # 队列满时在这里阻塞，等线程池消化
+        image_queue.put((job, countdown))
     return True
 
 
 # ============================
 # 热门模式
 # ============================
-def run_popular_mode():
-    global record, session_new_movies, pause_requested
+def popular_lister(movie_queue, n_consumers):
+    """第一段：提前翻页，把待处理电影放入有界队列"""
+    seen = set()
+    try:
+        for page in range(1, POPULAR_MAX_PAGES + 1):
+            if pause_requested:
+                return
 
-    for page in range(1, POPULAR_MAX_PAGES + 1):
-        if pause_requested:
+            resp = safe_get(
+                f"{BASE_URL}/movie/popular", params={"api_key": API_KEY, "page": page}
+            )
+            movies = resp.json().get("results", [])
+            if not movies:
+                log("无更多热门电影")
+                return
+
+            for m in movies:
+                movie_id = m["id"]
+                if movie_id in seen:
+                    continue
+                seen.add(movie_id)
+
+                with record_lock:
+                    if movie_id in record["movie_ids"] or movie_id in inflight_movie_ids:
+                        continue
+
+                if not work_queue.put_until_paused(
+                    movie_queue, (movie_id, m.get("title") or "无标题"), paused
+                ):
+                    return
+    except Exception as e:
+        log(f"⚠ 热门列表线程异常：{e}")
+    finally:
+        for _ in range(n_consumers):
+            movie_queue.put(None)
+
+
+def popular_resolver(movie_queue):
+    """第二段：解析每部电影的 /images 元数据，把图片投递到全局线程池"""
+    while True:
+        item = movie_queue.get()
+        if item is None:
             return
+        if pause_requested:
+            # 暂停后只把队列取空，等列表线程发结束信号
+            continue
+
+        movie_id, title = item
+        try:
+            # 归档由 MovieCountdown 在该电影最后一张图完成时处理
+            download_movie_images(movie_id, title)
+        except Exception as e:
+            log(f"  ⚠ 解析《{title}》失败：{e}")
 
-        resp = safe_get(
-            f"{BASE_URL}/movie/popular", params={"api_key": API_KEY, "page": page}
+
+def run_popular_mode():
+    """
+    三段流水线：翻页 → /images 元数据 → 图片下载（全局线程池），
+    段与段之间用有界队列连接，下游跟不上时上游自动阻塞。
+    """
+    movie_queue = queue.Queue(maxsize=MOVIE_QUEUE_SIZE)
+
+    resolvers = [
+        threading.Thread(
+            target=popular_resolver, args=(movie_queue,), daemon=True, name=f"TMDB-Meta-{i}"
         )
-        movies = resp.json().get("results", [])
+        for i in range(METADATA_WORKERS)
+    ]
+    lister = threading.Thread(
+        target=popular_lister,
+        args=(movie_queue, len(resolvers)),
+        daemon=True,
+        name="TMDB-Lister",
+    )
 
-        for m in movies:
-            if pause_requested:
-                return
+    for t in resolvers:
+        t.start()
+    lister.start()
+
+    lister.join()
+    for t in resolvers:
+        t.join()
+
+
+# ============================
+# 升级模式：预览图 → 原图
+# ============================
+def run_upgrade_mode():
+    global pause_requested
+
+    with record_lock:
+        sizes = record.get("image_sizes", {})
+        jobs = []
+        for fp, info in sizes.items():
+            if info.get("size") == "original":
+                continue
+            width = info.get("width") or 0
+            # 只升级原图确实更大、且达到升级门槛的
+            if width and (width <= PREVIEW_WIDTH or width < UPGRADE_MIN_WIDTH):
+                continue
+            jobs.append((fp, dict(info)))
 
-            movie_id = m["id"]
-            title = m.get("title") or "无标题"
+    if not jobs:
+        log("⏭ 没有需要升级为原图的剧照")
+        return
+
+    log(f"⬆ 待升级为原图：{len(jobs)} 张")
+
+    for i, (fp, info) in enumerate(jobs, 1):
+        if pause_requested:
+            return
+
+        save_path = info["path"]
+        try:
+            resp = safe_get(IMG_BASE + "original" + fp, stream=True)
+            image_store.write_image(
+                save_path,
+                resp.iter_content(image_store.CHUNK_SIZE),
+                source="tmdb",
+                key=fp,
+            )
 
             with record_lock:
-                if movie_id in record["movie_ids"]:
-                    continue
+                record["image_sizes"][fp]["size"] = "original"
+            log("  ⬆ 已升级：" + save_path)
+        except Exception as e:
+            log(f"  ❌ 升级失败：{fp} 错误：{e}")
 
-            ok = download_movie_images(movie_id, title)
-            if ok:
-                with record_lock:
-                    record["movie_ids"].append(movie_id)
-                session_new_movies.append(title)
-                save_record_safe()
+        if i % 50 == 0:
+            save_record_safe()
 
 
 # ============================
@@ -336,7 +624,13 @@ def download_worker():
             record = load_record()
 
     if MODE == "popular":
-        run_popular_mode()
+        start_image_pool()
+        try:
+            run_popular_mode()
+        finally:
+            stop_image_pool()
+    elif MODE == "upgrade":
+        run_upgrade_mode()
 
     save_record_safe()
 
@@ -1,4 +1,5 @@
 import json
+import multiprocessing
 import os
 import sys
 import threading
@@ -8,11 +9,35 @@ from tkinter import scrolledtext, ttk
 import TMDB
 import MTime
 import douban
+import image_store
 import maoyan
+import phash_index
+import thumbnails
+import transcode
+import verify
 
 
 CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dashboard_ui_config.json")
 
+# 后台后处理池（各自一个进程池，吃 CPU/内存），界面里默认都不开；
+# 需要时在 dashboard_ui_config.json 里写 "postprocess": {"verify": true, ...}
+POSTPROCESS_DEFAULTS = {"verify": False, "phash": False, "thumbnails": False, "transcode": False}
+POSTPROCESS_MODULES = {"verify": verify, "phash": phash_index, "thumbnails": thumbnails, "transcode": transcode}
+
+
+def load_postprocess_flags():
+    flags = dict(POSTPROCESS_DEFAULTS)
+    try:
+        if os.path.exists(CONFIG_PATH):
+            with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f) or {}
+            for k, v in (data.get("postprocess") or {}).items():
+                if k in flags and isinstance(v, bool):
+                    flags[k] = v
+    except Exception:
+        pass
+    return flags
+
 
 class LogView:
     def __init__(self, parent):
@@ -433,6 +458,7 @@ class DashboardApp:
             self.maoyan_var_source,
             "正在热映",
             "即将上映",
+            "TMDB 待下载列表",
         )
         self.maoyan_opt_source.pack(side="left", padx=(6, 0), fill="x", expand=True)
 
@@ -478,6 +504,9 @@ class DashboardApp:
         if source == "即将上映":
             return "__AUTO_COMING__"
 
+        if source == "TMDB 待下载列表":
+            return "__AUTO_TMDB__"
+
         return "__AUTO_HOT__"
 
     def _build_douban_controls(self, parent):
@@ -708,8 +737,17 @@ class DashboardApp:
 
 
 def main():
-    app = DashboardApp()
-    app.start()
+    # 打包后的 exe 里用进程池（校验、感知哈希、缩略图等后处理）需要先调用
+    multiprocessing.freeze_support()
+    flags = load_postprocess_flags()
+    started = [name for name, on in flags.items() if on and POSTPROCESS_MODULES[name].start()]
+    try:
+        app = DashboardApp()
+        app.start()
+    finally:
+        image_store.flush()
+        for name in reversed(started):
+            POSTPROCESS_MODULES[name].stop()
 
 
 if __name__ == "__main__":
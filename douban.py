@@ -10,6 +10,10 @@ from tkinter import scrolledtext
 from bs4 import BeautifulSoup
 from datetime import datetime
 
+import image_keys
+import image_store
+import resolver
+
 # ============================
 # ✅ 基本配置（你只需要改这里）
 # copy(document.cookie)
@@ -24,6 +28,7 @@ COOKIE_FILE = "last_cookie.txt"
 RECORD_FILE = "douban_downloaded.json"
 
 SEARCH_API = "https://movie.douban.com/j/search_subjects"
+SUGGEST_API = "https://movie.douban.com/j/subject_suggest"
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
@@ -143,6 +148,17 @@ def load_record():
         record["daily"] = {}
     if "completed" not in record:
         record["completed"] = {}
+    if record.get("key_version", 1) < image_keys.KEY_VERSION:
+        migrate_record_keys()
+
+
+def migrate_record_keys():
+    """旧记录按完整 URL 记图：换成规范的图片 id，同一张图的不同 URL 合并成一条"""
+    merged = image_keys.migrate_photos("douban", record["photos"])
+    record["key_version"] = image_keys.KEY_VERSION
+    if merged:
+        log(f"🔑 记录已迁移为规范图片 id，合并重复 {merged} 条")
+    save_record()
 
 
 def save_record():
@@ -161,6 +177,36 @@ def mark_subject_completed(subject_id, title, rate=""):
         }
 
 
+def forget_photo(subject_id, url):
+    """完整性校验发现坏图：从记录里去掉，并取消该条目的完成标记，下次运行会重新下载"""
+    if not is_running:
+        load_record()
+    forget_photos(subject_id, [url])
+
+
+def forget_photos(subject_id, urls, save=True):
+    """
+    去掉记录里的这些图（URL 或图片 id 都行）并取消该条目的完成标记，下次运行会重新检查（磁盘上已有的文件直接补进记录，不重下）
+    urls 为空时只取消完成标记；save=False 时由调用方先 load_record()、最后统一 save_record()
+    """
+    drop = {image_keys.douban_key(u) for u in urls}
+    with record_lock:
+        photos = record["photos"].get(str(subject_id), [])
+        photos[:] = [k for k in photos if k not in drop]
+        record.get("completed", {}).pop(str(subject_id), None)
+    if save:
+        save_record()
+
+
+def _on_write_failed(result, error):
+    """后台写盘失败：从记录里去掉并取消完成标记，下次运行重新下载"""
+    if result.get("source") == "douban" and result.get("movie_id") and result.get("key"):
+        forget_photos(result["movie_id"], [result["key"]])
+
+
+image_store.add_failure_listener(_on_write_failed)
+
+
 # ============================
 # ✅ 统计函数（你要求的 4 大核心统计）
 # ============================
@@ -252,6 +298,43 @@ def get_variety_subjects(page=0):
     return result
 
 
+# ============================
+# 按片名搜索（供 resolver 解析 TMDB 电影）
+# ============================
+
+
+def search_subject_candidates(keyword):
+    keyword = (keyword or "").strip()
+    if not keyword:
+        return []
+
+    data = safe_json_request(SUGGEST_API, params={"q": keyword})
+    if data is None:
+        return None  # 请求失败（403/网络/超时），与“没搜到”区分开
+    if not isinstance(data, list):
+        return []
+
+    result = []
+    for item in data:
+        if item.get("type") not in (None, "movie"):
+            continue
+        if not item.get("id"):
+            continue
+        result.append(
+            {
+                "id": item["id"],
+                "titles": [item.get("title", ""), item.get("sub_title", "")],
+                "year": item.get("year", ""),
+            }
+        )
+    return result
+
+
+def resolver_search(movie, cancel=None):
+    """供 resolver 调用的豆瓣搜索入口：中文名、英文名依次搜，用共享打分器选最佳"""
+    return resolver.search_by_titles(movie, search_subject_candidates, cancel=cancel, pause=MIN_DELAY)
+
+
 # ============================
 # ✅ 剧照解析
 # ============================
@@ -268,10 +351,15 @@ def get_photos_page(subject_id, start=0):
     imgs = soup.select("ul.poster-col3 li img")
 
     result = []
+    seen = set()
     for img in imgs:
         src = img.get("src")
         if src:
-            large = src.replace("/m/public/", "/l/public/")
+            large = image_keys.douban_best_url(src)
+            key = image_keys.douban_key(large)
+            if key in seen:
+                continue
+            seen.add(key)
             pid = large.split("/")[-1]
             result.append((pid, large))
 
@@ -279,17 +367,19 @@ def get_photos_page(subject_id, start=0):
     return result, has_next
 
 
-def download_file(url, folder, filename):
+def download_file(url, folder, filename, movie_id="", key=""):
     path = os.path.join(folder, filename)
-    if os.path.exists(path):
+    if image_store.exists(path):
         return True
 
     try:
-        r = requests.get(url, headers=HEADERS, timeout=20)
-        if r.status_code == 200:
-            with open(path, "wb") as f:
-                f.write(r.content)
-            return True
+        # with：非 200 或写盘出错时也把流式连接还回连接池
+        with requests.get(url, headers=HEADERS, timeout=20, stream=True) as r:
+            if r.status_code == 200:
+                image_store.write_image(
+                    path, r.iter_content(image_store.CHUNK_SIZE), source="douban", movie_id=movie_id, key=key, url=url
+                )
+                return True
     except:
         pass
     return False
@@ -370,7 +460,7 @@ def worker_main():
                         known = set(record.get("photos", {}).get(sid, []))
                     all_known = True
                     for _pid, _url in photos:
-                        if _url not in known:
+                        if image_keys.douban_key(_url) not in known:
                             all_known = False
                             break
                     if all_known:
@@ -379,12 +469,13 @@ def worker_main():
                         break
 
                 for pid, url in photos:
+                    key = image_keys.douban_key(url)
                     with record_lock:
-                        if url in record["photos"][sid]:
+                        if key in record["photos"][sid]:
                             skip_cnt += 1
                             continue
 
-                    if download_file(url, save_path, pid):
+                    if download_file(url, save_path, pid, movie_id=sid, key=key):
                         rel_path = os.path.relpath(os.path.join(save_path, pid), SAVE_DIR)
                         rel_path = rel_path.replace("\\", "/")
                         log(f"[douban]{rel_path}✔")
@@ -392,7 +483,7 @@ def worker_main():
                         new_cnt += 1
 
                         with record_lock:
-                            record["photos"][sid].append(url)
+                            record["photos"][sid].append(key)
 
                             today = today_key()
                             record["daily"].setdefault(today, 0)
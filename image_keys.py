@@ -0,0 +1,82 @@
+"""
+豆瓣 / 猫眼图片的规范 key
+
+同一张图会以不同的 URL 出现：
+- 猫眼：p0/p1.pipi.cn、p0.meituan.net 上的同一对象带着不同的 ?imageMogr2/... 处理参数
+  （quality/80、thumbnail/2500x2500> 等），旧接口还有 /w.h/ 尺寸占位
+- 豆瓣：img1–img9.doubanio.com 分片不同，/s/ /m/ /l/ 等尺寸目录不同
+记录里只存稳定的图片 id（猫眼的对象名、豆瓣的 pNNN），下载时统一请求最好的那个版本，只下一次。
+图片 id 就是磁盘上的文件名去掉扩展名，对账和路径反查都按它对齐。
+"""
+
+import os
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+
+KEY_VERSION = 2  # 记录里 "key_version" 低于此值时按完整 URL 记的，需要迁移
+
+DOUBAN_SIZE_DIR = re.compile(r"/view/photo/\w+/public/")
+DOUBAN_PHOTO_ID = re.compile(r"/(p\d+)\.\w+$")
+MAOYAN_SIZE_DIR = re.compile(r"/\d+\.\d+/|/w\.h/")
+
+
+def is_url(key):
+    return "/" in key
+
+
+def url_stem(url):
+    """URL 最后一段去掉查询参数和扩展名"""
+    name = urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1]
+    return os.path.splitext(name)[0]
+
+
+def douban_key(url):
+    """豆瓣剧照 id（p2512345678），与分片主机和尺寸目录无关"""
+    if not is_url(url):
+        return url
+    m = DOUBAN_PHOTO_ID.search(urlsplit(url).path)
+    return m.group(1) if m else url_stem(url)
+
+
+def douban_best_url(url):
+    """同一张剧照最好的公开版本：/l/public/ 大图（/raw/ 需要登录）"""
+    parts = urlsplit(url.strip())
+    path = DOUBAN_SIZE_DIR.sub("/view/photo/l/public/", parts.path)
+    return urlunsplit((parts.scheme or "https", parts.netloc, path, "", ""))
+
+
+def maoyan_key(url):
+    """猫眼图片对象名，与主机、imageMogr2 处理参数和尺寸占位无关"""
+    if not is_url(url):
+        return url
+    return url_stem(url)
+
+
+def maoyan_best_url(url):
+    """去掉 imageMogr2 等处理参数和 /w.h/ 尺寸占位，直接取原图"""
+    parts = urlsplit(url.strip())
+    path = MAOYAN_SIZE_DIR.sub("/", parts.path)
+    return urlunsplit((parts.scheme or "https", parts.netloc, path, "", ""))
+
+
+KEY_FUNCS = {"douban": douban_key, "maoyan": maoyan_key}
+
+
+def canonical(source, key):
+    """记录里的 key（新的图片 id 或旧的完整 URL）→ 图片 id"""
+    return KEY_FUNCS[source](key)
+
+
+def migrate_photos(source, photos):
+    """
+    把 {id: [URL 或 key]} 就地换成规范 key，同一张图的不同 URL 合并成一条
+    返回合并掉的条数
+    """
+    key_fn = KEY_FUNCS[source]
+    merged = 0
+    for sid, urls in photos.items():
+        keys = list(dict.fromkeys(key_fn(u) for u in urls))
+        merged += len(urls) - len(keys)
+        photos[sid] = keys
+    return merged
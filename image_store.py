@@ -0,0 +1,819 @@
+"""
+图片落盘的统一入口（TMDB / MTime / 豆瓣 / 猫眼 共用）
+
+默认直接写到目标路径（先写 .part 再改名）。打开 STORE_ENABLED 后改为内容寻址存储：
+- 边下载边算 SHA-256，字节先放内存（超过 BUFFER_LIMIT 才落临时文件）
+- blob 按哈希存在 STORE_DIR/ab/cd/<sha256><ext>，同样的字节只写一次；
+  重复图片在哈希算完时就能发现，不会再写第二份
+- 每部电影的目录按 STORE_MODE 生成：
+    "hardlink"：硬链接到 blob（跨盘或不支持硬链接时退回复制）
+    "manifest"：不建文件，只记在 manifest.jsonl 里，需要时用 `python image_store.py materialize` 导出
+- 无论哪种方式都往 manifest.jsonl 追加一行 {"path", "sha256", "size", "source", "movie_id", "key"}
+
+打开 PACK_ENABLED 后，PACK_SOURCES 里来源的小图（不超过 PACK_MAX_IMAGE）不再单独成文件，
+而是追加进打包文件 PACK_DIR/<电影目录或日期>.pack，旁边的 .idx.jsonl 每行记一张图的
+{"path", "offset", "length", "sha256", "source", "movie_id", "key"}：
+- read_image(path) 随机读取单张，exists(path) 同样认打包里的图
+- `python image_store.py export [目录]` 把打包的图按原路径导出成普通文件
+- 打包的图没有单独的文件，不经缩略图 / 感知哈希 / 完整性校验等后处理
+
+打开 WRITE_BEHIND 后，默认模式下的落盘交给专门的写盘线程：
+- 下载线程只负责收字节、算哈希，收完把内存里的数据（超过 BUFFER_LIMIT 的是临时文件）交出去就返回
+- 排队中的数据总量受 WRITE_BUFFER_BYTES 限制，写盘跟不上时下载线程在交接处等待
+- 写盘线程成批处理：建目录（同一目录只建一次）、写 .part、按 FSYNC_POLICY 刷盘、改名
+- 排队中的图 exists() / read_image() 也认；程序退出前 flush() 等队列写完
+写盘失败时通知 add_failure_listener() 注册的回调，各数据源在回调里把这张图从记录里去掉、重新排队；
+万一回调先于数据源记上 key 执行，留下的幽灵由 reconcile.py 对账时重新排队。
+
+每写完一张图都会通知 add_listener() 注册的回调（感知哈希、缩略图等后处理从这里接入）
+
+WRITE_CHECK（默认开）：边收边留住开头和结尾的字节，收完做一次不解码的快速检查——
+空文件、HTML 错误页、结尾找不到 EOI 的 JPEG 直接抛 CorruptImage，不落盘，数据源照下载失败处理、不记录；
+完整解码仍由 verify.py 负责。
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import shutil
+import hashlib
+import itertools
+import threading
+
+
+SAVE_DIR = r"D:\TMDB_剧照库"
+
+STORE_ENABLED = False  # True 时启用内容寻址存储
+STORE_DIR = os.path.join(SAVE_DIR, ".blobs")
+STORE_MODE = "hardlink"  # "hardlink" / "manifest"
+MANIFEST_FILE = os.path.join(STORE_DIR, "manifest.jsonl")
+
+PACK_ENABLED = False  # True 时小图追加进打包文件
+PACK_DIR = os.path.join(SAVE_DIR, ".packs")
+PACK_BY = "movie"  # "movie"：每部电影一个包；"day"：每天一个包
+PACK_SOURCES = ("douban", "maoyan")  # 哪些来源的图进包（空元组表示全部来源）
+PACK_MAX_IMAGE = 2 * 1024 * 1024  # 超过此大小的图照常写成单独文件
+
+WRITE_CHECK = True  # 写盘前快速检查文件头 / JPEG 结尾，坏的直接当下载失败
+CHECK_TAIL = 1024  # JPEG 的 EOI 要出现在最后这么多字节里（允许 EOI 后面跟少量多余数据）
+
+TRANSCODED_EXTS = (".webp", ".avif")  # transcode.py 转码后的扩展名，exists() 也认
+SKIP_FILE = os.path.join(SAVE_DIR, ".skip_paths.txt")  # 有意不要的图（近似重复被挪走等），exists() 当作已有、不再下载
+
+CHUNK_SIZE = 64 * 1024  # 流式下载每块大小
+BUFFER_LIMIT = 16 * 1024 * 1024  # 小于此大小的图片全程在内存里，重复的不落盘
+
+WRITE_BEHIND = False  # True 时默认模式的落盘交给后台写盘线程
+WRITER_THREADS = 1  # 机械盘 1 个即可；网络盘可以设 2
+WRITE_BUFFER_BYTES = 64 * 1024 * 1024  # 排队等写盘的数据上限
+WRITE_BATCH = 32  # 写盘线程每批最多处理的图片数
+FSYNC_POLICY = "batch"  # "none"：不刷盘；"batch"：一批写完统一刷盘再改名；"always"：每张写完立即刷盘
+
+
+manifest_lock = threading.Lock()
+manifest_paths = None  # manifest 模式下已登记的目标路径，exists() 用
+
+pack_lock = threading.Lock()
+pack_index = None  # normcase(相对路径) → (包名, offset, length)
+
+skip_lock = threading.Lock()
+skip_paths = None  # normcase(相对路径) 集合，见 SKIP_FILE
+
+stats_lock = threading.Lock()
+stats = {"written": 0, "dedup": 0, "bytes_saved": 0, "packed": 0, "write_failed": 0}
+
+_listeners = []
+_failure_listeners = []
+
+
+# ============================
+# 写入前快速检查
+# ============================
+
+MAGIC = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+
+
+class CorruptImage(ValueError):
+    """下载到的字节不是完整的图片（空文件、HTML 错误页、被截断的 JPEG）"""
+
+
+def sniff_format(head):
+    for magic, fmt in MAGIC:
+        if head.startswith(magic):
+            return fmt
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return "avif"
+    return ""
+
+
+def quick_check(head, tail):
+    """不解码的快速检查，返回坏的原因，看不出问题返回空字符串；认不出格式但不像 HTML 的放行，交给 verify"""
+    if not head:
+        return "empty"
+    fmt = sniff_format(head)
+    if not fmt and head.lstrip().startswith(b"<"):
+        return "html"
+    if fmt == "jpeg" and b"\xff\xd9" not in tail.rstrip(b"\x00\r\n "):
+        return "truncated"
+    return ""
+
+
+def _checked(chunks):
+    """透传字节块，最后一块之后做 quick_check，坏了就在迭代里抛 CorruptImage（各写入路径都会清理半成品）"""
+    head = b""
+    tail = b""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if len(head) < 16:
+            head += chunk[: 16 - len(head)]
+        tail = chunk[-CHECK_TAIL:] if len(chunk) >= CHECK_TAIL else (tail + chunk)[-CHECK_TAIL:]
+        yield chunk
+    reason = quick_check(head, tail)
+    if reason:
+        raise CorruptImage(reason)
+
+
+def add_listener(fn):
+    """fn(result)：每张图写完后调用，result 同 write_image() 的返回值"""
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+
+def remove_listener(fn):
+    if fn in _listeners:
+        _listeners.remove(fn)
+
+
+def _notify(result):
+    for fn in list(_listeners):
+        try:
+            fn(result)
+        except Exception as e:
+            print(f"⚠ 图片写入回调出错：{e}")
+
+
+def add_failure_listener(fn):
+    """fn(result, error)：后台写盘失败时调用（write_image() 早已返回），数据源据此取消记录"""
+    if fn not in _failure_listeners:
+        _failure_listeners.append(fn)
+
+
+def _notify_failure(result, error):
+    for fn in list(_failure_listeners):
+        try:
+            fn(result, error)
+        except Exception as e:
+            print(f"⚠ 写盘失败回调出错：{e}")
+
+
+def movie_folder(path):
+    """图片所属的电影目录名（SAVE_DIR 下的第一级目录），不在 SAVE_DIR 下返回 ""。"""
+    try:
+        rel = os.path.relpath(path, SAVE_DIR)
+    except ValueError:
+        return ""
+    parts = rel.replace("\\", "/").split("/")
+    if len(parts) < 2 or parts[0] in ("..", "") or parts[0].startswith("."):
+        return ""
+    return parts[0]
+
+
+def blob_path(sha256, ext=""):
+    return os.path.join(STORE_DIR, sha256[:2], sha256[2:4], sha256 + ext.lower())
+
+
+def _write_plain(dest_path, chunks):
+    """不启用存储时：流式写到 .part，边写边算哈希，写完改名"""
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    tmp = dest_path + ".part"
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                h.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        os.replace(tmp, dest_path)
+    except Exception:
+        # 下载中途断开/磁盘写满：不留下半截的 .part
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return h.hexdigest(), size
+
+
+def _hash_stream(chunks):
+    """
+    边收边算 SHA-256；小图留在内存，大图超过 BUFFER_LIMIT 后转存到 STORE_DIR/tmp
+    返回 (sha256, size, 内存数据或 None, 临时文件路径或 None)
+    """
+    h = hashlib.sha256()
+    size = 0
+    buf = []
+    spill = None
+    spill_path = None
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            h.update(chunk)
+            size += len(chunk)
+            if spill is not None:
+                spill.write(chunk)
+                continue
+            buf.append(chunk)
+            if size > BUFFER_LIMIT:
+                tmp_dir = os.path.join(STORE_DIR, "tmp")
+                os.makedirs(tmp_dir, exist_ok=True)
+                spill_path = os.path.join(tmp_dir, uuid.uuid4().hex + ".part")
+                spill = open(spill_path, "wb")
+                spill.writelines(buf)
+                buf = []
+    except Exception:
+        if spill is not None:
+            spill.close()
+            os.remove(spill_path)
+        raise
+    if spill is not None:
+        spill.close()
+        return h.hexdigest(), size, None, spill_path
+    return h.hexdigest(), size, b"".join(buf), None
+
+
+def _store_blob(sha256, ext, data, spill_path):
+    """blob 不存在才写入；返回 (blob 路径, 是否重复)"""
+    path = blob_path(sha256, ext)
+    if os.path.exists(path):
+        if spill_path:
+            os.remove(spill_path)
+        return path, True
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if spill_path:
+        os.replace(spill_path, path)
+    else:
+        tmp = f"{path}.{uuid.uuid4().hex}.part"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return path, False
+
+
+def _link_or_copy(src, dest_path):
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    tmp = f"{dest_path}.{uuid.uuid4().hex}.part"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest_path)
+
+
+def _append_manifest(entry):
+    global manifest_paths
+    with manifest_lock:
+        os.makedirs(STORE_DIR, exist_ok=True)
+        with open(MANIFEST_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        if manifest_paths is not None:
+            manifest_paths.add(os.path.normcase(entry["path"]))
+
+
+def iter_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return
+    with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+# ============================
+# 写盘线程（WRITE_BEHIND）
+# ============================
+
+_write_queue = queue.Queue()
+_writers = []
+_writers_lock = threading.Lock()
+_budget = threading.Condition()
+_inflight_bytes = 0
+_pending = {}  # normcase(目标路径) → 排队中的任务
+_known_dirs = set()  # 已确认存在的目录，避免每张图都 makedirs（WRITER_THREADS > 1 时多线程共用）
+_known_dirs_lock = threading.Lock()
+_atexit_registered = False
+
+
+def _acquire_budget(n):
+    """排队数据超过 WRITE_BUFFER_BYTES 时等写盘线程腾出空间（单张超限的图在队列空时放行）"""
+    global _inflight_bytes
+    with _budget:
+        while _inflight_bytes and _inflight_bytes + n > WRITE_BUFFER_BYTES:
+            _budget.wait()
+        _inflight_bytes += n
+
+
+def _release_budget(n):
+    global _inflight_bytes
+    with _budget:
+        _inflight_bytes -= n
+        _budget.notify_all()
+
+
+def _ensure_dir(folder):
+    with _known_dirs_lock:
+        if folder in _known_dirs:
+            return
+    os.makedirs(folder, exist_ok=True)
+    with _known_dirs_lock:
+        _known_dirs.add(folder)
+
+
+def _fsync_dir(folder):
+    """POSIX 下改名后刷目录项；Windows 不支持打开目录，跳过"""
+    if os.name != "posix":
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _finish_job(job, error=None):
+    """每个任务恰好收尾一次：撤出 _pending、归还预算、通知成功或失败回调"""
+    if job.get("finished"):
+        return
+    job["finished"] = True
+    with manifest_lock:
+        key = os.path.normcase(job["result"]["path"])
+        if _pending.get(key) is job:
+            del _pending[key]
+    _release_budget(job["cost"])
+    if error is not None:
+        for tmp in (job.get("tmp"), job.get("spill")):
+            if tmp and os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+        with stats_lock:
+            stats["write_failed"] += 1
+        print(f"⚠ 写盘失败：{job['result']['path']} {error}")
+        _notify_failure(job["result"], error)
+        return
+    _notify(job["result"])
+
+
+def _write_batch(batch):
+    """一批：建目录 → 写 .part → 按策略刷盘 → 改名；单张出错不影响同批其它图"""
+    staged = []
+    for job in batch:
+        dest = job["result"]["path"]
+        try:
+            _ensure_dir(os.path.dirname(dest))
+            if job["data"] is None:
+                tmp = job["spill"]
+            else:
+                tmp = job["tmp"] = f"{dest}.{uuid.uuid4().hex}.part"
+                with open(tmp, "wb") as f:
+                    f.write(job["data"])
+                    if FSYNC_POLICY == "always":
+                        f.flush()
+                        os.fsync(f.fileno())
+            staged.append((job, tmp))
+        except Exception as e:
+            _finish_job(job, e)
+
+    if FSYNC_POLICY == "batch":
+        for job, tmp in list(staged):
+            try:
+                with open(tmp, "rb+") as f:
+                    os.fsync(f.fileno())
+            except Exception as e:
+                staged.remove((job, tmp))
+                _finish_job(job, e)
+
+    folders = set()
+    for job, tmp in staged:
+        dest = job["result"]["path"]
+        try:
+            os.replace(tmp, dest)
+            folders.add(os.path.dirname(dest))
+        except Exception as e:
+            _finish_job(job, e)
+            continue
+        with stats_lock:
+            stats["written"] += 1
+        _finish_job(job)
+
+    if FSYNC_POLICY != "none":
+        for folder in folders:
+            try:
+                _fsync_dir(folder)
+            except OSError:
+                pass
+
+
+def _writer_loop():
+    while True:
+        job = _write_queue.get()
+        if job is None:
+            _write_queue.task_done()
+            return
+        batch = [job]
+        stopping = False
+        while len(batch) < WRITE_BATCH:
+            try:
+                job = _write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                stopping = True
+                break
+            batch.append(job)
+        try:
+            _write_batch(batch)
+        except Exception as e:
+            print(f"⚠ 写盘线程出错：{e}")
+            # 没收尾的任务不能留在 _pending 里（exists() 会一直当作已有）、也不能占着预算
+            for job in batch:
+                _finish_job(job, e)
+        for _ in range(len(batch) + stopping):
+            _write_queue.task_done()
+        if stopping:
+            return
+
+
+def _ensure_writers():
+    global _atexit_registered
+    with _writers_lock:
+        alive = [t for t in _writers if t.is_alive()]
+        if not _atexit_registered:
+            atexit.register(flush)
+            _atexit_registered = True
+        for i in range(len(alive), WRITER_THREADS):
+            t = threading.Thread(target=_writer_loop, name=f"image-writer-{i}", daemon=True)
+            t.start()
+            alive.append(t)
+        _writers[:] = alive
+
+
+def _write_behind(dest_path, chunks, result):
+    """在下载线程里收完字节、算好哈希，交给写盘线程；返回时文件可能还没落盘"""
+    sha256, size, data, spill_path = _hash_stream(chunks)
+    result.update(sha256=sha256, size=size)
+    job = {"result": result, "data": data, "spill": spill_path, "cost": size if data is not None else 0}
+    _acquire_budget(job["cost"])
+    with manifest_lock:
+        _pending[os.path.normcase(dest_path)] = job
+    _ensure_writers()
+    _write_queue.put(job)
+    return result
+
+
+def flush():
+    """等排队中的图全部落盘（退出前调用）"""
+    if _writers:
+        _write_queue.join()
+
+
+def stop_writers():
+    flush()
+    with _writers_lock:
+        for _ in _writers:
+            _write_queue.put(None)
+        _writers.clear()
+
+
+# ============================
+# 打包存储：小图追加进 .pack，.idx.jsonl 记偏移
+# ============================
+
+
+def _pack_key(path):
+    return os.path.normcase(os.path.relpath(path, SAVE_DIR))
+
+
+def pack_files(name):
+    return os.path.join(PACK_DIR, name + ".pack"), os.path.join(PACK_DIR, name + ".idx.jsonl")
+
+
+def iter_pack_names():
+    if not os.path.isdir(PACK_DIR):
+        return []
+    return sorted(n[: -len(".idx.jsonl")] for n in os.listdir(PACK_DIR) if n.endswith(".idx.jsonl"))
+
+
+def iter_packed(name=None):
+    """逐条产出打包索引：{"path"（绝对路径）, "pack", "offset", "length", ...}"""
+    for pack in [name] if name else iter_pack_names():
+        idx_path = pack_files(pack)[1]
+        if not os.path.exists(idx_path):
+            continue
+        with open(idx_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entry["pack"] = pack
+                entry["path"] = os.path.join(SAVE_DIR, entry["path"].replace("/", os.sep))
+                yield entry
+
+
+def _load_pack_index():
+    """调用方持有 pack_lock"""
+    global pack_index
+    if pack_index is None:
+        pack_index = {_pack_key(e["path"]): (e["pack"], e["offset"], e["length"]) for e in iter_packed()}
+    return pack_index
+
+
+def _wants_pack(source):
+    return PACK_ENABLED and (not PACK_SOURCES or source in PACK_SOURCES)
+
+
+def _pack_name(dest_path):
+    if PACK_BY == "day":
+        return time.strftime("%Y%m%d")
+    return movie_folder(dest_path) or "_misc"
+
+
+def _append_pack(dest_path, data, sha256, source, movie_id, key):
+    name = _pack_name(dest_path)
+    pack_path, idx_path = pack_files(name)
+    rel = os.path.relpath(dest_path, SAVE_DIR).replace("\\", "/")
+    with pack_lock:
+        index = _load_pack_index()
+        os.makedirs(PACK_DIR, exist_ok=True)
+        with open(pack_path, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+        # 先写数据再写索引：中途崩溃只会在包尾留下没有索引的字节，不会有指向半截数据的索引
+        entry = {
+            "path": rel,
+            "offset": offset,
+            "length": len(data),
+            "sha256": sha256,
+            "source": source,
+            "movie_id": str(movie_id),
+            "key": key,
+        }
+        with open(idx_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        index[_pack_key(dest_path)] = (name, offset, len(data))
+    return pack_path
+
+
+def _buffer_small(chunks):
+    """
+    把不超过 PACK_MAX_IMAGE 的图收进内存：返回 (数据, None)；
+    超过时返回 (None, 已收到的块 + 剩余块 的迭代器)，由调用方照常写文件
+    """
+    it = iter(chunks)
+    buf = []
+    size = 0
+    for chunk in it:
+        if not chunk:
+            continue
+        buf.append(chunk)
+        size += len(chunk)
+        if size > PACK_MAX_IMAGE:
+            return None, itertools.chain(buf, it)
+    return b"".join(buf), None
+
+
+def read_image(dest_path):
+    """读取一张图的字节：普通文件 / 打包 / manifest 模式的 blob 都支持；找不到抛 FileNotFoundError"""
+    with manifest_lock:
+        job = _pending.get(os.path.normcase(dest_path))
+    if job is not None and job["data"] is not None:
+        return job["data"]
+    if os.path.exists(dest_path):
+        with open(dest_path, "rb") as f:
+            return f.read()
+    with pack_lock:
+        hit = _load_pack_index().get(_pack_key(dest_path))
+    if hit:
+        name, offset, length = hit
+        with open(pack_files(name)[0], "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        if len(data) != length:
+            raise IOError(f"打包文件被截断：{name}")
+        return data
+    if STORE_ENABLED and STORE_MODE == "manifest":
+        for entry in iter_manifest():
+            if os.path.normcase(entry["path"]) == os.path.normcase(dest_path):
+                with open(blob_path(entry["sha256"], os.path.splitext(dest_path)[1]), "rb") as f:
+                    return f.read()
+    raise FileNotFoundError(dest_path)
+
+
+def export_packs(dest_root=None, name=None):
+    """把打包的图按原相对路径导出成普通文件（dest_root 默认 SAVE_DIR，已存在的跳过），返回导出数"""
+    dest_root = dest_root or SAVE_DIR
+    exported = 0
+    for pack in [name] if name else iter_pack_names():
+        pack_path = pack_files(pack)[0]
+        if not os.path.exists(pack_path):
+            continue
+        with open(pack_path, "rb") as src:
+            for entry in iter_packed(pack):
+                dest = os.path.join(dest_root, os.path.relpath(entry["path"], SAVE_DIR))
+                if os.path.exists(dest):
+                    continue
+                src.seek(entry["offset"])
+                data = src.read(entry["length"])
+                if len(data) != entry["length"]:
+                    print(f"⚠ 打包文件被截断：{pack} → {entry['path']}")
+                    continue
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                tmp = dest + ".part"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, dest)
+                exported += 1
+    return exported
+
+
+# ============================
+# 跳过标记：有意挪走/不要的图，各数据源不再重下
+# ============================
+
+
+def _skip_key(path):
+    return os.path.normcase(os.path.relpath(path, SAVE_DIR))
+
+
+def _load_skip_paths():
+    global skip_paths
+    if skip_paths is None:
+        skip_paths = set()
+        if os.path.exists(SKIP_FILE):
+            with open(SKIP_FILE, "r", encoding="utf-8") as f:
+                skip_paths.update(os.path.normcase(line.rstrip("\n")) for line in f if line.strip())
+    return skip_paths
+
+
+def mark_skipped(paths):
+    """把这些目标路径记成“不要了”：文件可以挪走或删掉，记录里的 key 保留，exists() 仍返回 True"""
+    with skip_lock:
+        known = _load_skip_paths()
+        new = [os.path.relpath(p, SAVE_DIR) for p in paths if _skip_key(p) not in known]
+        if not new:
+            return
+        with open(SKIP_FILE, "a", encoding="utf-8") as f:
+            for rel in new:
+                f.write(rel + "\n")
+        known.update(os.path.normcase(rel) for rel in new)
+
+
+def iter_skipped():
+    """跳过标记里的绝对路径"""
+    with skip_lock:
+        rels = list(_load_skip_paths())
+    for rel in rels:
+        yield os.path.join(SAVE_DIR, rel)
+
+
+def exists(dest_path):
+    """目标图片是否已存在：实际文件、排队等写盘、有意跳过、转码后的同名文件、已打包，或 manifest 模式下已登记"""
+    global manifest_paths
+    if os.path.exists(dest_path):
+        return True
+    if _pending:
+        with manifest_lock:
+            if os.path.normcase(dest_path) in _pending:
+                return True
+    with skip_lock:
+        if _skip_key(dest_path) in _load_skip_paths():
+            return True
+    stem, ext = os.path.splitext(dest_path)
+    if ext.lower() not in TRANSCODED_EXTS and any(os.path.exists(stem + e) for e in TRANSCODED_EXTS):
+        return True
+    if PACK_ENABLED or os.path.isdir(PACK_DIR):
+        with pack_lock:
+            if _pack_key(dest_path) in _load_pack_index():
+                return True
+    if not (STORE_ENABLED and STORE_MODE == "manifest"):
+        return False
+    with manifest_lock:
+        if manifest_paths is None:
+            manifest_paths = {os.path.normcase(e["path"]) for e in iter_manifest()}
+        return os.path.normcase(dest_path) in manifest_paths
+
+
+def write_image(dest_path, chunks, source="", movie_id="", key="", url=""):
+    """
+    把一张图片写到 dest_path。chunks 是字节块的可迭代对象（如 resp.iter_content(CHUNK_SIZE)）
+    返回 {"path", "file"（实际字节所在的文件，manifest 模式下是 blob，打包时是 .pack）, "sha256", "size", "dedup",
+          "source", "movie_id", "key", "url", "packed"}；下载或写入出错时抛异常，不留下半截文件
+    """
+    if WRITE_CHECK:
+        chunks = _checked(chunks)
+
+    if _wants_pack(source):
+        data, rest = _buffer_small(chunks)
+        if data is not None:
+            sha256 = hashlib.sha256(data).hexdigest()
+            pack_path = _append_pack(dest_path, data, sha256, source, movie_id, key)
+            with stats_lock:
+                stats["packed"] += 1
+            result = {"path": dest_path, "file": pack_path, "sha256": sha256, "size": len(data), "dedup": False}
+            result.update(source=source, movie_id=str(movie_id), key=key, url=url, packed=True)
+            return result
+        chunks = rest
+
+    if not STORE_ENABLED and WRITE_BEHIND:
+        result = {"path": dest_path, "file": dest_path, "dedup": False}
+        result.update(source=source, movie_id=str(movie_id), key=key, url=url, packed=False)
+        return _write_behind(dest_path, chunks, result)
+
+    if not STORE_ENABLED:
+        sha256, size = _write_plain(dest_path, chunks)
+        result = {"path": dest_path, "file": dest_path, "sha256": sha256, "size": size, "dedup": False}
+        result.update(source=source, movie_id=str(movie_id), key=key, url=url, packed=False)
+        _notify(result)
+        return result
+
+    sha256, size, data, spill_path = _hash_stream(chunks)
+    ext = os.path.splitext(dest_path)[1]
+    blob, dedup = _store_blob(sha256, ext, data, spill_path)
+
+    if STORE_MODE == "hardlink":
+        _link_or_copy(blob, dest_path)
+    _append_manifest(
+        {
+            "path": dest_path,
+            "sha256": sha256,
+            "size": size,
+            "source": source,
+            "movie_id": str(movie_id),
+            "key": key,
+        }
+    )
+
+    with stats_lock:
+        if dedup:
+            stats["dedup"] += 1
+            stats["bytes_saved"] += size
+        else:
+            stats["written"] += 1
+    file_path = dest_path if STORE_MODE == "hardlink" else blob
+    result = {"path": dest_path, "file": file_path, "sha256": sha256, "size": size, "dedup": dedup}
+    result.update(source=source, movie_id=str(movie_id), key=key, url=url, packed=False)
+    _notify(result)
+    return result
+
+
+def materialize(limit=None):
+    """按 manifest 把缺失的目标文件建出来（硬链接，不支持时复制），返回新建的数量"""
+    created = 0
+    for entry in iter_manifest():
+        if limit and created >= limit:
+            break
+        if os.path.exists(entry["path"]):
+            continue
+        blob = blob_path(entry["sha256"], os.path.splitext(entry["path"])[1])
+        if not os.path.exists(blob):
+            print(f"⚠ blob 缺失：{entry['sha256']} → {entry['path']}")
+            continue
+        _link_or_copy(blob, entry["path"])
+        created += 1
+    return created
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "materialize":
+        print(f"已导出 {materialize()} 个文件")
+    elif len(sys.argv) > 1 and sys.argv[1] == "export":
+        print(f"已导出 {export_packs(sys.argv[2] if len(sys.argv) > 2 else None)} 个打包的文件")
+    else:
+        print("用法：python image_store.py materialize | export [目录]")
@@ -0,0 +1,251 @@
+"""
+图库扫描：SAVE_DIR 下实际有哪些文件
+
+多线程 os.scandir 按电影目录并行扫描，结果写成紧凑的清单 SAVE_DIR/.library_manifest.jsonl，
+每行一个目录：
+    {"dir": 相对目录, "mtime": 目录 mtime_ns, "subdirs": [...],
+     "files": [[文件名, 大小, mtime, 来源, 电影 id], ...]}
+增量：目录的 mtime 没变（没有增删改名文件）就直接沿用上次的文件列表，只对变了的目录重新 scandir。
+各数据源都是先写 .part 再改名，新文件一定会改动所在目录的 mtime。
+
+来源和电影 id 按各数据源的目录约定 + 记录文件反查（见 Locator），查不到的留空。
+
+python library_scan.py [--full]   扫描并打印按电影 / 来源汇总的文件数和字节数
+"""
+
+import os
+import sys
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import image_keys
+import image_store
+
+
+SCAN_WORKERS = 8  # 并行扫描的电影目录数（机械盘/网络盘上 IO 等待为主，线程即可）
+MANIFEST_FILE = os.path.join(image_store.SAVE_DIR, ".library_manifest.jsonl")
+
+
+# ============================
+# 路径 → 来源 / 电影 id
+# ============================
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+class Locator:
+    """
+    按各数据源的目录约定和记录文件，把图库里的路径反查成 (source, movie_id, key, url)
+      <片名>/raw/<file>          → TMDB，key = "/" + 文件名
+      <片名>/MTime_<类型>/<id>.* → MTime，key = "mtime:<id>"
+      <片名>/<图片 id>.*         → 豆瓣或猫眼，按规范图片 id（image_keys）在两边记录里查
+    """
+
+    def __init__(self):
+        self.key_owner = None  # downloaded.json：key → TMDB movie id
+        self.photo_owner = None  # 图片 id → (source, id, 记录里的 key)
+        self.lock = threading.Lock()
+
+    def _load(self):
+        import TMDB
+        import douban
+        import maoyan
+
+        key_owner = {}
+        for mid, keys in _read_json(TMDB.RECORD_FILE).get("images", {}).items():
+            for k in keys:
+                key_owner[k] = mid
+
+        photo_owner = {}
+        for source, module in (("douban", douban), ("maoyan", maoyan)):
+            for sid, keys in _read_json(module.RECORD_FILE).get("photos", {}).items():
+                for k in keys:
+                    photo_owner.setdefault(image_keys.canonical(source, k), (source, sid, k))
+        self.key_owner, self.photo_owner = key_owner, photo_owner
+
+    def classify(self, path):
+        """返回 (source, movie_id, key, url)，认不出的字段为空字符串"""
+        with self.lock:
+            if self.key_owner is None:
+                self._load()
+        parent = os.path.basename(os.path.dirname(path))
+        name = os.path.basename(path)
+        if parent == "raw":
+            key = "/" + name
+            return "tmdb", self.key_owner.get(key, ""), key, ""
+        if parent.startswith("MTime_"):
+            key = "mtime:" + os.path.splitext(name)[0]
+            return "mtime", self.key_owner.get(key, ""), key, ""
+        hit = self.photo_owner.get(os.path.splitext(name)[0])
+        if hit:
+            source, sid, k = hit
+            return source, sid, image_keys.canonical(source, k), k if image_keys.is_url(k) else ""
+        return "", "", "", ""
+
+
+# ============================
+# 扫描
+# ============================
+
+
+def load_manifest(path=MANIFEST_FILE):
+    dirs = {}
+    if not os.path.exists(path):
+        return dirs
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            dirs[entry["dir"]] = entry
+    return dirs
+
+
+def save_manifest(dirs, path=MANIFEST_FILE):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for rel in sorted(dirs):
+            f.write(json.dumps(dirs[rel], ensure_ascii=False, separators=(",", ":")) + "\n")
+    os.replace(tmp, path)
+
+
+def _scan_dir(root, rel, old, locator, out, counters):
+    """扫描一个目录（递归子目录）；目录 mtime 没变就沿用 old 里的结果"""
+    full = os.path.join(root, rel)
+    try:
+        mtime = os.stat(full).st_mtime_ns
+    except OSError:
+        return
+
+    prev = old.get(rel)
+    if prev is not None and prev["mtime"] == mtime:
+        entry = prev
+        counters["reused"] += 1
+    else:
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(full) as it:
+                for e in it:
+                    if e.name.startswith(".") or e.name.endswith(".part"):
+                        continue
+                    if e.is_dir(follow_symlinks=False):
+                        subdirs.append(e.name)
+                    elif e.is_file(follow_symlinks=False):
+                        st = e.stat(follow_symlinks=False)
+                        source, movie_id, _key, _url = locator.classify(e.path)
+                        files.append([e.name, st.st_size, int(st.st_mtime), source, movie_id])
+        except OSError:
+            return
+        entry = {"dir": rel, "mtime": mtime, "subdirs": sorted(subdirs), "files": files}
+        counters["scanned"] += 1
+
+    out.append(entry)
+    for sub in entry["subdirs"]:
+        _scan_dir(root, os.path.join(rel, sub), old, locator, out, counters)
+
+
+def scan(root=None, full=False, workers=SCAN_WORKERS, manifest_path=None):
+    """
+    扫描图库并更新清单，返回 {"dirs", "scanned", "reused", "files", "bytes"}
+    full=True 时忽略旧清单，全部重新 scandir
+    """
+    root = root or image_store.SAVE_DIR
+    manifest_path = manifest_path or MANIFEST_FILE
+    old = {} if full else load_manifest(manifest_path)
+    locator = Locator()
+
+    try:
+        with os.scandir(root) as it:
+            movies = sorted(e.name for e in it if e.is_dir(follow_symlinks=False) and not e.name.startswith("."))
+    except OSError:
+        movies = []
+
+    results = []
+    counters_list = []
+
+    def work(name):
+        out = []
+        counters = {"scanned": 0, "reused": 0}
+        _scan_dir(root, name, old, locator, out, counters)
+        return out, counters
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for out, counters in ex.map(work, movies):
+            results.extend(out)
+            counters_list.append(counters)
+
+    dirs = {e["dir"]: e for e in results}
+    save_manifest(dirs, manifest_path)
+    return {
+        "dirs": len(dirs),
+        "scanned": sum(c["scanned"] for c in counters_list),
+        "reused": sum(c["reused"] for c in counters_list),
+        "files": sum(len(e["files"]) for e in results),
+        "bytes": sum(f[1] for e in results for f in e["files"]),
+    }
+
+
+def iter_files(root=None, manifest_path=None):
+    """按清单逐个产出 {"path", "size", "mtime", "source", "movie_id"}（不碰磁盘）"""
+    root = root or image_store.SAVE_DIR
+    manifest_path = manifest_path or MANIFEST_FILE
+    if not os.path.exists(manifest_path):
+        return
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            base = os.path.join(root, entry["dir"])
+            for name, size, mtime, source, movie_id in entry["files"]:
+                yield {
+                    "path": os.path.join(base, name),
+                    "size": size,
+                    "mtime": mtime,
+                    "source": source,
+                    "movie_id": movie_id,
+                }
+
+
+def summarize(root=None, manifest_path=None):
+    """按电影目录和来源汇总：{"movies": {片名: [文件数, 字节]}, "sources": {来源: [文件数, 字节]}}"""
+    root = root or image_store.SAVE_DIR
+    movies = {}
+    sources = {}
+    for f in iter_files(root, manifest_path):
+        movie = os.path.relpath(f["path"], root).split(os.sep)[0]
+        for table, k in ((movies, movie), (sources, f["source"] or "unknown")):
+            row = table.setdefault(k, [0, 0])
+            row[0] += 1
+            row[1] += f["size"]
+    return {"movies": movies, "sources": sources}
+
+
+if __name__ == "__main__":
+    import time
+
+    t0 = time.perf_counter()
+    res = scan(full="--full" in sys.argv)
+    print(
+        f"扫描完成：{res['dirs']} 个目录（重新扫描 {res['scanned']}，沿用 {res['reused']}），"
+        f"{res['files']} 个文件，{res['bytes'] / 1024 ** 3:.2f} GB，用时 {time.perf_counter() - t0:.1f}s"
+    )
+    summary = summarize()
+    for source, (n, size) in sorted(summary["sources"].items()):
+        print(f"  {source}: {n} 个文件，{size / 1024 ** 2:.1f} MB")
@@ -10,6 +10,10 @@ from tkinter import scrolledtext
 from datetime import datetime
 from urllib.parse import urlparse
 
+import image_keys
+import image_store
+import resolver
+
 
 SAVE_DIR = r"D:\TMDB_剧照库"
 MIN_DELAY = 10.0
@@ -104,6 +108,17 @@ def load_record():
         record["daily"] = {}
     if "completed" not in record:
         record["completed"] = {}
+    if record.get("key_version", 1) < image_keys.KEY_VERSION:
+        migrate_record_keys()
+
+
+def migrate_record_keys():
+    """旧记录按完整 URL 记图：换成规范的图片 id，同一张图的不同 URL 合并成一条"""
+    merged = image_keys.migrate_photos("maoyan", record["photos"])
+    record["key_version"] = image_keys.KEY_VERSION
+    if merged:
+        log(f"🔑 记录已迁移为规范图片 id，合并重复 {merged} 条")
+    save_record()
 
 
 def save_record():
@@ -122,6 +137,36 @@ def mark_movie_completed(movie_id, title, score=""):
         }
 
 
+def forget_photo(movie_id, url):
+    """完整性校验发现坏图：从记录里去掉，并取消该电影的完成标记，下次运行会重新下载"""
+    if not is_running:
+        load_record()
+    forget_photos(movie_id, [url])
+
+
+def forget_photos(movie_id, urls, save=True):
+    """
+    去掉记录里的这些图（URL 或图片 id 都行）并取消该电影的完成标记，下次运行会重新检查（磁盘上已有的文件直接补进记录，不重下）
+    urls 为空时只取消完成标记；save=False 时由调用方先 load_record()、最后统一 save_record()
+    """
+    drop = {image_keys.maoyan_key(u) for u in urls}
+    with record_lock:
+        photos = record["photos"].get(str(movie_id), [])
+        photos[:] = [k for k in photos if k not in drop]
+        record.get("completed", {}).pop(str(movie_id), None)
+    if save:
+        save_record()
+
+
+def _on_write_failed(result, error):
+    """后台写盘失败：从记录里去掉并取消完成标记，下次运行重新下载"""
+    if result.get("source") == "maoyan" and result.get("movie_id") and result.get("key"):
+        forget_photos(result["movie_id"], [result["key"]])
+
+
+image_store.add_failure_listener(_on_write_failed)
+
+
 def get_total_recorded_photos():
     total = 0
     with record_lock:
@@ -182,6 +227,8 @@ def search_movie_candidates(keyword: str, city_id: int = 1):
         return []
 
     data = safe_json_request_allow_400(SEARCH_API, params={"kw": keyword, "cityId": city_id})
+    if data is None:
+        return None  # 请求失败，与“没搜到”区分开
     if not data:
         return []
 
@@ -197,11 +244,47 @@ def search_movie_candidates(keyword: str, city_id: int = 1):
             mid_int = int(mid)
         except Exception:
             continue
-        result.append({"id": mid_int, "title": title, "year": year})
+        result.append({"id": mid_int, "title": title, "title_en": m.get("enm") or "", "year": year})
 
     return result
 
 
+def _resolver_candidates(keyword):
+    found = search_movie_candidates(keyword)
+    if found is None:
+        return None
+    return [{"id": c["id"], "titles": [c["title"], c.get("title_en", "")], "year": c.get("year")} for c in found]
+
+
+def resolver_search(movie, cancel=None):
+    """供 resolver 调用的猫眼搜索入口：中文名、英文名依次搜，用共享打分器选最佳"""
+    return resolver.search_by_titles(movie, _resolver_candidates, cancel=cancel, pause=2)
+
+
+def resolve_tmdb_movie_ids(limit: int = 200):
+    """把 movies_to_download 里的 TMDB 电影解析成猫眼 movieId（已解析/负缓存中的不再搜索）"""
+    ids = []
+    searched = 0
+    for movie in resolver.iter_tmdb_movies():
+        if not is_running or searched >= limit:
+            break
+        mid, origin, detail = resolver.resolve("maoyan", movie, resolver_search)
+        if origin == "search":
+            searched += 1
+            title = movie.get("title_cn") or movie.get("title_en", "")
+            if mid:
+                log(f"🔎 TMDB《{title}》 → movieId={mid} {detail['best_title']}（相似度 {detail['score']:.2f}）")
+            elif detail.get("error"):
+                log(f"⚠ TMDB《{title}》猫眼搜索请求失败，下次再查")
+            else:
+                log(f"❌ TMDB《{title}》猫眼无足够匹配的结果（score={detail['score']:.2f}）")
+            random_sleep(2, 4)
+        if mid:
+            ids.append(int(mid))
+    resolver.flush()
+    return ids
+
+
 def get_hot_movie_ids():
     data = safe_json_request_allow_400(HOT_API, params=None)
     if not data:
@@ -244,17 +327,19 @@ def parse_filename_from_url(url: str) -> str:
         return ""
 
 
-def download_file(url, folder, filename):
+def download_file(url, folder, filename, movie_id="", key=""):
     path = os.path.join(folder, filename)
-    if os.path.exists(path):
+    if image_store.exists(path):
         return True
 
     try:
-        r = requests.get(url, headers=HEADERS, timeout=20)
-        if r.status_code == 200:
-            with open(path, "wb") as f:
-                f.write(r.content)
-            return True
+        # with：非 200 或写盘出错时也把流式连接还回连接池
+        with requests.get(url, headers=HEADERS, timeout=20, stream=True) as r:
+            if r.status_code == 200:
+                image_store.write_image(
+                    path, r.iter_content(image_store.CHUNK_SIZE), source="maoyan", movie_id=movie_id, key=key, url=url
+                )
+                return True
     except Exception:
         pass
     return False
@@ -275,11 +360,18 @@ def get_movie_detail(movie_id: int):
     if cover:
         photos = [cover] + photos
 
+    # 同一张图可能带不同的处理参数出现多次：按图片 id 去重，统一请求原图
     cleaned = []
+    seen = set()
     for u in photos:
         if not u or not isinstance(u, str):
             continue
-        cleaned.append(u.strip())
+        best = image_keys.maoyan_best_url(u)
+        key = image_keys.maoyan_key(best)
+        if key in seen:
+            continue
+        seen.add(key)
+        cleaned.append(best)
 
     return {
         "id": str(movie_id),
@@ -361,17 +453,53 @@ def worker_main(movie_ids_text: str):
         keywords = []
         log(f"📋 即将上映电影数量：{len(ids)}")
         random_sleep(3, 6)
+    elif auto_text.startswith("__AUTO_TMDB__"):
+        limit = 200
+        m_limit = re.search(r"limit=(\d+)", auto_text)
+        if m_limit:
+            limit = int(m_limit.group(1))
+        log(f"🔍 正在把 TMDB 待下载列表解析为猫眼 movieId... 本轮最多搜索 {limit} 部")
+        ids = resolve_tmdb_movie_ids(limit=limit)
+        keywords = []
+        log(f"📋 已解析的电影数量：{len(ids)}")
     else:
         ids, keywords = _parse_movie_ids(movie_ids_text)
     if keywords:
+        pending_keywords = []
         for kw in keywords:
-            cands = search_movie_candidates(kw)
-            if not cands:
+            # 先查本地片名索引：片名 → TMDB id → 已解析的猫眼 movieId，不发请求
+            tmdb_id, _score = resolver.lookup_title(kw)
+            movie = resolver.index_movie(tmdb_id) if tmdb_id else None
+            if not movie:
+                pending_keywords.append(kw)
+                continue
+            mid, origin, detail = resolver.resolve("maoyan", movie, resolver_search)
+            if origin == "cache":
+                ids.append(int(mid))
+                log(f"📌 本地命中《{kw}》 → TMDB {tmdb_id} → movieId={mid}")
+            elif origin == "deferred":
+                log(f"🕒 《{kw}》（TMDB {tmdb_id}）在猫眼负缓存中，跳过")
+            elif mid:
+                ids.append(int(mid))
+                log(f"🔎 《{kw}》（TMDB {tmdb_id}） → movieId={mid} {detail['best_title']}（相似度 {detail['score']:.2f}）")
+                random_sleep(2, 4)
+            else:
+                log(f"❌ 《{kw}》（TMDB {tmdb_id}）猫眼无足够匹配的结果（score={detail['score']:.2f}）")
+                random_sleep(2, 4)
+        keywords = pending_keywords
+
+    if keywords:
+        for kw in keywords:
+            detail = resolver_search({"title_cn": kw})
+            if detail["best_id"] is None:
                 log(f"❌ 未搜索到：{kw}")
                 continue
-            chosen = cands[0]
-            ids.append(chosen["id"])
-            log(f"🔎 搜索《{kw}》 → movieId={chosen['id']} {chosen.get('title','')}")
+            if not detail["id"]:
+                log(f"❌ 搜索《{kw}》无足够匹配的结果（score={detail['score']:.2f}）")
+                random_sleep(2, 4)
+                continue
+            ids.append(detail["id"])
+            log(f"🔎 搜索《{kw}》 → movieId={detail['id']} {detail['best_title']}（相似度 {detail['score']:.2f}）")
             random_sleep(2, 4)
 
     # 去重保持顺序
@@ -434,10 +562,10 @@ def worker_main(movie_ids_text: str):
             save_record()
             continue
 
-        # 如果所有 URL 都已记录，直接完成
+        # 如果所有图都已记录，直接完成
         all_known = True
         for u in photos:
-            if u not in known:
+            if image_keys.maoyan_key(u) not in known:
                 all_known = False
                 break
         if all_known:
@@ -453,8 +581,9 @@ def worker_main(movie_ids_text: str):
             while not pause_event.is_set():
                 time.sleep(1)
 
+            key = image_keys.maoyan_key(url)
             with record_lock:
-                if url in record["photos"][str(mid)]:
+                if key in record["photos"][str(mid)]:
                     skip_cnt += 1
                     continue
 
@@ -462,7 +591,7 @@ def worker_main(movie_ids_text: str):
             if not filename:
                 filename = f"{idx + 1}.jpg"
 
-            if download_file(url, save_path, filename):
+            if download_file(url, save_path, filename, movie_id=mid, key=key):
                 rel_path = os.path.relpath(os.path.join(save_path, filename), SAVE_DIR)
                 rel_path = rel_path.replace("\\", "/")
                 log(f"[maoyan]{rel_path} ✔")
@@ -470,7 +599,7 @@ def worker_main(movie_ids_text: str):
                 new_cnt += 1
 
                 with record_lock:
-                    record["photos"][str(mid)].append(url)
+                    record["photos"][str(mid)].append(key)
 
                     today = today_key()
                     record["daily"].setdefault(today, 0)
@@ -0,0 +1,378 @@
+"""
+跨数据源近似重复图片索引（感知哈希 dHash）
+
+同一张剧照在 TMDB 原图、MTime _1000X1000、猫眼 imageMogr2/thumbnail 里分辨率和压缩都不同，
+字节级去重认不出来。这里对每张图算 64 位 dHash：
+- 计算放在进程池里（postprocess.PoolStage），下载完成的图片经 image_store 回调自动入队
+- 哈希、宽高、mtime 存在按需扩容的定长 NumPy 数组里（每张图 24 字节），原样存成 SAVE_DIR/.phash_index.npz；
+  路径、路径 → 行号和作废行仍是 Python 对象
+- 每部电影（SAVE_DIR 下的一级目录）一棵 BK 树，按汉明距离查近似图；树节点只存行号，哈希回数组里取
+- 发现近似重复时保留分辨率最高的一张：记到 .near_duplicates.jsonl，
+  PHASH_ACTION = "move" 时把较小的挪到 SAVE_DIR/.near_duplicates/ 下（可手动恢复），
+  并登记到 image_store 的跳过标记里，记录照旧保留，各数据源不会再把它下回来
+
+批量建索引：python phash_index.py scan
+"""
+
+import os
+import sys
+import json
+import shutil
+import threading
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+import image_store
+import postprocess
+
+
+PHASH_ENABLED = True
+PHASH_WORKERS = postprocess.DEFAULT_WORKERS
+PHASH_MAX_DISTANCE = 6  # 汉明距离不超过此值视为同一张图
+PHASH_ACTION = "flag"  # "flag"：只记录；"move"：把低分辨率的挪走
+
+INDEX_FILE = os.path.join(image_store.SAVE_DIR, ".phash_index.npz")
+DUPLICATES_FILE = os.path.join(image_store.SAVE_DIR, ".near_duplicates.jsonl")
+DUPLICATES_DIR = os.path.join(image_store.SAVE_DIR, ".near_duplicates")
+SAVE_EVERY = 200  # 每新增多少条落一次盘
+
+
+def available() -> bool:
+    return np is not None and Image is not None
+
+
+# ============================
+# 子进程里执行的计算
+# ============================
+
+
+def dhash_file(path):
+    """
+    返回 (hash, width, height, mtime)；读不了的图返回 None
+    dHash：缩成 9×8 灰度图，比较每行相邻像素的明暗，得到 64 位
+    """
+    try:
+        mtime = int(os.path.getmtime(path))
+        with Image.open(path) as img:
+            width, height = img.size
+            img.draft("L", (64, 64))  # JPEG 直接按 1/8 等比例解码，省掉大部分解码时间
+            small = img.convert("L").resize((9, 8), Image.LANCZOS)
+        pixels = np.asarray(small, dtype=np.int16)
+        bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+        value = int(np.packbits(bits).view(">u8")[0])
+        return value, width, height, mtime
+    except Exception:
+        return None
+
+
+def _dhash_item(item):
+    return dhash_file(item[1])
+
+
+# ============================
+# BK 树
+# ============================
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树：节点为 [行号, {距离: 子节点}]，哈希由 hash_of(行号) 取"""
+
+    def __init__(self, hash_of):
+        self.root = None
+        self.hash_of = hash_of
+
+    def add(self, value, row):
+        if self.root is None:
+            self.root = [row, {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(value, self.hash_of(node[0]))
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [row, {}]
+                return
+            node = child
+
+    def query(self, value, radius):
+        """返回 [(距离, 行号), ...]"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, self.hash_of(node[0]))
+            if d <= radius:
+                found.append((d, node[0]))
+            for k, child in node[1].items():
+                if d - radius <= k <= d + radius:
+                    stack.append(child)
+        return found
+
+
+class Column:
+    """按需扩容（容量翻倍）的一维 NumPy 数组，取值返回 Python int"""
+
+    def __init__(self, dtype, data=None):
+        self.data = np.zeros(1024, dtype=dtype) if data is None else np.array(data, dtype=dtype)
+        self.size = 0 if data is None else len(self.data)
+
+    def append(self, value):
+        if self.size == len(self.data):
+            grown = np.zeros(max(1024, 2 * len(self.data)), dtype=self.data.dtype)
+            grown[: self.size] = self.data[: self.size]
+            self.data = grown
+        self.data[self.size] = value
+        self.size += 1
+
+    def __getitem__(self, row):
+        if row >= self.size:
+            raise IndexError(row)
+        return int(self.data[row])
+
+    def __len__(self):
+        return self.size
+
+    def values(self):
+        return self.data[: self.size]
+
+
+# ============================
+# 索引
+# ============================
+
+
+class PHashIndex:
+    def __init__(self):
+        self.paths = []
+        self.hashes = Column(np.uint64)
+        self.widths = Column(np.int32)
+        self.heights = Column(np.int32)
+        self.mtimes = Column(np.int64)
+        self.removed = set()  # 被挪走的行号（BK 树不支持删除，查询时过滤）
+        self.row_of = {}  # 路径 → 行号
+        self.trees = {}  # 电影目录 → BKTree
+        self.lock = threading.Lock()
+        self.dirty = 0
+
+    def load(self, path=INDEX_FILE):
+        if not os.path.exists(path):
+            return
+        try:
+            data = np.load(path)
+        except Exception as e:
+            print(f"⚠ 感知哈希索引读取失败，将重建：{e}")
+            return
+        self.paths = data["paths"].tolist()
+        self.hashes = Column(np.uint64, data["hashes"])
+        self.widths = Column(np.int32, data["widths"])
+        self.heights = Column(np.int32, data["heights"])
+        self.mtimes = Column(np.int64, data["mtimes"])
+        self.removed = set(data["removed"].tolist()) if "removed" in data else set()
+        for row, p in enumerate(self.paths):
+            self._link(p, row)
+        self.dirty = 0
+
+    def save(self, path=INDEX_FILE):
+        with self.lock:
+            if not self.paths:
+                return
+            arrays = {
+                "paths": np.array(self.paths),
+                "hashes": self.hashes.values().copy(),
+                "widths": self.widths.values().copy(),
+                "heights": self.heights.values().copy(),
+                "mtimes": self.mtimes.values().copy(),
+                "removed": np.array(sorted(self.removed), dtype=np.int64),
+            }
+            self.dirty = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    def _link(self, path, row):
+        """把已写进数组的一行挂到路径索引和所在电影的 BK 树上"""
+        old = self.row_of.get(path)
+        if old is not None:
+            # 同一路径重新下载（如升级原图）：旧行作废
+            self.removed.add(old)
+        self.row_of[path] = row
+        movie = image_store.movie_folder(path)
+        if movie:
+            tree = self.trees.get(movie)
+            if tree is None:
+                tree = self.trees[movie] = BKTree(lambda r: self.hashes[r])
+            tree.add(self.hashes[row], row)
+
+    def _append(self, path, value, width, height, mtime):
+        row = len(self.paths)
+        self.paths.append(path)
+        self.hashes.append(value)
+        self.widths.append(width)
+        self.heights.append(height)
+        self.mtimes.append(mtime)
+        self._link(path, row)
+        self.dirty += 1
+        return row
+
+    def is_current(self, path, mtime):
+        with self.lock:
+            row = self.row_of.get(path)
+            return row is not None and row not in self.removed and self.mtimes[row] == mtime
+
+    def near(self, path, value, radius=PHASH_MAX_DISTANCE):
+        """同一部电影里与 value 近似的其它图片：[(距离, 行号), ...]"""
+        movie = image_store.movie_folder(path)
+        tree = self.trees.get(movie)
+        if tree is None:
+            return []
+        return [
+            (d, row)
+            for d, row in tree.query(value, radius)
+            if row not in self.removed and self.paths[row] != path
+        ]
+
+    def add(self, path, value, width, height, mtime):
+        """加入一张图，返回加入前就存在的近似图 [(距离, 行号), ...]"""
+        with self.lock:
+            matches = self.near(path, value)
+            row = self._append(path, value, width, height, mtime)
+        return row, matches
+
+
+index = PHashIndex()
+_loaded = False
+_stage = None
+
+
+def load_index():
+    global _loaded
+    if not _loaded:
+        index.load()
+        _loaded = True
+
+
+def _resolution(row):
+    return index.widths[row] * index.heights[row]
+
+
+def handle_near_duplicates(row, matches):
+    """一组近似图里保留分辨率最高的，其余按 PHASH_ACTION 处理"""
+    group = [row] + [r for _d, r in matches]
+    keep = max(group, key=_resolution)
+    losers = [r for r in group if r != keep]
+    entry = {
+        "movie": image_store.movie_folder(index.paths[keep]),
+        "keep": index.paths[keep],
+        "keep_size": [index.widths[keep], index.heights[keep]],
+        "duplicates": [index.paths[r] for r in losers],
+        "distance": max(d for d, _r in matches),
+        "action": PHASH_ACTION,
+    }
+
+    if PHASH_ACTION == "move":
+        moved = []
+        for r in losers:
+            src = index.paths[r]
+            rel = os.path.relpath(src, image_store.SAVE_DIR)
+            dest = os.path.join(DUPLICATES_DIR, rel)
+            try:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.move(src, dest)
+                moved.append(src)
+                with index.lock:
+                    index.removed.add(r)
+            except OSError as e:
+                print(f"⚠ 挪走近似重复图片失败：{src} {e}")
+        # 记录里的 key 保留（这张图算处理过了），再打上跳过标记，各数据源按路径查 exists() 时也不会重下
+        image_store.mark_skipped(moved)
+
+    with open(DUPLICATES_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return entry
+
+
+def _on_hash(item, result):
+    if result is None:
+        return
+    path = item[0]
+    value, width, height, mtime = result
+    row, matches = index.add(path, value, width, height, mtime)
+    if matches:
+        handle_near_duplicates(row, matches)
+    if index.dirty >= SAVE_EVERY:
+        index.save()
+
+
+def _on_image_written(result):
+    if _stage is not None:
+        _stage.submit((result["path"], result["file"]))
+
+
+def get_stage():
+    global _stage
+    if _stage is None:
+        _stage = postprocess.PoolStage("phash", _dhash_item, _on_hash, workers=PHASH_WORKERS)
+    return _stage
+
+
+def start():
+    """启动后台索引：之后每张新下载的图都会自动算哈希、查近似重复"""
+    if not PHASH_ENABLED or not available():
+        return False
+    load_index()
+    get_stage().start()
+    image_store.add_listener(_on_image_written)
+    return True
+
+
+def stop():
+    image_store.remove_listener(_on_image_written)
+    if _stage is not None:
+        _stage.stop()
+    if _loaded:
+        index.save()
+
+
+def scan(root=None, progress=None):
+    """批量为已有图库建索引（只处理新文件和 mtime 变了的文件），返回处理数"""
+    if not available():
+        print("⚠ 需要安装 numpy 和 Pillow")
+        return 0
+    load_index()
+    root = root or image_store.SAVE_DIR
+
+    def pending():
+        for path in postprocess.iter_image_files(root):
+            try:
+                mtime = int(os.path.getmtime(path))
+            except OSError:
+                continue
+            if not index.is_current(path, mtime):
+                yield (path, path)
+
+    done = get_stage().run_bulk(pending(), progress=progress)
+    index.save()
+    return done
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "scan":
+        n = scan(sys.argv[2] if len(sys.argv) > 2 else None, progress=lambda d: print(f"已处理 {d} 张"))
+        print(f"完成：新增 {n} 张，近似重复记录见 {DUPLICATES_FILE}")
+    else:
+        print("用法：python phash_index.py scan [目录]")
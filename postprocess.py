@@ -0,0 +1,137 @@
+"""
+下载后处理的公共骨架：后台线程攒批 → 进程池计算 → 结果回到后台线程处理
+
+感知哈希、缩略图、完整性校验等 CPU 密集的后处理都用它，
+避免在下载线程里解码大图，也不受 GIL 限制
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".avif")
+
+
+def iter_image_files(root, skip_hidden=True):
+    """递归列出 root 下的图片文件（跳过 . 开头的目录，如 .blobs / .thumbs）"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        if skip_hidden:
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for name in filenames:
+            if name.lower().endswith(IMAGE_EXTS):
+                yield os.path.join(dirpath, name)
+
+
+class PoolStage:
+    """
+    submit(item) 把任务放进队列；后台线程每攒够 batch 个（或等了 linger 秒）
+    就交给进程池执行 func(item)，再在后台线程里调用 on_result(item, result)
+    func 必须是模块级函数（要能被子进程 pickle）
+    """
+
+    def __init__(self, name, func, on_result, workers=DEFAULT_WORKERS, batch=32, linger=2.0, queue_size=10000):
+        self.name = name
+        self.func = func
+        self.on_result = on_result
+        self.workers = workers
+        self.batch = batch
+        self.linger = linger
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pool = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            self.thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self.thread.start()
+
+    def stop(self, wait=True):
+        """处理完队列里已有的任务后停止"""
+        with self.lock:
+            thread = self.thread
+        if thread and thread.is_alive():
+            self.queue.put(None)
+            if wait:
+                thread.join()
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=wait)
+                self.pool = None
+            self.thread = None
+
+    def submit(self, item):
+        """放不进去（队列满）时丢弃并返回 False，不阻塞下载线程；漏掉的由批量扫描补上"""
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def _take_batch(self):
+        item = self.queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        while len(batch) < self.batch:
+            try:
+                item = self.queue.get(timeout=self.linger)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _loop(self):
+        while True:
+            batch, stopping = self._take_batch()
+            if batch:
+                self._run(batch)
+            if stopping:
+                return
+
+    def _run(self, items, chunksize=1):
+        try:
+            results = self.pool.map(self.func, items, chunksize=chunksize)
+            for item, result in zip(items, results):
+                try:
+                    self.on_result(item, result)
+                except Exception as e:
+                    print(f"⚠ {self.name} 处理结果出错：{e}")
+        except Exception as e:
+            print(f"⚠ {self.name} 批处理出错：{e}")
+
+    def run_bulk(self, items, progress=None, chunk=512):
+        """同步处理一大批任务（批量回填/扫描用），返回处理数；progress(done) 每块回调一次"""
+        own_pool = self.pool is None
+        if own_pool:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        done = 0
+        try:
+            block = []
+            for item in items:
+                block.append(item)
+                if len(block) >= chunk:
+                    self._run(block, chunksize=16)
+                    done += len(block)
+                    block = []
+                    if progress:
+                        progress(done)
+            if block:
+                self._run(block, chunksize=16)
+                done += len(block)
+                if progress:
+                    progress(done)
+        finally:
+            if own_pool:
+                self.pool.shutdown()
+                self.pool = None
+        return done
@@ -0,0 +1,298 @@
+"""
+记录 ↔ 磁盘对账
+
+记录和实际文件会慢慢对不上：手动删了/挪了文件、崩溃时文件写完了记录没存、
+或者记录先记上了文件却没落盘。这里把三份记录
+(downloaded.json / douban_downloaded.json / maoyan_downloaded.json) 和 library_scan 的磁盘清单做一次连接：
+- ghost（幽灵）：记录里有，磁盘上没有
+- orphan（孤儿）：磁盘上有，记录里没有
+结果逐行写到 SAVE_DIR/.reconcile.jsonl，不在内存里攒报告。
+
+按各数据源的存放约定把两边都归一成 (类别, 文件名)：
+  TMDB   key "/x.jpg"        ↔ <片名>/raw/x.jpg
+  MTime  key "mtime:<id>"    ↔ <片名>/MTime_<类型>/<id>.*
+         key "mtime_url:<url>" ↔ <片名>/MTime_<类型>/<URL 文件名>
+  豆瓣/猫眼 规范图片 id       ↔ <片名>/<图片 id>.*
+被 phash_index 挪到 .near_duplicates/ 的图和 image_store 跳过标记里的图算“在”，不当幽灵重下；
+transcode 转码过的图按原图路径认。
+
+--fix 两个方向都修：
+- 幽灵重新排队（复用各数据源的 forget_* ：TMDB/MTime 电影移出已完成，豆瓣/猫眼取消完成标记）
+- 孤儿收录：同一电影目录里有已知文件就能认出归属；TMDB/MTime 直接补进记录，
+  豆瓣/猫眼取消完成标记，下次运行时已有文件直接补记录、不重下
+--fix 会改记录文件，请在各下载器都停止时运行。
+
+python reconcile.py [--fix] [--full]
+"""
+
+import os
+import sys
+import json
+from collections import defaultdict
+
+import image_keys
+import image_store
+import library_scan
+import transcode
+
+
+REPORT_FILE = os.path.join(image_store.SAVE_DIR, ".reconcile.jsonl")
+PARKED_DIRS = (os.path.join(image_store.SAVE_DIR, ".near_duplicates"),)  # 有意挪走、不算丢失的图
+MTIME_PREFIXES = ("mtime:", "mtime_url:")
+
+
+# ============================
+# 归一化：记录 key / 磁盘路径 → (类别, 文件名)
+# ============================
+
+
+def record_key(source, key):
+    if source == "tmdb":
+        return "raw", key.lstrip("/")
+    if source == "mtime":
+        if key.startswith("mtime_url:"):
+            # 没有图片 id 的 MTime 图按 URL 原文件名保存
+            return "mtime", os.path.splitext(os.path.basename(key[len("mtime_url:") :]))[0]
+        return "mtime", key[len("mtime:") :]
+    return "flat", image_keys.canonical(source, key)
+
+
+def disk_key(path, root):
+    """返回 (电影目录, (类别, 文件名))；不符合任何数据源约定的返回 (电影目录, None)"""
+    parts = os.path.relpath(path, root).replace("\\", "/").split("/")
+    folder = parts[0]
+    name = parts[-1]
+    if len(parts) == 2:
+        return folder, ("flat", os.path.splitext(name)[0])
+    if len(parts) == 3 and parts[1] == "raw":
+        return folder, ("raw", name)
+    if len(parts) == 3 and parts[1].startswith("MTime_"):
+        return folder, ("mtime", os.path.splitext(name)[0])
+    return folder, None
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def iter_record_entries():
+    """逐条产出 (source, movie_id, key)"""
+    import TMDB
+    import douban
+    import maoyan
+
+    data = _read_json(TMDB.RECORD_FILE)
+    for mid, keys in data.get("images", {}).items():
+        for k in keys:
+            yield ("mtime" if k.startswith(MTIME_PREFIXES) else "tmdb"), mid, k
+    del data
+
+    for source, module in (("douban", douban), ("maoyan", maoyan)):
+        data = _read_json(module.RECORD_FILE)
+        for sid, urls in data.get("photos", {}).items():
+            for url in urls:
+                yield source, sid, url
+        del data
+
+
+def iter_disk_paths(root):
+    """磁盘清单里的文件（转码过的按原图路径）+ 打包的图 + manifest 模式下只登记未建文件的图 + 有意跳过/挪走的图"""
+    originals = transcode.original_paths()
+    for f in library_scan.iter_files(root):
+        yield originals.get(f["path"], f["path"]), root
+    for entry in image_store.iter_packed():
+        yield entry["path"], root
+    if image_store.STORE_ENABLED and image_store.STORE_MODE == "manifest":
+        for entry in image_store.iter_manifest():
+            if entry.get("path") and not os.path.exists(entry["path"]):
+                yield entry["path"], root
+    skipped = set()
+    for path in image_store.iter_skipped():
+        skipped.add(os.path.normcase(os.path.relpath(path, root)))
+        if not os.path.exists(path):
+            yield path, root
+    for parked in PARKED_DIRS:
+        if os.path.isdir(parked):
+            for dirpath, _dirnames, filenames in os.walk(parked):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    if os.path.normcase(os.path.relpath(path, parked)) not in skipped:
+                        yield path, parked
+
+
+# ============================
+# 对账
+# ============================
+
+
+def _claim(hits, owner):
+    """同名的几条记录里优先认领属于同一电影目录的那条"""
+    if owner:
+        for i, (source, movie_id, _key) in enumerate(hits):
+            if (source, movie_id) == owner or (owner[0] in ("tmdb", "mtime") and movie_id == owner[1]):
+                return hits.pop(i)
+    return hits.pop(0)
+
+
+def reconcile(root=None, fix=False, full_scan=False, report_path=None, progress=None):
+    """
+    返回 {"records", "files", "matched", "ghosts", "orphans", "requeued", "adopted"}
+    只有一份 key → 记录的索引常驻内存，磁盘文件和报告都是流式的
+    """
+    root = root or image_store.SAVE_DIR
+    report_path = report_path or REPORT_FILE
+    library_scan.scan(root, full=full_scan)
+
+    # 记录索引：(类别, 文件名) → [(source, movie_id, key), ...]；
+    # 同名的记录（不同电影各记了一次）都保留，每个磁盘文件认领一条，剩下的即幽灵
+    pending = defaultdict(list)
+    counts = defaultdict(int)
+    for entry in iter_record_entries():
+        pending[record_key(entry[0], entry[2])].append(entry)
+        counts["records"] += 1
+
+    matched = set()
+    owners = {}  # (电影目录, "db"/"flat") → (source, movie_id)，收录孤儿时认归属
+    orphans = []  # 只留认领需要的 (电影目录, 类别, 文件名)
+
+    tmp = report_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as report:
+
+        def emit(entry):
+            report.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+        for path, base in iter_disk_paths(root):
+            counts["files"] += 1
+            if progress and counts["files"] % 50000 == 0:
+                progress(counts["files"])
+            folder, k = disk_key(path, base)
+            if k is None:
+                continue
+            hits = pending.get(k)
+            if hits:
+                hit = _claim(hits, owners.get((folder, "flat" if k[0] == "flat" else "db")))
+                if not hits:
+                    del pending[k]
+                matched.add(k)
+                counts["matched"] += 1
+                source, movie_id, _key = hit
+                owners.setdefault((folder, "flat" if k[0] == "flat" else "db"), (source, movie_id))
+            elif k not in matched:
+                counts["orphans"] += 1
+                emit({"type": "orphan", "path": path, "folder": folder})
+                if fix and base == root:
+                    orphans.append((folder, k[0], k[1]))
+
+        ghosts = defaultdict(list)  # (source, movie_id) → [key]
+        for source, movie_id, key in (e for hits in pending.values() for e in hits):
+            counts["ghosts"] += 1
+            emit({"type": "ghost", "source": source, "movie_id": movie_id, "key": key})
+            if fix:
+                ghosts[(source, movie_id)].append(key)
+        pending.clear()
+    os.replace(tmp, report_path)
+
+    if fix:
+        counts["requeued"] = requeue_ghosts(ghosts)
+        counts["adopted"] = adopt_orphans(orphans, owners)
+    return dict(counts)
+
+
+# ============================
+# 修复
+# ============================
+
+
+def _shared_record():
+    """TMDB 和 MTime 共用 downloaded.json：两边指向同一份内存记录，最后只存一次"""
+    import TMDB
+    import MTime
+
+    if TMDB.record is None and MTime.record is None:
+        TMDB.record = MTime.record = TMDB.load_record()
+    elif TMDB.record is not MTime.record:
+        raise RuntimeError("TMDB / MTime 下载器正在运行，请停止后再修复")
+    return TMDB, MTime
+
+
+def requeue_ghosts(ghosts):
+    import douban
+    import maoyan
+
+    if not ghosts:
+        return 0
+    TMDB, MTime = _shared_record()
+    flat = {"douban": douban, "maoyan": maoyan}
+    for module in flat.values():
+        if not module.is_running:
+            module.load_record()
+
+    n = 0
+    for (source, movie_id), keys in ghosts.items():
+        if source == "tmdb":
+            TMDB.forget_images(movie_id, keys, save=False)
+        elif source == "mtime":
+            MTime.forget_mtime_images(movie_id, keys, save=False)
+        else:
+            flat[source].forget_photos(movie_id, keys, save=False)
+        n += len(keys)
+
+    TMDB.save_record_safe()
+    for module in flat.values():
+        module.save_record()
+    print(f"🔁 {n} 张丢失的图已重新排队")
+    return n
+
+
+def adopt_orphans(orphans, owners):
+    import douban
+    import maoyan
+
+    if not orphans:
+        return 0
+    TMDB, _MTime = _shared_record()
+    flat = {"douban": douban, "maoyan": maoyan}
+    for module in flat.values():
+        if not module.is_running:
+            module.load_record()
+
+    db_keys = defaultdict(list)  # movie_id → [key]
+    reopened = set()
+    n = 0
+    for folder, kind, name in orphans:
+        if kind == "flat":
+            owner = owners.get((folder, "flat"))
+            if owner and owner not in reopened:
+                reopened.add(owner)
+                flat[owner[0]].forget_photos(owner[1], [], save=False)
+        else:
+            # 按 URL 文件名保存的 MTime 图还原不出原来的 mtime_url: key，不收录
+            owner = owners.get((folder, "db")) if kind == "raw" or name.isdigit() else None
+            if owner:
+                db_keys[owner[1]].append("/" + name if kind == "raw" else "mtime:" + name)
+        if owner:
+            n += 1
+
+    for movie_id, keys in db_keys.items():
+        TMDB.adopt_images(movie_id, keys, save=False)
+    TMDB.save_record_safe()
+    for module in flat.values():
+        module.save_record()
+    print(f"📥 收录 {n} 个孤儿文件（{len(orphans) - n} 个认不出归属，见报告）")
+    return n
+
+
+if __name__ == "__main__":
+    res = reconcile(
+        fix="--fix" in sys.argv,
+        full_scan="--full" in sys.argv,
+        progress=lambda n: print(f"已比对 {n} 个文件"),
+    )
+    print(
+        f"对账完成：记录 {res.get('records', 0)} 条，磁盘 {res.get('files', 0)} 个文件，"
+        f"幽灵 {res.get('ghosts', 0)}，孤儿 {res.get('orphans', 0)}（详见 {REPORT_FILE}）"
+    )
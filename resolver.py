@@ -0,0 +1,563 @@
+"""
+跨数据源片名解析：把 movies_to_download 里的 TMDB 电影解析成 MTime / 猫眼 / 豆瓣 的 id
+
+- 共用一个打分器（title_match）
+- 共用一份持久化映射 title_ids.json：{tmdb_id: {source: {"id", "score", "query", "time"}}}
+- 共用一份负缓存 title_negative_cache.json：{tmdb_id: {source: {..., "next_check"}}}，按指数退避再查
+- 同一部电影在同一数据源上命中后不再搜索；并发解析同一部电影时只有一个线程真正发请求
+
+各数据源只需提供 searcher(movie, cancel=None) -> detail：
+    {"id": 命中的 id 或 None, "score", "query", "best_id", "best_title"}
+按片名逐个搜索的数据源可以直接用 search_by_titles() 拼出 searcher
+
+另有一份持久化的片名索引 title_index.json（归一化的中英文名、年份、别名），
+从 movies_to_download.jsonl 增量构建：片名 → TMDB id 的查询在本地完成，不发请求
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+
+import title_match
+
+
+if getattr(sys, "frozen", False):
+    BASE_DIR = os.path.dirname(sys.executable)
+else:
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MOVIES_LIST_FILE = os.path.join(BASE_DIR, "movies_to_download.jsonl")
+ID_MAP_FILE = os.path.join(BASE_DIR, "title_ids.json")
+TITLE_INDEX_FILE = os.path.join(BASE_DIR, "title_index.json")
+NEGATIVE_FILE = os.path.join(BASE_DIR, "title_negative_cache.json")
+
+# 旧的 MTime 专用缓存，首次加载时并入共享文件
+LEGACY_MTIME_ID_MAP_FILE = os.path.join(BASE_DIR, "mtime_id_map.json")
+LEGACY_MTIME_NEGATIVE_FILE = os.path.join(BASE_DIR, "mtime_negative_cache.json")
+
+ACCEPT_SCORE = 0.6  # 达到此分不再搜下一个片名
+LOOKUP_SCORE = 0.9  # 本地片名索引模糊命中至少要这么像，才拿来代替用户输入的片名
+MATCH_THRESHOLD = title_match.MATCH_THRESHOLD
+NEGATIVE_BASE_DAYS = 1  # 第一次未匹配后多久再查
+NEGATIVE_MAX_DAYS = 90  # 再查间隔上限
+SAVE_EVERY = 50  # 映射/负缓存、片名索引各攒够这么多次改动才整表落盘
+SAVE_INTERVAL = 60  # 或距上次落盘超过这么多秒（退出时 atexit 再补一次）
+RESOLVE_ALL_PAUSE = 3.0  # 命令行批量解析时，每部真正发起过搜索的电影之后歇多少秒
+
+SOURCES = ("mtime", "maoyan", "douban")
+
+
+id_map = None
+negative = None
+cache_lock = threading.Lock()
+
+title_index = None  # {"offset": 已读到的列表字节数, "movies": {tmdb_id: {"cn", "en", "year", "norms", "aliases"}}}
+title_lookup = None  # 由 title_index 构建的内存 TitleIndex
+index_lock = threading.RLock()
+
+_inflight = {}  # (source, tmdb_id) -> [Lock, 等待/持有的线程数]，防止同一部电影被并发重复搜索；用完即删
+_inflight_lock = threading.Lock()
+
+_dirty = {"cache": 0, "index": 0}  # 上次落盘后的改动次数
+_last_save = {"cache": time.time(), "index": time.time()}
+_dirty_lock = threading.Lock()
+
+
+# ============================
+# 持久化
+# ============================
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        print(f"⚠ {os.path.basename(path)} 损坏，将重建")
+        return None
+
+
+def _write_json(path, data):
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"⚠ 保存 {os.path.basename(path)} 出错：{e}")
+
+
+def _migrate_legacy_mtime(ids, neg):
+    """把旧版 mtime_id_map.json / mtime_negative_cache.json 并入共享结构"""
+    legacy_ids = _read_json(LEGACY_MTIME_ID_MAP_FILE) or {}
+    for tmdb_id, entry in legacy_ids.items():
+        if not entry.get("mtime_id"):
+            continue
+        ids.setdefault(tmdb_id, {}).setdefault(
+            "mtime",
+            {
+                "id": entry["mtime_id"],
+                "score": entry.get("score", 0.0),
+                "query": entry.get("query", ""),
+                "time": entry.get("time", 0),
+            },
+        )
+
+    legacy_neg = _read_json(LEGACY_MTIME_NEGATIVE_FILE) or {}
+    for tmdb_id, entry in legacy_neg.items():
+        if "mtime" in ids.get(tmdb_id, {}):
+            continue
+        neg.setdefault(tmdb_id, {}).setdefault("mtime", entry)
+    return bool(legacy_ids or legacy_neg)
+
+
+def load():
+    global id_map, negative
+    with cache_lock:
+        if id_map is not None:
+            return
+        ids = _read_json(ID_MAP_FILE)
+        neg = _read_json(NEGATIVE_FILE)
+        migrated = False
+        if ids is None and neg is None:
+            ids, neg = {}, {}
+            migrated = _migrate_legacy_mtime(ids, neg)
+        id_map = ids or {}
+        negative = neg or {}
+    if migrated:
+        save()
+
+
+def _touch(kind):
+    """记一次改动，攒够 SAVE_EVERY 次或超过 SAVE_INTERVAL 秒才真正落盘"""
+    with _dirty_lock:
+        _dirty[kind] += 1
+        due = _dirty[kind] >= SAVE_EVERY or time.time() - _last_save[kind] >= SAVE_INTERVAL
+    if due:
+        (save if kind == "cache" else save_title_index)()
+
+
+def _saved(kind):
+    with _dirty_lock:
+        _dirty[kind] = 0
+        _last_save[kind] = time.time()
+
+
+def flush():
+    """把攒着的改动写盘（批量解析结束、下载线程退出、进程退出时调用）"""
+    with _dirty_lock:
+        cache_dirty, index_dirty = _dirty["cache"], _dirty["index"]
+    if cache_dirty:
+        save()
+    if index_dirty:
+        save_title_index()
+
+
+atexit.register(flush)
+
+
+def save():
+    if id_map is None:
+        return
+    _saved("cache")
+    with cache_lock:
+        ids = json.loads(json.dumps(id_map))
+        neg = json.loads(json.dumps(negative))
+    _write_json(ID_MAP_FILE, ids)
+    _write_json(NEGATIVE_FILE, neg)
+
+
+# ============================
+# 映射 & 负缓存
+# ============================
+
+
+def get_cached_id(source, tmdb_id, ttl_days=0):
+    """返回已解析的 id；ttl_days > 0 时过期的映射视为没有"""
+    load()
+    with cache_lock:
+        entry = id_map.get(str(tmdb_id), {}).get(source)
+    if not entry:
+        return None
+    if ttl_days and time.time() - entry.get("time", 0) > ttl_days * 86400:
+        return None
+    return entry.get("id")
+
+
+def remember_id(source, tmdb_id, detail):
+    load()
+    with cache_lock:
+        id_map.setdefault(str(tmdb_id), {})[source] = {
+            "id": detail["id"],
+            "score": round(detail.get("score", 0.0), 4),
+            "query": detail.get("query", ""),
+            "time": int(time.time()),
+        }
+        entries = negative.get(str(tmdb_id))
+        if entries:
+            entries.pop(source, None)
+            if not entries:
+                negative.pop(str(tmdb_id), None)
+    _touch("cache")
+    if detail.get("best_title") and detail.get("score", 0.0) >= ACCEPT_SCORE:
+        add_alias(tmdb_id, detail["best_title"])
+
+
+def is_deferred(source, tmdb_id) -> bool:
+    """负缓存里还没到再查时间的返回 True"""
+    load()
+    with cache_lock:
+        entry = negative.get(str(tmdb_id), {}).get(source)
+    return bool(entry) and time.time() < entry.get("next_check", 0)
+
+
+def remember_miss(source, movie, detail):
+    """记一次未匹配，返回距下次再查的天数"""
+    load()
+    now = int(time.time())
+    with cache_lock:
+        entries = negative.setdefault(str(movie["id"]), {})
+        attempts = entries.get(source, {}).get("attempts", 0) + 1
+        days = min(NEGATIVE_BASE_DAYS * 2 ** (attempts - 1), NEGATIVE_MAX_DAYS)
+        entries[source] = {
+            "title": movie.get("title_cn") or movie.get("title_en", ""),
+            "year": movie.get("year", ""),
+            "best_id": detail.get("best_id"),
+            "best_title": detail.get("best_title", ""),
+            "best_score": round(detail.get("score", 0.0), 4),
+            "attempts": attempts,
+            "last_check": now,
+            "next_check": now + int(days * 86400),
+        }
+    _touch("cache")
+    return days
+
+
+def known_ids(tmdb_id):
+    """某部电影在各数据源上已解析出的 id：{source: id}"""
+    load()
+    with cache_lock:
+        entries = id_map.get(str(tmdb_id), {})
+        return {source: e.get("id") for source, e in entries.items()}
+
+
+# ============================
+# 本地片名索引（movies_to_download → 归一化片名/年份/别名）
+# ============================
+
+
+def _index_entry(movie):
+    titles = [movie.get("title_cn") or "", movie.get("title_en") or ""]
+    return {
+        "cn": titles[0],
+        "en": titles[1],
+        "year": title_match.parse_year(movie.get("year")),
+        "norms": [n for n in dict.fromkeys(title_match.normalize_title(t) for t in titles) if n],
+        "aliases": [],
+    }
+
+
+def _add_to_lookup(tmdb_id, entry):
+    title_lookup.add_normalized(int(tmdb_id), entry["norms"] + entry["aliases"], entry["year"])
+
+
+def load_title_index():
+    global title_index, title_lookup
+    with index_lock:
+        if title_index is not None:
+            return
+        data = _read_json(TITLE_INDEX_FILE) or {}
+        title_index = {"offset": data.get("offset", 0), "movies": data.get("movies", {})}
+        title_lookup = title_match.TitleIndex()
+        for tmdb_id, entry in title_index["movies"].items():
+            _add_to_lookup(tmdb_id, entry)
+
+
+def save_title_index():
+    with index_lock:
+        if title_index is None:
+            return
+        _saved("index")
+        _write_json(TITLE_INDEX_FILE, title_index)
+
+
+def refresh_title_index():
+    """
+    列表是只追加的 JSONL：从上次读到的字节位置接着读新行；文件变短说明被重写了，整表重建
+    只消费以换行结尾的完整行，写了一半的行留到下次
+    返回新增的电影数
+    """
+    global title_index, title_lookup
+    load_title_index()
+    try:
+        size = os.path.getsize(MOVIES_LIST_FILE)
+    except OSError:
+        return 0
+
+    with index_lock:
+        if size == title_index["offset"]:
+            return 0
+        if size < title_index["offset"]:
+            title_index = {"offset": 0, "movies": {}}
+            title_lookup = title_match.TitleIndex()
+
+        added = 0
+        with open(MOVIES_LIST_FILE, "rb") as f:
+            f.seek(title_index["offset"])
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                title_index["offset"] += len(raw)
+                try:
+                    movie = json.loads(raw.decode("utf-8"))
+                except ValueError:
+                    continue
+                key = str(movie["id"])
+                if key in title_index["movies"]:
+                    continue
+                entry = _index_entry(movie)
+                title_index["movies"][key] = entry
+                _add_to_lookup(key, entry)
+                added += 1
+    save_title_index()
+    return added
+
+
+def add_alias(tmdb_id, title):
+    """记下某部电影在其它数据源上的片名，之后本地查询和候选打分都会用到"""
+    norm = title_match.normalize_title(title)
+    if not norm:
+        return
+    load_title_index()
+    with index_lock:
+        entry = title_index["movies"].get(str(tmdb_id))
+        if not entry or norm in entry["norms"] or norm in entry["aliases"]:
+            return
+        entry["aliases"].append(norm)
+        title_lookup.add_normalized(int(tmdb_id), [norm], entry["year"])
+    _touch("index")
+
+
+def index_movie(tmdb_id):
+    """按 TMDB id 取回索引里的电影（resolve() 需要的字段），没有返回 None"""
+    refresh_title_index()
+    with index_lock:
+        entry = title_index["movies"].get(str(tmdb_id))
+    if not entry:
+        return None
+    return {"id": int(tmdb_id), "title_cn": entry["cn"], "title_en": entry["en"], "year": entry["year"] or ""}
+
+
+def lookup_title(title, year=None, min_score=LOOKUP_SCORE):
+    """
+    片名 → TMDB id，完全在本地完成：先查归一化片名字典，再走 n-gram 索引
+    模糊命中必须唯一、分数不低于 min_score、且续集编号一致（“唐人街探案3”不会认成“唐人街探案2”）；
+    否则返回 (None, 最高分)，调用方按原片名去搜
+    """
+    refresh_title_index()
+    with index_lock:
+        exact = title_lookup.exact(title)
+        if len(exact) == 1:
+            return exact[0], 1.0
+        top = title_lookup.query(title, year, top_k=2)
+    if not top or top[0][1] < min_score:
+        return None, top[0][1] if top else 0.0
+    if len(top) > 1 and top[1][1] >= top[0][1]:
+        return None, top[0][1]
+    movie = index_movie(top[0][0])
+    wanted = title_match.sequel_numbers(title)
+    if not movie or all(title_match.sequel_numbers(t) != wanted for t in movie_titles(movie)):
+        return None, top[0][1]
+    return top[0]
+
+
+def movie_targets(movie):
+    """目标电影的预处理片名：在索引里的用索引存好的归一化片名 + 别名，否则现算（有 LRU 缓存）"""
+    tmdb_id = movie.get("id")
+    if tmdb_id is not None:
+        load_title_index()
+        with index_lock:
+            entry = title_index["movies"].get(str(tmdb_id))
+        if entry:
+            return title_match.prepare_normalized(entry["norms"] + entry["aliases"])
+    return title_match.prepare_titles(movie_titles(movie))
+
+
+# ============================
+# 打分 & 搜索
+# ============================
+
+
+def movie_titles(movie):
+    return [t for t in dict.fromkeys([movie.get("title_cn"), movie.get("title_en")]) if t]
+
+
+def empty_detail():
+    return {"id": None, "score": 0.0, "query": "", "best_id": None, "best_title": "", "error": False}
+
+
+def merge_candidates(detail, movie, query, candidates):
+    """
+    用共享打分器给一批候选打分，更新 detail 里的最佳项
+    candidates：[{"id", "titles": [...], "year"}]；None 表示这次请求失败（网络/超时/HTTP 错误），
+    与“搜到了但没有结果”的 [] 区分开，失败的搜索不进负缓存
+    """
+    if candidates is None:
+        detail["error"] = True
+        return detail
+    targets = movie_targets(movie)
+    for c in candidates:
+        if c.get("id") is None:
+            continue
+        score = title_match.score_candidate(targets, movie.get("year"), c.get("titles") or [], c.get("year"))
+        if score > detail["score"]:
+            titles = [t for t in c.get("titles") or [] if t]
+            detail.update(
+                score=score,
+                query=query,
+                best_id=c["id"],
+                best_title=titles[0] if titles else "",
+            )
+    return detail
+
+
+def finish_detail(detail, threshold=MATCH_THRESHOLD):
+    if detail["best_id"] is not None and detail["score"] >= threshold:
+        detail["id"] = detail["best_id"]
+    return detail
+
+
+def search_by_titles(movie, search_fn, cancel=None, pause=0.0):
+    """
+    依次用中文名、英文名调 search_fn(query) -> candidates，够好就不再搜下一个
+    search_fn 请求失败时返回 None，detail["error"] 会被置上
+    """
+    detail = empty_detail()
+    for i, query in enumerate(movie_titles(movie)):
+        if cancel is not None and cancel.is_set():
+            break
+        if i and detail["score"] >= ACCEPT_SCORE:
+            break
+        if i and pause:
+            time.sleep(pause)
+        merge_candidates(detail, movie, query, search_fn(query))
+    return finish_detail(detail)
+
+
+class _InflightGuard:
+    """同一 (source, tmdb_id) 串行执行；最后一个用完的线程把锁从 _inflight 里删掉，字典不会越积越大"""
+
+    def __init__(self, source, tmdb_id):
+        self.key = (source, str(tmdb_id))
+
+    def __enter__(self):
+        with _inflight_lock:
+            entry = _inflight.setdefault(self.key, [threading.Lock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+        self.entry = entry
+
+    def __exit__(self, *exc):
+        self.entry[0].release()
+        with _inflight_lock:
+            self.entry[1] -= 1
+            if not self.entry[1]:
+                _inflight.pop(self.key, None)
+
+
+def resolve(source, movie, searcher, revalidate=False, ttl_days=0):
+    """
+    先查映射，命中直接返回；再查负缓存，没到再查时间就跳过；否则搜索并写入对应缓存
+    movie：{"id", "title_cn", "title_en", "year"}（movies_to_download 的一行）
+    返回 (id, 来源, detail)，来源为 "cache" / "search" / "deferred"；只有 "search" 时 detail 非 None
+    """
+    tmdb_id = movie["id"]
+    with _InflightGuard(source, tmdb_id):
+        if not revalidate:
+            cached = get_cached_id(source, tmdb_id, ttl_days)
+            if cached:
+                return cached, "cache", None
+            if is_deferred(source, tmdb_id):
+                return None, "deferred", None
+
+        detail = searcher(movie)
+        if detail.get("id"):
+            remember_id(source, tmdb_id, detail)
+        elif detail.get("error"):
+            # 请求失败不等于搜不到：不记负缓存，下次照常再搜
+            detail["retry_days"] = 0
+        else:
+            detail["retry_days"] = remember_miss(source, movie, detail)
+        return detail.get("id"), "search", detail
+
+
+# ============================
+# 命令行：批量解析整个列表
+# ============================
+
+
+def _source_searcher(source):
+    if source == "mtime":
+        import MTime
+
+        return MTime.resolver_search
+    if source == "maoyan":
+        import maoyan
+
+        return maoyan.resolver_search
+    if source == "douban":
+        import douban
+
+        return douban.resolver_search
+    raise ValueError(f"未知数据源：{source}")
+
+
+def iter_tmdb_movies(path=None):
+    """逐行读 movies_to_download.jsonl（坏行跳过，重复追加的 id 只取第一行，见 MTime.append_movies_to_list）"""
+    path = path or MOVIES_LIST_FILE
+    if not os.path.exists(path):
+        return
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                m = json.loads(line)
+            except Exception:
+                continue
+            if m.get("id") in seen:
+                continue
+            seen.add(m.get("id"))
+            yield m
+
+
+def resolve_all(sources=SOURCES, movies=None):
+    """每部电影 × 每个数据源解析一遍，返回 {source: {"cache", "search", "deferred", "hit"}}"""
+    searchers = {s: _source_searcher(s) for s in sources}
+    counts = {s: {"cache": 0, "search": 0, "deferred": 0, "hit": 0} for s in sources}
+    for movie in movies if movies is not None else iter_tmdb_movies():
+        searched = False
+        for source, searcher in searchers.items():
+            found, origin, _ = resolve(source, movie, searcher)
+            counts[source][origin] += 1
+            searched = searched or origin == "search"
+            if found:
+                counts[source]["hit"] += 1
+        if searched and RESOLVE_ALL_PAUSE:
+            # 命中缓存/负缓存的不用等；真发过请求的电影之间留出间隔，避免连续打满各站的搜索接口
+            time.sleep(RESOLVE_ALL_PAUSE)
+    flush()
+    return counts
+
+
+if __name__ == "__main__":
+    wanted = [s for s in sys.argv[1:] if s in SOURCES] or list(SOURCES)
+    for source, c in resolve_all(wanted).items():
+        print(f"{source}: 命中 {c['hit']}（缓存 {c['cache']} / 搜索 {c['search']}），负缓存跳过 {c['deferred']}")
@@ -0,0 +1,145 @@
+"""
+缩略图 / 预览图生成
+
+每张原图在 SAVE_DIR/.thumbs/<尺寸名>/<原图相对路径（含扩展名）>.jpg 下生成固定尺寸的 JPEG，
+浏览图库时不用再解码几 MB 的原图。文件名保留原扩展名（a.jpg → a.jpg.jpg），同目录的 a.jpg 和 a.png 不会互相覆盖。
+- 在进程池里生成（postprocess.PoolStage），四个数据源下载完成时经 image_store 回调自动入队
+- 幂等、增量：缩略图比原图新就跳过，重复入队也不会重复生成
+- 已有图库批量回填：python thumbnails.py backfill [目录]
+"""
+
+import os
+import sys
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+import image_store
+import postprocess
+
+
+THUMBS_ENABLED = True
+THUMBS_WORKERS = postprocess.DEFAULT_WORKERS
+THUMB_SIZES = {
+    "thumb": 320,  # 列表/网格用
+    "preview": 1280,  # 大图预览用
+}
+THUMB_QUALITY = 85
+THUMBS_DIR = os.path.join(image_store.SAVE_DIR, ".thumbs")
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def thumb_path(path, size_name):
+    rel = os.path.relpath(path, image_store.SAVE_DIR)
+    return os.path.join(THUMBS_DIR, size_name, rel + ".jpg")
+
+
+def _is_fresh(dest, src_mtime):
+    try:
+        return os.path.getmtime(dest) >= src_mtime
+    except OSError:
+        return False
+
+
+def needs_thumbs(path, file=None):
+    try:
+        mtime = os.path.getmtime(file or path)
+    except OSError:
+        return False
+    return any(not _is_fresh(thumb_path(path, name), mtime) for name in THUMB_SIZES)
+
+
+# ============================
+# 子进程里执行的计算
+# ============================
+
+
+def make_thumbs(item):
+    """
+    item = (目标路径, 实际文件)；返回新生成的张数，原图读不了返回 -1
+    大尺寸先生成，小尺寸从大尺寸结果再缩，原图只解码一次
+    """
+    path, file = item
+    try:
+        mtime = os.path.getmtime(file)
+        todo = [(name, px) for name, px in THUMB_SIZES.items() if not _is_fresh(thumb_path(path, name), mtime)]
+        if not todo:
+            return 0
+        todo.sort(key=lambda x: x[1], reverse=True)
+        with Image.open(file) as img:
+            img.draft("RGB", (todo[0][1], todo[0][1]))
+            img = img.convert("RGB")
+            for name, px in todo:
+                img.thumbnail((px, px), Image.LANCZOS)
+                dest = thumb_path(path, name)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                tmp = dest + ".part"
+                img.save(tmp, "JPEG", quality=THUMB_QUALITY, optimize=True)
+                os.replace(tmp, dest)
+        return len(todo)
+    except Exception:
+        return -1
+
+
+# ============================
+# 后台生成 & 批量回填
+# ============================
+
+stats = {"generated": 0, "failed": 0}
+_stage = None
+
+
+def _on_result(item, result):
+    if result < 0:
+        stats["failed"] += 1
+    else:
+        stats["generated"] += result
+
+
+def _on_image_written(result):
+    if _stage is not None:
+        _stage.submit((result["path"], result["file"]))
+
+
+def get_stage():
+    global _stage
+    if _stage is None:
+        _stage = postprocess.PoolStage("thumbnails", make_thumbs, _on_result, workers=THUMBS_WORKERS)
+    return _stage
+
+
+def start():
+    if not THUMBS_ENABLED or not available():
+        return False
+    get_stage().start()
+    image_store.add_listener(_on_image_written)
+    return True
+
+
+def stop():
+    image_store.remove_listener(_on_image_written)
+    if _stage is not None:
+        _stage.stop()
+
+
+def backfill(root=None, progress=None):
+    """为已有图库补缩略图（已是最新的跳过），返回处理的原图数"""
+    if not available():
+        print("⚠ 需要安装 Pillow")
+        return 0
+    root = root or image_store.SAVE_DIR
+    pending = ((p, p) for p in postprocess.iter_image_files(root) if needs_thumbs(p))
+    return get_stage().run_bulk(pending, progress=progress)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        n = backfill(sys.argv[2] if len(sys.argv) > 2 else None, progress=lambda d: print(f"已处理 {d} 张"))
+        print(f"完成：处理 {n} 张原图，生成 {stats['generated']} 张缩略图，失败 {stats['failed']} 张")
+    else:
+        print("用法：python thumbnails.py backfill [目录]")
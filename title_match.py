@@ -0,0 +1,433 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import difflib
+import functools
+from collections import namedtuple
+
+try:
+    import numpy as np  # 可选：有 numpy 时批量打分走向量化
+except Exception:
+    np = None
+
+
+# ============================
+# 配置参数
+# ============================
+
+YEAR_TOLERANCE = 2  # 年份相差超过几年开始扣分
+YEAR_PENALTY = 0.15  # 年份不符的扣分（与 MTime 旧逻辑一致）
+MATCH_THRESHOLD = 0.5  # 低于此分视为未匹配
+
+
+# ============================
+# 标题归一化 & n-gram
+# ============================
+
+
+def normalize_title(s: str) -> str:
+    if not s:
+        return ""
+    s = s.strip()
+    # 去掉括号里的年份等
+    s = re.split(r"[（）()]", s)[0]
+    # 全部小写，去掉空格
+    s = s.lower().replace(" ", "")
+    return s
+
+
+def is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF
+        or 0x3400 <= code <= 0x4DBF
+        or 0x3040 <= code <= 0x30FF  # 日文假名
+        or 0xAC00 <= code <= 0xD7AF  # 韩文
+        or 0xF900 <= code <= 0xFAFF
+    )
+
+
+def title_grams(title: str, normalized: bool = False) -> frozenset:
+    """
+    中日韩字符：单字 + 相邻二元组（bigram）
+    其它字符（字母数字等）：首尾补位后的三元组（trigram）
+    """
+    s = title if normalized else normalize_title(title)
+    grams = set()
+    run = []
+    run_cjk = None
+
+    def flush():
+        if not run:
+            return
+        text = "".join(run)
+        if run_cjk:
+            grams.update(text)
+            for i in range(len(text) - 1):
+                grams.add(text[i : i + 2])
+        else:
+            padded = f"^{text}$"
+            for i in range(len(padded) - 2):
+                grams.add(padded[i : i + 3])
+        run.clear()
+
+    for ch in s:
+        if not ch.isalnum():
+            flush()
+            run_cjk = None
+            continue
+        cjk = is_cjk(ch)
+        if run_cjk is not None and cjk != run_cjk:
+            flush()
+        run_cjk = cjk
+        run.append(ch)
+    flush()
+    return frozenset(grams)
+
+
+CN_NUMERALS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+ROMAN_NUMERALS = {"II": 2, "III": 3, "IV": 4, "V": 5, "VI": 6, "VII": 7, "VIII": 8}
+
+
+def sequel_numbers(title: str) -> frozenset:
+    """片名里的续集编号（阿拉伯数字、第X部/集、罗马数字），“唐人街探案3” → {3}，没有编号返回空集"""
+    if not title:
+        return frozenset()
+    s = normalize_title(title)
+    nums = {int(n) for n in re.findall(r"\d+", s)}
+    nums.update(CN_NUMERALS[c] for c in re.findall(r"第([一二三四五六七八九十])[部集章季]", s))
+    nums.update(ROMAN_NUMERALS[r] for r in re.findall(r"\b(VIII|VII|VI|IV|V|III|II)\b", title))
+    return frozenset(nums)
+
+
+def parse_year(value):
+    """从 "2019" / "2019-05-01大陆上映" / 2019 里取出年份，取不到返回 0"""
+    if not value:
+        return 0
+    m = re.search(r"(19|20)\d{2}", str(value))
+    return int(m.group(0)) if m else 0
+
+
+def year_penalty(y1, y2) -> float:
+    y1 = parse_year(y1)
+    y2 = parse_year(y2)
+    if y1 and y2 and abs(y1 - y2) > YEAR_TOLERANCE:
+        return YEAR_PENALTY
+    return 0.0
+
+
+# ============================
+# 预处理目标片名：同一部电影的片名只归一化/切 gram 一次
+# ============================
+
+PreparedTitles = namedtuple("PreparedTitles", ["norms", "grams"])
+
+
+@functools.lru_cache(maxsize=8192)
+def _prepare_normalized(norms):
+    grams = tuple(g for g in (title_grams(n, True) for n in norms) if g)
+    return PreparedTitles(frozenset(norms), grams)
+
+
+def prepare_normalized(norms) -> PreparedTitles:
+    """已归一化的片名（如从索引文件读出的）直接组装，不再 normalize_title"""
+    return _prepare_normalized(tuple(dict.fromkeys(n for n in norms if n)))
+
+
+def prepare_titles(titles) -> PreparedTitles:
+    return prepare_normalized(normalize_title(t) for t in titles if t)
+
+
+# ============================
+# 单对打分
+# ============================
+
+
+def dice(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return 2.0 * len(a & b) / (len(a) + len(b))
+
+
+def title_similarity(a: str, b: str) -> float:
+    na = normalize_title(a)
+    nb = normalize_title(b)
+    if not na or not nb:
+        return 0.0
+    if na == nb:
+        return 1.0
+    return dice(title_grams(na, True), title_grams(nb, True))
+
+
+def score_candidate(target_titles, target_year, cand_titles, cand_year) -> float:
+    """
+    目标的所有别名 × 候选的所有别名取最高相似度，再按年份扣分
+    target_titles：片名列表，或 prepare_titles() 的结果（批量给候选打分时避免重复归一化）
+    cand_titles：片名列表（中文名、英文名、别名…），空值自动忽略
+    """
+    if not isinstance(target_titles, PreparedTitles):
+        target_titles = prepare_titles(target_titles)
+    norm_c = {normalize_title(t) for t in cand_titles if t}
+    norm_c.discard("")
+    cands = [g for g in (title_grams(n, True) for n in norm_c) if g]
+    if not target_titles.grams or not cands:
+        return 0.0
+
+    if target_titles.norms & norm_c:
+        best = 1.0
+    else:
+        best = max(dice(a, b) for a in target_titles.grams for b in cands)
+    return best - year_penalty(target_year, cand_year)
+
+
+def pick_best(target_titles, target_year, candidates, threshold=MATCH_THRESHOLD):
+    """
+    candidates：[{"titles": [...], "year": ..., ...}]
+    返回 (最佳候选, 分数)；最佳分数低于阈值时候选为 None
+    """
+    best = None
+    best_score = 0.0
+    for c in candidates:
+        score = score_candidate(target_titles, target_year, c.get("titles") or [], c.get("year"))
+        if score > best_score:
+            best = c
+            best_score = score
+    if best_score < threshold:
+        return None, best_score
+    return best, best_score
+
+
+# ============================
+# 批量索引：一次对上千个已知片名打分
+# ============================
+
+
+class TitleIndex:
+    """
+    倒排索引：gram → 行号。每个 key（如 TMDB id）可有多行（中文名/英文名/别名）。
+    查询时统计每行与查询共有的 gram 数，再算 Dice 系数，按 key 取最大值。
+    """
+
+    def __init__(self):
+        self.keys = []  # key 序号 → key
+        self.key_pos = {}  # key → key 序号
+        self.key_years = []  # key 序号 → 年份（0 表示未知）
+        self.row_key = []  # 行号 → key 序号
+        self.row_size = []  # 行号 → gram 数
+        self.row_norm = []  # 行号 → 归一化片名
+        self.norm_rows = {}  # 归一化片名 → [行号...]（完全相同直接满分）
+        self.postings = {}  # gram → [行号...]
+        self._arrays = None  # numpy 版本的索引，查询前按需构建
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, titles, year=None):
+        self.add_normalized(key, [normalize_title(t) for t in titles], year)
+
+    def add_normalized(self, key, norms, year=None):
+        """norms 是已归一化的片名；同一 key 可多次追加（如后来学到的别名）"""
+        pos = self.key_pos.get(key)
+        if pos is None:
+            pos = len(self.keys)
+            self.key_pos[key] = pos
+            self.keys.append(key)
+            self.key_years.append(parse_year(year))
+
+        for norm in norms:
+            if not norm or any(self.row_key[r] == pos for r in self.norm_rows.get(norm, ())):
+                continue
+            grams = title_grams(norm, True)
+            if not grams:
+                continue
+            row = len(self.row_key)
+            self.row_key.append(pos)
+            self.row_size.append(len(grams))
+            self.row_norm.append(norm)
+            self.norm_rows.setdefault(norm, []).append(row)
+            for g in grams:
+                self.postings.setdefault(g, []).append(row)
+        self._arrays = None
+
+    def _build_arrays(self):
+        self._arrays = {
+            "row_key": np.asarray(self.row_key, dtype=np.int32),
+            "row_size": np.asarray(self.row_size, dtype=np.float32),
+            "key_years": np.asarray(self.key_years, dtype=np.int32),
+            "postings": {g: np.asarray(rows, dtype=np.int32) for g, rows in self.postings.items()},
+        }
+
+    def _row_scores_numpy(self, grams):
+        if self._arrays is None:
+            self._build_arrays()
+        arr = self._arrays
+        hits = [arr["postings"][g] for g in grams if g in arr["postings"]]
+        n_rows = len(self.row_key)
+        if not hits:
+            return np.zeros(n_rows, dtype=np.float32)
+        inter = np.bincount(np.concatenate(hits), minlength=n_rows).astype(np.float32)
+        return 2.0 * inter / (len(grams) + arr["row_size"])
+
+    def _row_scores_python(self, grams):
+        inter = {}
+        for g in grams:
+            for row in self.postings.get(g, ()):
+                inter[row] = inter.get(row, 0) + 1
+        q = len(grams)
+        return {row: 2.0 * n / (q + self.row_size[row]) for row, n in inter.items()}
+
+    def exact(self, title):
+        """归一化后完全相同的 key 列表（字典查找，不打分）"""
+        norm = normalize_title(title)
+        keys = [self.keys[self.row_key[row]] for row in self.norm_rows.get(norm, ())]
+        return list(dict.fromkeys(keys))
+
+    def query(self, title, year=None, top_k=5, aliases=()):
+        """返回 [(key, 分数), ...]，按分数从高到低；title 与 aliases 取最高"""
+        norms = [normalize_title(t) for t in (title, *aliases)]
+        norms = [n for n in dict.fromkeys(norms) if n]
+        if not norms or not self.keys:
+            return []
+        y = parse_year(year)
+
+        if np is not None:
+            key_scores = np.zeros(len(self.keys), dtype=np.float32)
+            for norm in norms:
+                row_scores = self._row_scores_numpy(title_grams(norm, True))
+                np.maximum.at(key_scores, self._arrays["row_key"], row_scores)
+            # 完全相同的归一化片名直接给满分
+            for norm in norms:
+                for row in self.norm_rows.get(norm, ()):
+                    key_scores[self.row_key[row]] = 1.0
+            if y:
+                years = self._arrays["key_years"]
+                mask = (years > 0) & (np.abs(years - y) > YEAR_TOLERANCE)
+                key_scores = key_scores - mask * YEAR_PENALTY
+            k = min(top_k, len(self.keys))
+            top = np.argpartition(-key_scores, k - 1)[:k]
+            top = top[np.argsort(-key_scores[top])]
+            return [(self.keys[i], float(key_scores[i])) for i in top if key_scores[i] > 0]
+
+        key_scores = {}
+        for norm in norms:
+            for row, score in self._row_scores_python(title_grams(norm, True)).items():
+                pos = self.row_key[row]
+                if self.row_norm[row] == norm:
+                    score = 1.0
+                if score > key_scores.get(pos, 0.0):
+                    key_scores[pos] = score
+        result = []
+        for pos, score in key_scores.items():
+            ky = self.key_years[pos]
+            if y and ky and abs(ky - y) > YEAR_TOLERANCE:
+                score -= YEAR_PENALTY
+            if score > 0:
+                result.append((self.keys[pos], score))
+        result.sort(key=lambda x: x[1], reverse=True)
+        return result[:top_k]
+
+
+# ============================
+# 基准测试：与 difflib.SequenceMatcher 对比速度和准确率
+#   python title_match.py [电影列表文件] [查询数]
+# ============================
+
+
+def _load_movies(path):
+    movies = []
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        movies.append(json.loads(line))
+                    except ValueError:
+                        continue
+        else:
+            movies = json.load(f)
+    return movies
+
+
+def _perturb(title, rng):
+    """模拟搜索结果里常见的片名差异"""
+    kind = rng.randrange(4)
+    if kind == 0:
+        return title + "（" + str(rng.randrange(1990, 2027)) + "）"
+    if kind == 1 and len(title) > 3:
+        i = rng.randrange(len(title))
+        return title[:i] + title[i + 1 :]
+    if kind == 2:
+        return title + rng.choice(["：导演剪辑版", " 特别版", "2", " IMAX"])
+    return title
+
+
+def run_benchmark(path, n_queries=300):
+    movies = _load_movies(path)
+    entries = []
+    for m in movies:
+        titles = [m.get("title_cn") or "", m.get("title_en") or ""]
+        if any(normalize_title(t) for t in titles):
+            entries.append((m["id"], titles, m.get("year")))
+
+    rng = random.Random(42)
+    samples = rng.sample(entries, min(n_queries, len(entries)))
+    queries = [(mid, _perturb(titles[0] or titles[1], rng), year) for mid, titles, year in samples]
+
+    # 同名电影算对：比较归一化片名集合
+    names_of = {mid: {normalize_title(t) for t in titles if t} for mid, titles, _y in entries}
+
+    def correct(expect, got):
+        return got is not None and (got == expect or names_of[got] & names_of[expect])
+
+    # difflib：逐个候选两次 SequenceMatcher（与 MTime 旧逻辑一致）
+    t0 = time.perf_counter()
+    diff_ok = 0
+    for expect, q, year in queries:
+        nq = normalize_title(q)
+        best, best_score = None, 0.0
+        for mid, titles, y in entries:
+            ratio = 0.0
+            for t in titles:
+                nt = normalize_title(t)
+                if nt and nq:
+                    ratio = max(ratio, difflib.SequenceMatcher(None, nt, nq).ratio())
+            score = ratio - year_penalty(year, y)
+            if score > best_score:
+                best, best_score = mid, score
+        diff_ok += bool(correct(expect, best))
+    diff_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    index = TitleIndex()
+    for mid, titles, y in entries:
+        index.add(mid, titles, y)
+    build_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    idx_ok = 0
+    for expect, q, year in queries:
+        top = index.query(q, year, top_k=1)
+        idx_ok += bool(correct(expect, top[0][0] if top else None))
+    idx_time = time.perf_counter() - t0
+
+    n = len(queries)
+    print(f"片名数：{len(entries)}，查询数：{n}，numpy：{'有' if np is not None else '无'}")
+    print(f"difflib   ：{diff_time / n * 1000:8.2f} ms/次  准确率 {diff_ok / n:.1%}")
+    print(
+        f"TitleIndex：{idx_time / n * 1000:8.2f} ms/次  准确率 {idx_ok / n:.1%}"
+        f"（建索引 {build_time * 1000:.0f} ms）"
+    )
+
+
+if __name__ == "__main__":
+    base = os.path.dirname(os.path.abspath(__file__))
+    default = os.path.join(base, "movies_to_download.jsonl")
+    if not os.path.exists(default):
+        default = os.path.join(base, "movies_to_download.json")
+    list_path = sys.argv[1] if len(sys.argv) > 1 else default
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    run_benchmark(list_path, count)
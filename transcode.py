@@ -0,0 +1,393 @@
+"""
+冷图转码（WebP / AVIF），按磁盘预算控制图库增长
+
+TMDB original 背景图和 MTime 海报动辄几 MB，多数下载后很少再看。这里定期：
+1. library_scan 增量扫描图库，算出图库大小
+2. 超过 LIBRARY_BUDGET_GB 时，从最久没动过的冷图（mtime 早于 COLD_DAYS 天）开始，
+   在进程池里转成 TRANSCODE_FORMAT，直到省下的字节把图库压回预算以内
+   （LIBRARY_BUDGET_GB = 0 时不看预算，冷图全部转）
+3. 新文件与原图同目录同名、换扩展名；转出来不够小（省不到 MIN_SAVING）的保留原图
+4. 原图挪到 SAVE_DIR/.originals/ 下保留 KEEP_ORIGINAL_DAYS 天，可 restore 还原；
+   磁盘剩余低于 MIN_FREE_GB 时提前清理最早的原图
+映射（新文件 → 原图、保留位置、大小）记在 SAVE_DIR/.transcoded.json，对账时据此把新文件认回原来的 key；
+image_store.exists() 认转码后的同名文件，豆瓣/猫眼不会重下。
+
+python transcode.py [run | purge | restore]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+import image_store
+import library_scan
+import postprocess
+
+
+TRANSCODE_ENABLED = False
+TRANSCODE_WORKERS = max(1, postprocess.DEFAULT_WORKERS // 2)  # 后台慢慢转，不和下载抢 CPU
+TRANSCODE_FORMAT = "webp"  # "webp" / "avif"（AVIF 需要 Pillow 11.3+ 或 pillow-avif-plugin）
+TRANSCODE_QUALITY = 82
+TRANSCODE_SOURCES = ("tmdb", "mtime")  # 空元组表示所有来源
+TRANSCODE_EXTS = (".jpg", ".jpeg", ".png")
+SAVE_OPTIONS = {"webp": {"method": 4}, "avif": {"speed": 6}}
+
+COLD_DAYS = 30  # 多少天没改动算冷图
+MIN_IMAGE_SIZE = 256 * 1024  # 太小的图转了也省不了多少
+MIN_SAVING = 0.15  # 新文件至少比原图小这么多才替换
+KEEP_ORIGINAL_DAYS = 14  # 原图保留天数，0 = 转完直接删
+LIBRARY_BUDGET_GB = 0  # 图库（不含 . 开头的目录）超过这个大小才转码；0 = 冷图全部转
+MIN_FREE_GB = 20  # 磁盘剩余低于此值时提前清理保留的原图
+TRANSCODE_INTERVAL = 3600  # 后台每隔多少秒检查一次
+TRANSCODE_JOIN_TIMEOUT = 60  # 停止时最多等手上这一块转完、映射存盘多少秒
+
+ORIGINALS_DIR = os.path.join(image_store.SAVE_DIR, ".originals")
+MAP_FILE = os.path.join(image_store.SAVE_DIR, ".transcoded.json")
+SAVE_EVERY = 200
+
+GB = 1024 ** 3
+
+
+def available() -> bool:
+    return Image is not None
+
+
+# ============================
+# 子进程里执行的转码
+# ============================
+
+
+def transcode_file(item):
+    """
+    item = (原图路径, 格式, 质量)；返回 (新文件路径, 原大小, 新大小)
+    转不了或不够小返回 None，不留下半成品
+    """
+    path, fmt, quality = item
+    dest = os.path.splitext(path)[0] + "." + fmt
+    tmp = dest + ".part"
+    try:
+        size = os.path.getsize(path)
+        with Image.open(path) as img:
+            icc = img.info.get("icc_profile")
+            if img.mode not in ("RGB", "RGBA", "L"):
+                img = img.convert("RGB")
+            options = dict(SAVE_OPTIONS.get(fmt, {}))
+            if icc:
+                options["icc_profile"] = icc
+            img.save(tmp, fmt.upper(), quality=quality, **options)
+        new_size = os.path.getsize(tmp)
+        if new_size > size * (1 - MIN_SAVING):
+            os.remove(tmp)
+            return None
+        os.replace(tmp, dest)
+        return dest, size, new_size
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+
+
+# ============================
+# 映射记录
+# ============================
+
+map_lock = threading.Lock()
+mapping = None  # {"files": {新文件相对路径: {...}}, "skip": {原图相对路径: [大小, mtime]}}
+
+
+def _rel(path):
+    return os.path.relpath(path, image_store.SAVE_DIR).replace("\\", "/")
+
+
+def _abs(rel):
+    return os.path.join(image_store.SAVE_DIR, rel.replace("/", os.sep))
+
+
+def load_mapping():
+    global mapping
+    with map_lock:
+        if mapping is None:
+            mapping = {"files": {}, "skip": {}}
+            if os.path.exists(MAP_FILE):
+                try:
+                    with open(MAP_FILE, "r", encoding="utf-8") as f:
+                        mapping.update(json.load(f))
+                except Exception as e:
+                    print(f"⚠ 转码映射读取失败，将重建：{e}")
+        return mapping
+
+
+def save_mapping():
+    with map_lock:
+        if mapping is None:
+            return
+        tmp = MAP_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(mapping, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, MAP_FILE)
+
+
+def original_paths():
+    """{新文件绝对路径: 原图绝对路径}，对账时把转码后的文件认回原来的 key"""
+    return {_abs(new): _abs(info["original"]) for new, info in load_mapping()["files"].items()}
+
+
+# ============================
+# 选图 & 转码结果处理
+# ============================
+
+stats = {"transcoded": 0, "skipped": 0, "saved_bytes": 0, "purged": 0, "purged_bytes": 0}
+_dirty = 0
+
+
+def iter_candidates(now=None):
+    """冷图候选，最久没动过的在前：[(mtime, 路径, 大小), ...]；同时返回图库总字节数"""
+    now = now or time.time()
+    cutoff = now - COLD_DAYS * 86400
+    skip = load_mapping()["skip"]
+    total = 0
+    found = []
+    for f in library_scan.iter_files():
+        total += f["size"]
+        if TRANSCODE_SOURCES and f["source"] not in TRANSCODE_SOURCES:
+            continue
+        if f["size"] < MIN_IMAGE_SIZE or f["mtime"] > cutoff:
+            continue
+        if not f["path"].lower().endswith(TRANSCODE_EXTS):
+            continue
+        if skip.get(_rel(f["path"])) == [f["size"], f["mtime"]]:
+            continue
+        found.append((f["mtime"], f["path"], f["size"]))
+    found.sort()
+    return found, total
+
+
+def _keep_original(path):
+    """原图挪进 .originals/（KEEP_ORIGINAL_DAYS = 0 时直接删），返回保留位置的相对路径"""
+    if KEEP_ORIGINAL_DAYS <= 0:
+        os.remove(path)
+        return ""
+    dest = os.path.join(ORIGINALS_DIR, os.path.relpath(path, image_store.SAVE_DIR))
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.move(path, dest)
+    return _rel(dest)
+
+
+def _on_result(item, result):
+    global _dirty
+    path = item[0]
+    m = load_mapping()
+    if result is None:
+        try:
+            st = os.stat(path)
+            with map_lock:
+                m["skip"][_rel(path)] = [st.st_size, int(st.st_mtime)]
+        except OSError:
+            pass
+        stats["skipped"] += 1
+    else:
+        dest, size, new_size = result
+        try:
+            kept = _keep_original(path)
+        except OSError as e:
+            print(f"⚠ 转码后移走原图失败：{path} {e}")
+            os.remove(dest)
+            return
+        with map_lock:
+            m["files"][_rel(dest)] = {
+                "original": _rel(path),
+                "kept": kept,
+                "time": int(time.time()),
+                "size": size,
+                "new_size": new_size,
+            }
+        stats["transcoded"] += 1
+        stats["saved_bytes"] += size - new_size
+    _dirty += 1
+    if _dirty >= SAVE_EVERY:
+        _dirty = 0
+        save_mapping()
+
+
+_stage = None
+
+
+def get_stage():
+    global _stage
+    if _stage is None:
+        _stage = postprocess.PoolStage("transcode", transcode_file, _on_result, workers=TRANSCODE_WORKERS)
+    return _stage
+
+
+# ============================
+# 原图保留窗口
+# ============================
+
+
+def purge_originals(need_bytes=0, now=None):
+    """删掉超过保留期的原图；need_bytes > 0 时再从最早的开始提前删，直到腾出这么多空间"""
+    now = now or time.time()
+    m = load_mapping()
+    with map_lock:
+        kept = sorted(
+            ((info["time"], new, info) for new, info in m["files"].items() if info.get("kept")),
+            key=lambda x: x[0],
+        )
+    freed = 0
+    for ts, _new, info in kept:
+        expired = now - ts >= KEEP_ORIGINAL_DAYS * 86400
+        if not expired and freed >= need_bytes:
+            break
+        path = _abs(info["kept"])
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"⚠ 清理原图失败：{path} {e}")
+            continue
+        with map_lock:
+            info["kept"] = ""
+        freed += info["size"]
+        stats["purged"] += 1
+        stats["purged_bytes"] += info["size"]
+    if freed:
+        save_mapping()
+    return freed
+
+
+def restore():
+    """把还保留着的原图放回原处、删掉转码文件，返回还原数"""
+    m = load_mapping()
+    restored = 0
+    with map_lock:
+        items = [(new, info) for new, info in m["files"].items() if info.get("kept")]
+    for new, info in items:
+        src = _abs(info["kept"])
+        if not os.path.exists(src):
+            continue
+        dest = _abs(info["original"])
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.move(src, dest)
+        try:
+            os.remove(_abs(new))
+        except FileNotFoundError:
+            pass
+        with map_lock:
+            m["files"].pop(new, None)
+        restored += 1
+    save_mapping()
+    return restored
+
+
+# ============================
+# 一轮检查 & 后台线程
+# ============================
+
+
+def _free_bytes():
+    try:
+        return shutil.disk_usage(image_store.SAVE_DIR).free
+    except OSError:
+        return None
+
+
+def run_once(progress=None):
+    """扫描 → 清理过期原图 → 按预算转码冷图，返回本轮转码的张数"""
+    global _dirty
+    if not available():
+        print("⚠ 需要安装 Pillow")
+        return 0
+    library_scan.scan()
+
+    free = _free_bytes()
+    shortage = MIN_FREE_GB * GB - free if free is not None else 0
+    purge_originals(need_bytes=max(shortage, 0))
+
+    candidates, total = iter_candidates()
+    excess = total - LIBRARY_BUDGET_GB * GB if LIBRARY_BUDGET_GB > 0 else None
+    if excess is not None and excess <= 0:
+        return 0
+
+    start_saved = stats["saved_bytes"]
+
+    def pending():
+        for _mtime, path, _size in candidates:
+            if _stop_event.is_set():
+                return
+            if excess is not None and stats["saved_bytes"] - start_saved >= excess:
+                return
+            yield (path, TRANSCODE_FORMAT, TRANSCODE_QUALITY)
+
+    try:
+        done = get_stage().run_bulk(pending(), progress=progress, chunk=64)
+    finally:
+        _dirty = 0
+        save_mapping()
+    if done:
+        print(f"🗜 转码 {done} 张冷图，累计省下 {stats['saved_bytes'] / GB:.2f} GB")
+    return done
+
+
+_stop_event = threading.Event()
+_thread = None
+
+
+def _loop():
+    while not _stop_event.is_set():
+        try:
+            run_once()
+        except Exception as e:
+            print(f"⚠ 转码出错：{e}")
+        _stop_event.wait(TRANSCODE_INTERVAL)
+
+
+def start():
+    """后台定期转码；下载照常进行"""
+    global _thread
+    if not TRANSCODE_ENABLED or not available():
+        return False
+    if _thread and _thread.is_alive():
+        return True
+    _stop_event.clear()
+    _thread = threading.Thread(target=_loop, name="transcode", daemon=True)
+    _thread.start()
+    return True
+
+
+def stop():
+    """请求停止并等后台线程转完手上这一块、存好映射；之后再停进程池"""
+    global _thread
+    _stop_event.set()
+    thread = _thread
+    if thread and thread.is_alive() and thread is not threading.current_thread():
+        thread.join(TRANSCODE_JOIN_TIMEOUT)
+        if thread.is_alive():
+            # run_bulk 还在用进程池，这时关池会把它的收尾搅乱；线程是守护线程，退出时随进程结束
+            print("⚠ 转码线程未能及时停止")
+            return
+    _thread = None
+    if _stage is not None:
+        _stage.stop()
+
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "run":
+        n = run_once(progress=lambda d: print(f"已处理 {d} 张"))
+        print(f"完成：转码 {n} 张，跳过 {stats['skipped']} 张，省下 {stats['saved_bytes'] / GB:.2f} GB")
+    elif cmd == "purge":
+        purge_originals()
+        print(f"已清理 {stats['purged']} 张过期原图，{stats['purged_bytes'] / GB:.2f} GB")
+    elif cmd == "restore":
+        print(f"已还原 {restore()} 张原图")
+    else:
+        print("用法：python transcode.py run | purge | restore")
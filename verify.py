@@ -0,0 +1,291 @@
+"""
+图片完整性校验
+
+下载“成功”的文件也可能是坏的：0 字节、被截断、或者服务器返回的 HTML 错误页。
+这里在进程池里逐张检查：
+- 文件头魔数（JPEG / PNG / GIF / WebP / BMP），HTML 和空文件直接判坏
+- JPEG 结尾必须有 EOI 标记（FF D9）；EOI 后面还跟着多余字节的，改做一次完整解码，解得出来就算好图
+- 能被 Pillow 完整解码（未安装 Pillow 时跳过这一步）
+坏图挪到 SAVE_DIR/.corrupt/ 下并记到 .corrupt.jsonl，同时从对应数据源的记录里去掉、重新排队下载。
+
+新下载的图经 image_store 回调自动校验；已有图库：python verify.py scan [目录]
+"""
+
+import os
+import sys
+import json
+import shutil
+import importlib
+import threading
+
+try:
+    from PIL import Image, ImageFile
+except Exception:
+    Image = ImageFile = None
+
+import image_store
+import library_scan
+import postprocess
+
+
+VERIFY_ENABLED = True
+VERIFY_WORKERS = postprocess.DEFAULT_WORKERS
+VERIFY_DECODE = True  # 是否做完整解码检查（最慢的一步）
+
+CORRUPT_DIR = os.path.join(image_store.SAVE_DIR, ".corrupt")
+CORRUPT_LOG = os.path.join(image_store.SAVE_DIR, ".corrupt.jsonl")
+VERIFIED_FILE = os.path.join(image_store.SAVE_DIR, ".verified.json")  # 批量扫描已通过的 {相对路径: [大小, mtime]}
+
+
+# ============================
+# 子进程里执行的检查
+# ============================
+
+
+def decode_strict(path):
+    """不缩小、不容忍截断地完整解码一次，成功返回 True"""
+    ImageFile.LOAD_TRUNCATED_IMAGES = False
+    try:
+        with Image.open(path) as img:
+            img.load()
+        return True
+    except Exception:
+        return False
+
+
+def check_file(path):
+    """返回 (是否完好, 原因)"""
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return False, "empty"
+        with open(path, "rb") as f:
+            head = f.read(16)
+            fmt = image_store.sniff_format(head)
+            if not fmt:
+                if head.lstrip().startswith(b"<"):
+                    return False, "html"
+                return False, "bad_magic"
+            full_decode = False
+            if fmt == "jpeg":
+                f.seek(max(size - 1024, 0))
+                tail = f.read().rstrip(b"\x00\r\n ")
+                if not tail.endswith(b"\xff\xd9"):
+                    if Image is None:
+                        # 没有 Pillow 解不了码：EOI 后面跟着多余字节的放过，真截断的判坏
+                        if b"\xff\xd9" not in tail:
+                            return False, "truncated"
+                    else:
+                        full_decode = True
+
+        if full_decode:
+            # 结尾不是 EOI 不一定是截断（有的服务器在 EOI 后追加数据），以完整解码为准
+            if not decode_strict(path):
+                return False, "truncated"
+        elif VERIFY_DECODE and Image is not None and fmt != "avif":
+            with Image.open(path) as img:
+                if fmt == "jpeg":
+                    img.draft("RGB", (img.size[0] // 8 or 1, img.size[1] // 8 or 1))
+                img.load()
+        return True, fmt
+    except Exception as e:
+        return False, f"decode:{type(e).__name__}"
+
+
+def _check_item(item):
+    return check_file(item["file"])
+
+
+# ============================
+# 坏图处理：隔离 + 从记录里去掉 + 重新排队
+# ============================
+
+SOURCE_MODULES = {"tmdb": "TMDB", "mtime": "MTime", "douban": "douban", "maoyan": "maoyan"}
+
+report_lock = threading.Lock()
+stats = {"checked": 0, "corrupt": 0}
+
+
+def requeue(item):
+    """按数据源把坏图从记录里去掉并重新排队；来源不明返回 False"""
+    source = item.get("source")
+    movie_id = item.get("movie_id")
+    key = item.get("key")
+    if source not in SOURCE_MODULES or not movie_id or not key:
+        return False
+    module = importlib.import_module(SOURCE_MODULES[source])
+    if source == "tmdb":
+        module.forget_image(movie_id, key)
+    elif source == "mtime":
+        title = image_store.movie_folder(item["path"])
+        module.forget_mtime_image(movie_id, key, item.get("url", ""), item["path"], title)
+    else:
+        module.forget_photo(movie_id, item.get("url") or key)
+    return True
+
+
+def quarantine(path):
+    """坏图挪到 .corrupt/ 下（douban/猫眼按文件是否存在判断已下载，必须挪走才会重下）"""
+    if not os.path.exists(path):
+        return ""
+    rel = os.path.relpath(path, image_store.SAVE_DIR)
+    dest = os.path.join(CORRUPT_DIR, rel)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.move(path, dest)
+    return dest
+
+
+def handle_corrupt(item, reason):
+    moved = ""
+    if item["file"] == item["path"]:
+        try:
+            moved = quarantine(item["path"])
+        except OSError as e:
+            print(f"⚠ 隔离坏图失败：{item['path']} {e}")
+    try:
+        requeued = requeue(item)
+    except Exception as e:
+        print(f"⚠ 坏图重新排队失败：{item['path']} {e}")
+        requeued = False
+
+    entry = {
+        "path": item["path"],
+        "reason": reason,
+        "source": item.get("source", ""),
+        "movie_id": item.get("movie_id", ""),
+        "key": item.get("key", ""),
+        "moved_to": moved,
+        "requeued": requeued,
+    }
+    with report_lock:
+        stats["corrupt"] += 1
+        with open(CORRUPT_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    print(f"⚠ 坏图（{reason}）：{item['path']}{' → 已重新排队' if requeued else ''}")
+    return entry
+
+
+# ============================
+# 批量扫描：从路径反查数据源和记录里的 key
+# ============================
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def locate(locator, path):
+    source, movie_id, key, url = locator.classify(path)
+    item = {"path": path, "file": path}
+    if source:
+        item.update(source=source, movie_id=movie_id, key=key)
+    if url:
+        item["url"] = url
+    return item
+
+
+def load_verified():
+    data = _read_json(VERIFIED_FILE)
+    return data if isinstance(data, dict) else {}
+
+
+def save_verified(verified):
+    tmp = VERIFIED_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(verified, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, VERIFIED_FILE)
+
+
+# ============================
+# 后台校验 & 批量扫描
+# ============================
+
+_stage = None
+_verified = None  # 批量扫描时记录通过的文件
+
+
+def _on_result(item, result):
+    ok, reason = result
+    stats["checked"] += 1
+    if not ok:
+        handle_corrupt(item, reason)
+    elif _verified is not None:
+        try:
+            st = os.stat(item["file"])
+            rel = os.path.relpath(item["path"], image_store.SAVE_DIR)
+            _verified[rel] = [st.st_size, int(st.st_mtime)]
+        except OSError:
+            pass
+
+
+def _on_image_written(result):
+    if _stage is not None:
+        _stage.submit(
+            {k: result.get(k, "") for k in ("path", "file", "source", "movie_id", "key", "url")}
+        )
+
+
+def get_stage():
+    global _stage
+    if _stage is None:
+        _stage = postprocess.PoolStage("verify", _check_item, _on_result, workers=VERIFY_WORKERS)
+    return _stage
+
+
+def start():
+    if not VERIFY_ENABLED:
+        return False
+    get_stage().start()
+    image_store.add_listener(_on_image_written)
+    return True
+
+
+def stop():
+    image_store.remove_listener(_on_image_written)
+    if _stage is not None:
+        _stage.stop()
+
+
+def scan(root=None, progress=None, recheck=False):
+    """批量校验已有图库；上次扫描通过且大小/mtime 没变的文件跳过（recheck=True 全部重查）"""
+    global _verified
+    root = root or image_store.SAVE_DIR
+    _verified = {} if recheck else load_verified()
+    locator = library_scan.Locator()
+
+    def pending():
+        for path in postprocess.iter_image_files(root):
+            rel = os.path.relpath(path, image_store.SAVE_DIR)
+            seen = _verified.get(rel)
+            if seen:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if seen == [st.st_size, int(st.st_mtime)]:
+                    continue
+            yield locate(locator, path)
+
+    try:
+        done = get_stage().run_bulk(pending(), progress=progress)
+    finally:
+        save_verified(_verified)
+        _verified = None
+    return done
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "scan":
+        dirs = [a for a in sys.argv[2:] if not a.startswith("--")]
+        n = scan(
+            dirs[0] if dirs else None,
+            progress=lambda d: print(f"已检查 {d} 张"),
+            recheck="--recheck" in sys.argv,
+        )
+        print(f"完成：检查 {n} 张，坏图 {stats['corrupt']} 张（详见 {CORRUPT_LOG}）")
+    else:
+        print("用法：python verify.py scan [目录] [--recheck]")
@@ -0,0 +1,47 @@
+"""
+下载流水线的公共小件（TMDB / MTime 共用）
+
+- MovieCountdown：一部电影剩余未完成的图片数，全部完成时回调归档；中途因暂停丢弃过图片的不归档
+- put_until_paused：带背压地放入有界队列，暂停时放弃
+"""
+
+import queue
+import threading
+
+
+class MovieCountdown:
+    """
+    一部电影剩余未完成的图片数，归零时调用 on_finish 归档
+    有图片是被暂停丢弃的（done_one(aborted=True)）时改调 on_abort，下次继续
+    """
+
+    def __init__(self, total, on_finish, on_abort=None):
+        self.remaining = total
+        self.aborted = False
+        self.on_finish = on_finish
+        self.on_abort = on_abort
+        self.lock = threading.Lock()
+
+    def done_one(self, aborted=False):
+        with self.lock:
+            if aborted:
+                self.aborted = True
+            self.remaining -= 1
+            finished = self.remaining == 0
+        if not finished:
+            return
+        if not self.aborted:
+            self.on_finish()
+        elif self.on_abort is not None:
+            self.on_abort()
+
+
+def put_until_paused(q, item, paused):
+    """带背压地放入有界队列；paused() 为真时放弃，返回是否放入成功"""
+    while not paused():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False